@@ -10,10 +10,13 @@ from nmigen_lib.pipe.uart import P_UART
 
 class CaseBender(Elaboratable):
 
-    """Translate lowercase to uppercase, uppercase to lower."""
+    """Translate lowercase to uppercase, uppercase to lower.
 
-    def __init__(self):
-        spec = PipeSpec(8)
+    With `lanes` > 1, every lane of a beat is translated at once.
+    """
+
+    def __init__(self, lanes=1):
+        spec = PipeSpec(8, lanes=lanes)
         self.char_in = spec.outlet()
         self.char_out = spec.inlet()
 
@@ -26,9 +29,12 @@ class CaseBender(Elaboratable):
             return Mux(is_alpha(c), c ^ 0x20, c)
         m.d.comb += [
             self.char_out.o_valid.eq(self.char_in.i_valid),
-            self.char_out.o_data.eq(other_case(self.char_in.i_data)),
             self.char_in.o_ready.eq(self.char_out.i_ready),
         ]
+        for (c_in, c_out) in zip(self.char_in.lanes(), self.char_out.lanes()):
+            m.d.comb += c_out.eq(other_case(c_in))
+        if self.char_in._spec.lanes > 1:
+            m.d.comb += self.char_out.o_lane_valid.eq(self.char_in.i_lane_valid)
         return m
 
 
@@ -0,0 +1,224 @@
+#!/usr/bin/env nmigen
+
+import numbers
+
+import numpy as np
+
+from nmigen import Elaboratable, Module
+
+from nmigen_lib.util import Main
+from nmigen_lib.util.vectors import SignalPacker
+
+"""
+Bus functional models: drive and watch pipes in simulation.
+
+    driver = PipeDriver(design.data_in, beats, gaps=0.25)
+    monitor = PipeMonitor(design.data_out, len(beats), stalls=[0, 1, 1])
+    with Main(design).sim as sim:
+        sim.sync_process(driver.process)
+        sim.sync_process(monitor.process)
+        @sim.sync_process
+        def check():
+            yield from monitor.wait()
+            monitor.check(expected)
+
+`PipeDriver` sends beats into a `PipeOutlet` at up to one per
+clock.  `PipeMonitor` receives beats from a `PipeInlet` into a
+preallocated NumPy array and compares them with the expected beats
+in one vectorized step.
+
+A beat is a row of payload fields, in the order of
+`spec.payload_signals`: `data`, then `data_size`, `stop` and `start`
+if the pipe has them.  A one-dimensional array is just the data;
+the other fields are zero.  `fields` selects other columns.
+
+`gaps` says when the driver holds `valid` low and `stalls` when the
+monitor holds `ready` low.  Either can be a probability, any number
+from 0 to 1, a sequence of booleans that repeats, or a function of
+the cycle number.  Beats can be any iterable of rows or values.
+"""
+
+
+def pattern(spec, seed=0):
+    """Return a function of cycle number for a gap or stall spec."""
+    if spec is None:
+        return lambda cycle: False
+    if callable(spec):
+        return spec
+    if isinstance(spec, numbers.Real):
+        assert 0 <= spec <= 1, f'probability {spec} is not in [0, 1]'
+        rng = np.random.default_rng(seed)
+        return lambda cycle: rng.random() < spec
+    bits = np.asarray(spec, dtype=bool).tolist()
+    return lambda cycle: bits[cycle % len(bits)]
+
+
+class _PipeBFM:
+
+    def __init__(self, end, fields):
+        spec = end._spec
+        assert not spec.credit, 'convert CREDIT pipes to ready/valid first'
+        names = [desc.name for desc in spec.payload_signals]
+        if fields is None:
+            fields = names
+        for name in fields:
+            assert name in names, f'{spec} has no {name} field'
+        self.end = end
+        self.fields = list(fields)
+        descs = {desc.name: desc for desc in spec.payload_signals}
+        self.packer = SignalPacker(end._get_signal(descs[name])
+                                   for name in fields)
+        self.dtype = np.int64 if max(self.packer.widths) < 64 else object
+        (self.valid, self.ready) = (end._get_signal(desc)
+                                    for desc in spec.handshake_signals)
+
+    def _as_rows(self, beats):
+        if not isinstance(beats, np.ndarray):
+            beats = list(beats)
+        beats = np.asarray(beats, dtype=self.dtype)
+        if beats.ndim == 1:
+            rows = np.zeros((len(beats), len(self.fields)), dtype=self.dtype)
+            rows[:, 0] = beats
+            beats = rows
+        assert beats.shape[1] == len(self.fields), (
+            f'beats have {beats.shape[1]} columns, '
+            f'expected {len(self.fields)} {self.fields}')
+        return beats
+
+
+class PipeDriver(_PipeBFM):
+
+    def __init__(self, outlet, beats, *, gaps=None, fields=None, seed=0):
+        super().__init__(outlet, fields)
+        self.beats = self._as_rows(beats)
+        self.gaps = pattern(gaps, seed)
+        self.sent = 0
+
+    def process(self):
+        """Sync process that sends every beat."""
+        packer = self.packer
+        packed = [packer.pack(row) for row in self.beats.tolist()]
+        cycle = 0
+        while self.sent < len(packed):
+            pausing = self.gaps(cycle)
+            yield self.valid.eq(not pausing)
+            yield packer.value.eq(packed[self.sent])
+            yield
+            cycle += 1
+            if not pausing and (yield self.ready):
+                self.sent += 1
+        yield self.valid.eq(False)
+
+
+class PipeMonitor(_PipeBFM):
+
+    def __init__(self, inlet, count, *, stalls=None, fields=None, seed=0):
+        super().__init__(inlet, fields)
+        self.data = np.zeros((count, len(self.fields)), dtype=self.dtype)
+        self.cycles = np.zeros(count, dtype=np.int64)
+        self.stalls = pattern(stalls, seed)
+        self.received = 0
+
+    def process(self):
+        """Sync process that receives `count` beats."""
+        cycle = 0
+        while self.received < len(self.data):
+            stalling = self.stalls(cycle)
+            yield self.ready.eq(not stalling)
+            yield
+            cycle += 1
+            if not stalling and (yield self.valid):
+                packed = yield self.packer.value
+                self.data[self.received] = self.packer.unpack(packed)
+                self.cycles[self.received] = cycle
+                self.received += 1
+        yield self.ready.eq(False)
+
+    def wait(self):
+        """Wait, in a sync process, until every beat has arrived."""
+        while self.received < len(self.data):
+            yield
+        yield
+
+    def check(self, expected, max_reports=10):
+        """Assert that the received beats are `expected`."""
+        expected = self._as_rows(expected)
+        assert len(expected) == len(self.data), (
+            f'expected {len(expected)} beats, monitor holds {len(self.data)}')
+        bad = np.flatnonzero(np.any(self.data != expected, axis=1))
+        if len(bad):
+            lines = [f'beat {i}, cycle {self.cycles[i]}: '
+                     f'got {self.data[i].tolist()}, '
+                     f'expected {expected[i].tolist()}'
+                     for i in bad[:max_reports]]
+            raise AssertionError(
+                f'{len(bad)} of {len(expected)} beats mismatched '
+                f'{self.fields}\n' + '\n'.join(lines))
+
+    def throughput(self):
+        """Beats per clock from the first beat to the last."""
+        if len(self.cycles) < 2:
+            return 1.0
+        return len(self.cycles) / (self.cycles[-1] - self.cycles[0] + 1)
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, START_STOP
+    from nmigen_lib.pipe.fifo import PipeFifo
+
+    spec = PipeSpec(12, flags=START_STOP)
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.bursty = PipeFifo(spec, 16)
+            self.streaming = PipeFifo(spec, 16)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.bursty = self.bursty
+            m.submodules.streaming = self.streaming
+            return m
+
+    design = Top()
+    count = 500
+    rng = np.random.default_rng(1)
+    beats = np.stack([
+        rng.integers(0, 1 << 12, count),        # data
+        np.arange(count) % 5 == 4,              # stop
+        np.arange(count) % 5 == 0,              # start
+    ], axis=1)
+    drivers = [
+        PipeDriver(design.bursty.data_in, beats, gaps=0.3),
+        PipeDriver(design.streaming.data_in, beats[:, 0], gaps=0,
+                   fields=['data']),
+    ]
+    monitors = [
+        PipeMonitor(design.bursty.data_out, count, stalls=[0, 0, 1, 1, 0]),
+        PipeMonitor(design.streaming.data_out, count, fields=['data']),
+    ]
+    for bfm in drivers + monitors:
+        bfm.end.leave_unconnected()
+
+    with Main(design).sim as sim:
+        for bfm in drivers + monitors:
+            sim.sync_process(bfm.process)
+
+        @sim.sync_process
+        def check():
+            for monitor in monitors:
+                yield from monitor.wait()
+            monitors[0].check(beats)
+            monitors[1].check(int(b) for b in beats[:, 0])
+            assert monitors[1].throughput() == 1.0
+            # A wrong expectation is caught and reported.
+            try:
+                monitors[0].check(beats + 1)
+            except AssertionError as e:
+                assert str(e).startswith(f'{count} of {count} beats')
+                assert f'\nbeat 0, cycle {monitors[0].cycles[0]}: ' in str(e)
+            else:
+                assert False, 'mismatch not detected'
+
+    assert not any(pattern(0)(c) for c in range(100))
+    assert all(pattern(1)(c) for c in range(100))
@@ -0,0 +1,235 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Signal
+
+from nmigen_lib.util import Main
+
+from .fifo import PipeFifo
+from .spec import CREDIT, PipeSpec
+
+"""
+Credit-based flow control.
+
+A pipe with the `CREDIT` flag has a `credit` signal in place of
+`ready`.  Every clock `valid` is high is a transfer; the sink can't
+refuse it.  Instead, the source may only send while it holds
+credits.  It starts with none, and the sink returns one credit, a
+one-clock pulse, for each beat of buffer space it has.
+
+`ready` has to make a round trip in the clock it is used, so a
+ready/valid pipe can't cross a link with registers in it without
+losing throughput.  Credits can be as late as they like: if the
+sink's buffer covers the link's round trip, the link still runs at
+one beat per clock.
+
+`CreditSource(spec, max_credits)` turns a ready/valid pipe into a
+credit pipe, and `CreditSink(spec, depth)` turns it back, buffering
+`depth` beats.  `CreditDelay(spec, latency)` is `latency` registers
+in each direction.
+
+    src = CreditSource(spec, 8)
+    link = CreditDelay(src.out_spec, 3)
+    snk = CreditSink(src.out_spec, 8)
+    m.d.comb += [
+        producer.data_out.flow_to(src.data_in),
+        src.data_out.flow_to(link.data_in),
+        link.data_out.flow_to(snk.data_in),
+        snk.data_out.flow_to(consumer.data_in),
+    ]
+
+A 3-register link has a round trip of about 8 clocks, so a depth of
+8 keeps it running at full rate.
+
+The source holds at most `max_credits` at once.  Credits that
+arrive while it is full are dropped, and the sink slots they stand
+for are never used, so a sink deeper than `max_credits` is safe but
+wastes buffer space.  Give the source at least the sink's `depth`.
+"""
+
+
+def credit_spec(spec):
+    """The `CREDIT` flavor of `spec`."""
+    return spec._replace(flags=spec.flags | CREDIT)
+
+def ready_valid_spec(spec):
+    """The ready/valid flavor of `spec`."""
+    return spec._replace(flags=spec.flags & ~CREDIT)
+
+
+def _payload(end):
+    return Cat(*(end._get_signal(desc) for desc in end._spec.payload_signals))
+
+
+class CreditSource(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, in_spec, max_credits):
+        self.in_spec = ready_valid_spec(in_spec)
+        self.out_spec = credit_spec(in_spec)
+        self.max_credits = max_credits
+        self.data_in = self.in_spec.outlet()
+        self.data_out = self.out_spec.inlet()
+        self.o_credits = Signal(range(max_credits + 1))
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        credits = self.o_credits
+        m.d.comb += data_in.o_ready.eq(credits != 0)
+        m.d.sync += data_out.o_valid.eq(data_in.received())
+        with m.If(data_in.received()):
+            m.d.sync += _payload(data_out).eq(_payload(data_in))
+        with m.If(data_in.received() & ~data_out.i_credit):
+            m.d.sync += credits.eq(credits - 1)
+        with m.Elif(data_out.i_credit & ~data_in.received()):
+            # Saturate.  A credit dropped here is a slot in the sink
+            # that is never used, so the link can't overflow it.
+            with m.If(credits != self.max_credits):
+                m.d.sync += credits.eq(credits + 1)
+        return m
+
+
+class CreditSink(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, in_spec, depth):
+        self.in_spec = credit_spec(in_spec)
+        self.out_spec = ready_valid_spec(in_spec)
+        self.depth = depth
+        self.fifo = PipeFifo(self.out_spec, depth)
+        # Driven directly.  Credits guarantee the FIFO has room.
+        self.fifo.data_in.leave_unconnected()
+        self.data_in = self.in_spec.outlet()
+        self.data_out = self.fifo.data_out
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        fifo = self.fifo
+        m.submodules.fifo = fifo
+        m.d.comb += [
+            _payload(fifo.data_in).eq(_payload(data_in)),
+            fifo.data_in.i_valid.eq(data_in.i_valid),
+        ]
+
+        # Credits owed to the source: the whole FIFO at reset, then
+        # one for each beat that leaves it.
+        owed = Signal(range(self.depth + 1), reset=self.depth)
+        pop = fifo.data_out.sent()
+        m.d.sync += data_in.o_credit.eq(owed != 0)
+        with m.If(pop & (owed == 0)):
+            m.d.sync += owed.eq(owed + 1)
+        with m.Elif(~pop & (owed != 0)):
+            m.d.sync += owed.eq(owed - 1)
+        return m
+
+
+class CreditDelay(Elaboratable):
+
+    def __init__(self, spec, latency):
+        assert spec.credit, 'CreditDelay needs a CREDIT pipe'
+        self.spec = spec
+        self.latency = latency
+        self.data_in = spec.outlet()
+        self.data_out = spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        down = Cat(_payload(self.data_in), self.data_in.i_valid)
+        up = self.data_out.i_credit
+        for _ in range(self.latency):
+            down_reg = Signal(len(down))
+            up_reg = Signal()
+            m.d.sync += [
+                down_reg.eq(down),
+                up_reg.eq(up),
+            ]
+            (down, up) = (down_reg, up_reg)
+        m.d.comb += [
+            Cat(_payload(self.data_out), self.data_out.o_valid).eq(down),
+            self.data_in.o_credit.eq(up),
+        ]
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import START_STOP
+    from nmigen_lib.pipe.bfm import PipeDriver, PipeMonitor
+    import numpy as np
+
+    spec = PipeSpec(8, flags=START_STOP)
+
+    class Link(Elaboratable):
+
+        def __init__(self, latency, depth, max_credits=None):
+            self.src = CreditSource(spec, max_credits or depth)
+            self.delay = CreditDelay(self.src.out_spec, latency)
+            self.snk = CreditSink(self.src.out_spec, depth)
+            self.data_in = self.src.data_in
+            self.data_out = self.snk.data_out
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.src = self.src
+            m.submodules.delay = self.delay
+            m.submodules.snk = self.snk
+            m.d.comb += [
+                self.src.data_out.flow_to(self.delay.data_in),
+                self.delay.data_out.flow_to(self.snk.data_in),
+            ]
+            return m
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            # Deep enough for full rate, too shallow, with stalls,
+            # and with fewer credits than the sink's depth.
+            self.links = [Link(3, 16), Link(3, 4), Link(2, 8), Link(3, 16, 4)]
+
+        def elaborate(self, platform):
+            m = Module()
+            for (i, link) in enumerate(self.links):
+                m.submodules[f'link_{i}'] = link
+            return m
+
+    design = Top()
+    count = 300
+    beats = np.stack([
+        np.arange(count) & 0xFF,
+        np.arange(count) % 4 == 3,
+        np.arange(count) % 4 == 0,
+    ], axis=1)
+    drivers = [
+        PipeDriver(design.links[0].data_in, beats),
+        PipeDriver(design.links[1].data_in, beats),
+        PipeDriver(design.links[2].data_in, beats, gaps=0.2),
+        # Idle until the source's credits saturate.
+        PipeDriver(design.links[3].data_in, beats, gaps=lambda c: c < 40),
+    ]
+    monitors = [
+        PipeMonitor(design.links[0].data_out, count),
+        PipeMonitor(design.links[1].data_out, count),
+        PipeMonitor(design.links[2].data_out, count, stalls=0.4),
+        PipeMonitor(design.links[3].data_out, count),
+    ]
+    for bfm in drivers + monitors:
+        bfm.end.leave_unconnected()
+
+    with Main(design).sim as sim:
+        for bfm in drivers + monitors:
+            sim.sync_process(bfm.process)
+
+        @sim.sync_process
+        def check():
+            for monitor in monitors:
+                yield from monitor.wait()
+            for monitor in monitors:
+                monitor.check(beats)
+            # Credits cover the round trip, so the link runs at full
+            # rate.  Four credits don't, even with a deeper sink.
+            assert monitors[0].throughput() == 1.0
+            assert monitors[1].throughput() < 0.6
+            assert monitors[3].throughput() < 0.6
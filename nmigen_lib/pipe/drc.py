@@ -0,0 +1,172 @@
+#!/usr/bin/env nmigen
+
+from typing import NamedTuple
+from warnings import warn, warn_explicit
+
+from nmigen import Elaboratable
+
+from .endpoint import (MisdirectedPipeEnd, PipeInlet, PipeOutlet,
+                       UnconnectedPipeEnd, _PipeEnd)
+
+"""
+Design rule check for pipe ends.
+
+Run it after the design has been elaborated, since that is when
+pipes are connected.
+
+    fragment = Fragment.get(design, platform)
+    for v in check_pipe_ends(design):
+        print(v)
+
+`check_pipe_ends` walks the design once, from the top down through
+attributes that hold `Elaboratable`s, and lists of them, and finds
+every pipe end they hold.  It reports each end that was never
+connected, and each end held by an attribute whose name says the
+wrong direction: an input, `data_in`, `tx_in` or `data_ins`, must
+be a `PipeOutlet`, and an output, `*_out` or `*_outs`, a
+`PipeInlet`.  Ends that are only held in local variables aren't
+found.
+
+`has_pipe_ends` says whether the walk finds any ends at all.
+
+`warn_pipe_ends` issues each violation as a warning
+(`UnconnectedPipeEnd` or `MisdirectedPipeEnd`) at the line where the
+end was created.  `Main` calls it for every design it simulates or
+generates, and doesn't cache the generated code for designs that
+have pipe ends, since the check needs an elaborated design.
+"""
+
+
+class PipeEndViolation(NamedTuple):
+    category: type
+    path: str
+    end: _PipeEnd
+    message: str
+
+    def __str__(self):
+        loc = self.end.creation_loc
+        where = f'{loc[0]}:{loc[1]}: ' if loc else ''
+        return f'{where}{self.path}: {self.message}'
+
+
+def check_pipe_ends(design):
+    """Return a `PipeEndViolation` for each bad pipe end in `design`."""
+    violations = []
+    reported = set()
+    for (path, attr, end) in _walk(design):
+        if not end._connected and id(end) not in reported:
+            reported.add(id(end))
+            violations.append(PipeEndViolation(
+                UnconnectedPipeEnd, path, end,
+                f'{type(end).__name__} was never connected'))
+        want = _direction(attr)
+        if want is not None and not isinstance(end, want):
+            violations.append(PipeEndViolation(
+                MisdirectedPipeEnd, path, end,
+                f'{attr} should be a {want.__name__}, '
+                f'not a {type(end).__name__}'))
+    return violations
+
+
+def warn_pipe_ends(design):
+    """Warn about each bad pipe end in `design`.  Returns how many."""
+    violations = check_pipe_ends(design)
+    for v in violations:
+        message = f'{v.path}: {v.message}'
+        loc = v.end.creation_loc
+        if loc:
+            warn_explicit(message, v.category, loc[0], loc[1])
+        else:
+            warn(message, v.category)
+    return len(violations)
+
+
+def has_pipe_ends(design):
+    """Return True if `design` holds any pipe ends."""
+    return next(_walk(design), None) is not None
+
+
+def _walk(design):
+    # Yield (path, attribute name, end) for every end reachable
+    # from `design`.
+    seen = set()
+    stack = [('top', design)]
+    while stack:
+        (path, obj) = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        # Objects with only `__slots__` have no `vars()`.
+        for (attr, value) in getattr(obj, '__dict__', {}).items():
+            if isinstance(value, (list, tuple)):
+                items = [(f'{attr}[{k}]', v) for (k, v) in enumerate(value)]
+            elif isinstance(value, dict):
+                items = [(f'{attr}[{k!r}]', v) for (k, v) in value.items()]
+            else:
+                items = [(attr, value)]
+            for (name, v) in items:
+                if isinstance(v, _PipeEnd):
+                    yield (f'{path}.{name}', attr, v)
+                elif isinstance(v, Elaboratable):
+                    stack.append((f'{path}.{name}', v))
+
+def _direction(attr):
+    name = attr.rstrip('s')
+    if name.endswith('_in'):
+        return PipeOutlet
+    if name.endswith('_out'):
+        return PipeInlet
+    return None
+
+
+if __name__ == '__main__':
+    import linecache
+    from nmigen import Fragment, Module
+    from nmigen_lib.pipe import PipeSpec
+    from nmigen_lib.pipe.endpoint import capture_src_locs
+    from nmigen_lib.pipe.skid import SkidBuffer
+
+    spec = PipeSpec(8)
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.stages = [SkidBuffer(spec) for _ in range(3)]
+            self.data_in = self.stages[0].data_in
+            self.data_out = spec.outlet()       # wrong direction
+            self.spare = spec.inlet()           # never connected
+
+        def elaborate(self, platform):
+            m = Module()
+            for (i, stage) in enumerate(self.stages):
+                m.submodules[f'stage_{i}'] = stage
+            m.d.comb += [
+                self.stages[0].data_out.flow_to(self.stages[1].data_in),
+                self.stages[1].data_out.flow_to(self.stages[2].data_in),
+                self.stages[2].data_out.flow_to(self.data_out),
+            ]
+            return m
+
+    design = Top()
+    design.data_in.leave_unconnected()
+    Fragment.get(design, None)
+    violations = check_pipe_ends(design)
+    assert {(v.category, v.path) for v in violations} == {
+        (MisdirectedPipeEnd, 'top.data_out'),
+        (UnconnectedPipeEnd, 'top.spare'),
+    } and len(violations) == 2, violations
+    spare = next(v for v in violations if v.path == 'top.spare')
+    (filename, lineno) = spare.end.creation_loc
+    assert filename == __file__
+    assert 'self.spare = spec.inlet()' in linecache.getline(filename, lineno)
+    assert str(spare) == (f'{filename}:{lineno}: '
+                          'top.spare: PipeInlet was never connected')
+
+    # Without source locations, violations are still found.
+    capture_src_locs(False)
+    unlocated = spec.inlet()
+    capture_src_locs(True)
+    assert unlocated.creation_loc is None
+    design.spare = unlocated
+    spare = next(v for v in check_pipe_ends(design) if v.path == 'top.spare')
+    assert str(spare) == 'top.spare: PipeInlet was never connected'
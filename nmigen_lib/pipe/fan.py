@@ -0,0 +1,213 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Array, Cat, Elaboratable, Module, Signal
+
+from nmigen_lib.util import Main, delay
+
+"""
+Fan-out and fan-in for pipes.
+
+`Broadcast(spec, n)` copies every beat from `data_in` to each of the
+`n` inlets in `data_outs`.  Each branch takes the beat when it is
+ready; a branch that has taken it waits, and the beat is released
+upstream once every branch has it.  A slow branch stalls the others
+by at most one beat; put a `PipeFifo` in front of it to absorb more.
+
+`RoundRobinArbiter(spec, n)` merges the `n` outlets in `data_ins`
+into `data_out`.  Inputs with data take turns, starting after the
+one that sent last.  With `lock_packets` (the default for
+`START_STOP` pipes), an input keeps the grant from a packet's first
+beat until its `stop`, so packets are never interleaved.
+
+Both pass one beat per clock.  Their handshakes are
+combinatorial, like `CaseBender`'s; add a `SkidBuffer` to break them.
+"""
+
+
+class Broadcast(Elaboratable):
+
+    def __init__(self, spec, n):
+        self.spec = spec
+        self.n = n
+        self.data_in = spec.outlet()
+        self.data_outs = [spec.inlet() for _ in range(n)]
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        done = Signal(self.n)       # branches that have this beat
+        for (k, out) in enumerate(self.data_outs):
+            m.d.comb += [
+                out._get_signal(desc).eq(data_in._get_signal(desc))
+                for desc in self.spec.payload_signals
+            ]
+            m.d.comb += out.o_valid.eq(data_in.i_valid & ~done[k])
+        m.d.comb += data_in.o_ready.eq(
+            (done | Cat(out.i_ready for out in self.data_outs)).all()
+        )
+        with m.If(data_in.received()):
+            m.d.sync += done.eq(0)
+        with m.Else():
+            m.d.sync += done.eq(done | Cat(out.sent()
+                                           for out in self.data_outs))
+        return m
+
+
+class RoundRobinArbiter(Elaboratable):
+
+    def __init__(self, spec, n, *, lock_packets=None):
+        if lock_packets is None:
+            lock_packets = spec.start_stop
+        assert spec.start_stop or not lock_packets, (
+            'lock_packets needs a START_STOP pipe'
+        )
+        self.spec = spec
+        self.n = n
+        self.lock_packets = lock_packets
+        self.data_ins = [spec.outlet() for _ in range(n)]
+        self.data_out = spec.inlet()
+        self.o_grant = Signal(range(n))
+
+    def elaborate(self, platform):
+        m = Module()
+        n = self.n
+        data_out = self.data_out
+        valids = Cat(d.i_valid for d in self.data_ins)
+        last = Signal(range(n))     # last input to send
+        locked = Signal()           # last is mid-packet
+        chosen = Signal(range(n))
+
+        # Pick the first valid input after `last`.
+        with m.Switch(last):
+            for l in range(n):
+                with m.Case(l):
+                    for (j, k) in enumerate((l + i) % n
+                                            for i in range(1, n + 1)):
+                        with (m.If if j == 0 else m.Elif)(valids[k]):
+                            m.d.comb += chosen.eq(k)
+        with m.If(locked):
+            m.d.comb += self.o_grant.eq(last)
+        with m.Else():
+            m.d.comb += self.o_grant.eq(chosen)
+
+        grant = self.o_grant
+        for desc in self.spec.payload_signals:
+            sigs = Array(d._get_signal(desc) for d in self.data_ins)
+            m.d.comb += data_out._get_signal(desc).eq(sigs[grant])
+        m.d.comb += data_out.o_valid.eq(valids.bit_select(grant, 1))
+        for (k, d) in enumerate(self.data_ins):
+            m.d.comb += d.o_ready.eq(data_out.i_ready & (grant == k))
+
+        with m.If(data_out.sent()):
+            m.d.sync += last.eq(grant)
+            if self.lock_packets:
+                m.d.sync += locked.eq(~data_out.o_stop)
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, START_STOP
+
+    spec = PipeSpec(8, flags=START_STOP)
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.bcast = Broadcast(spec, 3)
+            self.arb = RoundRobinArbiter(spec, 3)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.bcast = self.bcast
+            m.submodules.arb = self.arb
+            return m
+
+    design = Top()
+    ends = [design.bcast.data_in, design.arb.data_out]
+    ends += design.bcast.data_outs + design.arb.data_ins
+    for end in ends:
+        end.leave_unconnected()
+
+    def sender(data_in, beats, gaps=lambda cycle: False):
+        # Send (data, start, stop) beats.
+        def send():
+            n = 0
+            cycle = 0
+            while n < len(beats):
+                (data, start, stop) = beats[n]
+                pausing = gaps(cycle)
+                yield data_in.i_valid.eq(not pausing)
+                yield data_in.i_data.eq(data)
+                yield data_in.i_start.eq(start)
+                yield data_in.i_stop.eq(stop)
+                yield
+                cycle += 1
+                if not pausing and (yield data_in.o_ready):
+                    n += 1
+            yield data_in.i_valid.eq(False)
+        return send
+
+    def receiver(data_out, count, stalls=lambda cycle: False, got=None):
+        # Receive `count` beats into `got`.
+        def receive():
+            cycle = 0
+            while len(got) < count:
+                stalling = stalls(cycle)
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield data_out.o_valid):
+                    got.append(((yield data_out.o_data),
+                                bool((yield data_out.o_start)),
+                                bool((yield data_out.o_stop))))
+            yield data_out.i_ready.eq(False)
+        return receive
+
+    def packets(base, count, length):
+        return [(base + p * length + i, i == 0, i == length - 1)
+                for p in range(count)
+                for i in range(length)]
+
+    with Main(design).sim as sim:
+        # Broadcast: every branch gets every beat, whatever its stalls.
+        beats = packets(0, 20, 3)
+        stall_patterns = [
+            lambda cycle: False,
+            lambda cycle: cycle % 5 == 2,
+            lambda cycle: 10 <= cycle < 30,
+        ]
+        b_got = [[] for _ in range(3)]
+        sim.sync_process(sender(design.bcast.data_in, beats))
+        for (out, stalls, got) in zip(design.bcast.data_outs,
+                                      stall_patterns, b_got):
+            sim.sync_process(receiver(out, len(beats), stalls, got))
+
+        # Arbiter: packets from three senders are not interleaved.
+        sources = [packets(100 * k, 8, k + 2) for k in range(3)]
+        a_got = []
+        for (data_in, source) in zip(design.arb.data_ins, sources):
+            sim.sync_process(sender(data_in, source))
+        total = sum(len(s) for s in sources)
+        sim.sync_process(receiver(design.arb.data_out, total,
+                                  lambda cycle: cycle % 7 == 3, a_got))
+
+        @sim.sync_process
+        def check():
+            yield from delay(200)
+            for got in b_got:
+                assert got == beats, f'broadcast got {got}'
+            # Split into packets, then by source.
+            packets_out = []
+            for beat in a_got:
+                if beat[1]:
+                    packets_out.append([])
+                packets_out[-1].append(beat)
+            by_source = [[] for _ in sources]
+            for packet in packets_out:
+                k = packet[0][0] // 100
+                assert packet[-1][2], f'packet {packet} has no stop'
+                by_source[k] += packet
+            assert by_source == sources
+            # Fair: the first three packets come from different sources.
+            firsts = {packet[0][0] // 100 for packet in packets_out[:3]}
+            assert firsts == {0, 1, 2}, f'unfair order {packets_out[:3]}'
@@ -0,0 +1,357 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Array, Cat, ClockDomain, Elaboratable, Memory, Module, Mux
+from nmigen import Signal
+from nmigen.lib.cdc import FFSynchronizer
+
+from nmigen_lib.util import Main, delay
+
+"""
+PipeFifo -- a synchronous FIFO between two pipe stages.
+
+    fifo = PipeFifo(spec, depth=64)
+    m.d.comb += [
+        upstream.data_out.flow_to(fifo.data_in),
+        fifo.data_out.flow_to(downstream.data_in),
+    ]
+
+`data_in` is a `PipeOutlet` and `data_out` is a `PipeInlet`, both of
+`spec`.  Every payload signal -- data, data_size, start and stop --
+passes through the FIFO.  `o_level` is the number of entries in the
+FIFO.
+
+Small FIFOs are built from registers; FIFOs deeper than
+`MAX_REGISTER_DEPTH` use a `Memory`, which becomes block RAM.  Either
+way, the FIFO accepts and delivers one transfer per clock as long as
+it is neither full nor empty.  A depth-1 FIFO can't accept while it
+is full, so it only runs at half rate.
+
+`data_in.o_ready` and `data_out.o_valid` are registered, so the FIFO
+also breaks the combinatorial paths between its neighbors.  The
+register FIFO's latency is one clock; the memory FIFO's is two.
+
+PipeAsyncFifo -- a FIFO between two clock domains.
+
+    fifo = PipeAsyncFifo(spec, depth=16, in_domain='sync', out_domain='pll')
+
+`data_in` is in `in_domain` and `data_out` is in `out_domain`.  The
+FIFO is a dual-port `Memory` with Gray-coded pointers, which are
+passed between the domains through two-flop synchronizers.  `depth`
+must be a power of two.  Each side runs at one transfer per clock of
+its own domain; the other side sees a transfer a few clocks later.
+Reset both domains together.
+"""
+
+MAX_REGISTER_DEPTH = 8
+
+
+class PipeFifo(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, spec, depth, *, use_memory=None):
+        assert depth >= 1, f'PipeFifo depth must be positive, not {depth}'
+        if use_memory is None:
+            use_memory = depth > MAX_REGISTER_DEPTH
+        self.spec = spec
+        self.depth = depth
+        self.use_memory = use_memory
+
+        self.data_in = spec.outlet()
+        self.data_out = spec.inlet()
+        self.o_level = Signal(range(depth + 1))
+        self.data_in.o_ready.reset = 1     # empty at reset
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        in_word = Cat(*(data_in._get_signal(desc)
+                        for desc in self.spec.payload_signals))
+        out_word = Cat(*(data_out._get_signal(desc)
+                         for desc in self.spec.payload_signals))
+
+        push = Signal()
+        pop = Signal()
+        m.d.comb += [
+            push.eq(data_in.received()),
+            pop.eq(data_out.sent()),
+        ]
+        with m.If(push & ~pop):
+            m.d.sync += self.o_level.eq(self.o_level + 1)
+        with m.Elif(pop & ~push):
+            m.d.sync += self.o_level.eq(self.o_level - 1)
+        # Ready unless full.  The level can't change between the
+        # next two edges, so this is the same as `self.o_level !=
+        # depth`, but registered.
+        with m.If(push & ~pop):
+            m.d.sync += data_in.o_ready.eq(self.o_level != self.depth - 1)
+        with m.Elif(pop):
+            m.d.sync += data_in.o_ready.eq(True)
+
+        if self.use_memory:
+            self._elaborate_memory(m, in_word, out_word, push, pop)
+        else:
+            self._elaborate_registers(m, in_word, out_word, push, pop)
+        return m
+
+    def _elaborate_registers(self, m, in_word, out_word, push, pop):
+        depth = self.depth
+        regs = Array(Signal(len(in_word), name=f'entry_{i}')
+                     for i in range(depth))
+        w_index = Signal(range(depth))
+        r_index = Signal(range(depth))
+        with m.If(push):
+            m.d.sync += [
+                regs[w_index].eq(in_word),
+                w_index.eq(_next_index(w_index, depth)),
+            ]
+        with m.If(pop):
+            m.d.sync += r_index.eq(_next_index(r_index, depth))
+        with m.If(push & ~pop):
+            m.d.sync += self.data_out.o_valid.eq(True)
+        with m.Elif(pop & ~push):
+            m.d.sync += self.data_out.o_valid.eq(self.o_level != 1)
+        m.d.comb += out_word.eq(regs[r_index])
+
+    def _elaborate_memory(self, m, in_word, out_word, push, pop):
+        # The memory's read port feeds the output directly.  An
+        # entry is read into it as soon as the output is empty or
+        # being consumed, so the memory holds everything but the
+        # head of the queue.
+        depth = self.depth
+        mem = Memory(width=len(in_word), depth=depth)
+        m.submodules.w_port = w_port = mem.write_port()
+        m.submodules.r_port = r_port = mem.read_port(transparent=False)
+        w_index = Signal(range(depth))
+        r_index = Signal(range(depth))
+        stored = Signal(range(depth + 1))   # written, not yet read
+        load = Signal()
+        m.d.comb += [
+            w_port.addr.eq(w_index),
+            w_port.data.eq(in_word),
+            w_port.en.eq(push),
+            load.eq((stored != 0) & (~self.data_out.o_valid | pop)),
+            r_port.addr.eq(r_index),
+            r_port.en.eq(load),
+            out_word.eq(r_port.data),
+        ]
+        with m.If(push):
+            m.d.sync += w_index.eq(_next_index(w_index, depth))
+        with m.If(load):
+            m.d.sync += r_index.eq(_next_index(r_index, depth))
+        with m.If(push & ~load):
+            m.d.sync += stored.eq(stored + 1)
+        with m.Elif(load & ~push):
+            m.d.sync += stored.eq(stored - 1)
+        with m.If(load):
+            m.d.sync += self.data_out.o_valid.eq(True)
+        with m.Elif(pop):
+            m.d.sync += self.data_out.o_valid.eq(False)
+
+
+class PipeAsyncFifo(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, spec, depth, *, in_domain, out_domain):
+        assert depth >= 2 and depth & (depth - 1) == 0, (
+            f'PipeAsyncFifo depth must be a power of two, not {depth}'
+        )
+        self.spec = spec
+        self.depth = depth
+        self.in_domain = in_domain
+        self.out_domain = out_domain
+
+        self.data_in = spec.outlet()
+        self.data_out = spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        in_word = Cat(*(data_in._get_signal(desc)
+                        for desc in self.spec.payload_signals))
+        out_word = Cat(*(data_out._get_signal(desc)
+                         for desc in self.spec.payload_signals))
+        w_sync = m.d[self.in_domain]
+        r_sync = m.d[self.out_domain]
+
+        # Pointers have one more bit than the address to tell full
+        # from empty.
+        ptr_bits = (self.depth - 1).bit_length() + 1
+        w_bin = Signal(ptr_bits)
+        w_gray = Signal(ptr_bits)
+        r_gray_w = Signal(ptr_bits)     # r_gray in write domain
+        r_bin = Signal(ptr_bits)
+        r_gray = Signal(ptr_bits)
+        w_gray_r = Signal(ptr_bits)     # w_gray in read domain
+        m.submodules.w_gray_sync = FFSynchronizer(
+            w_gray, w_gray_r, o_domain=self.out_domain)
+        m.submodules.r_gray_sync = FFSynchronizer(
+            r_gray, r_gray_w, o_domain=self.in_domain)
+
+        mem = Memory(width=len(in_word), depth=self.depth)
+        m.submodules.w_port = w_port = mem.write_port(domain=self.in_domain)
+        m.submodules.r_port = r_port = mem.read_port(
+            domain=self.out_domain, transparent=False)
+
+        # Write side: full when the pointers differ only in their
+        # top two bits, which in Gray code is a full lap.
+        push = Signal()
+        w_bin_next = Signal(ptr_bits)
+        full_gray = r_gray_w ^ (0b11 << (ptr_bits - 2))
+        m.d.comb += [
+            data_in.o_ready.eq(w_gray != full_gray),
+            push.eq(data_in.received()),
+            w_bin_next.eq(w_bin + push),
+            w_port.addr.eq(w_bin[:-1]),
+            w_port.data.eq(in_word),
+            w_port.en.eq(push),
+        ]
+        w_sync += [
+            w_bin.eq(w_bin_next),
+            w_gray.eq(_gray(w_bin_next)),
+        ]
+
+        # Read side: like `PipeFifo`'s memory version, the read port
+        # feeds `data_out` directly.
+        load = Signal()
+        r_bin_next = Signal(ptr_bits)
+        m.d.comb += [
+            load.eq((r_gray != w_gray_r) &
+                    (~data_out.o_valid | data_out.sent())),
+            r_bin_next.eq(r_bin + load),
+            r_port.addr.eq(r_bin[:-1]),
+            r_port.en.eq(load),
+            out_word.eq(r_port.data),
+        ]
+        r_sync += [
+            r_bin.eq(r_bin_next),
+            r_gray.eq(_gray(r_bin_next)),
+        ]
+        with m.If(load):
+            r_sync += data_out.o_valid.eq(True)
+        with m.Elif(data_out.sent()):
+            r_sync += data_out.o_valid.eq(False)
+        return m
+
+
+def _gray(n):
+    return n ^ (n >> 1)
+
+def _next_index(index, depth):
+    if depth & (depth - 1) == 0:
+        return index + 1        # wraps by itself
+    return Mux(index == depth - 1, 0, index + 1)
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, DATA_SIZE, START_STOP
+
+    spec = PipeSpec(8, flags=DATA_SIZE | START_STOP)
+
+    class Top(Elaboratable):
+
+        def __init__(self, depths):
+            self.fifos = [PipeFifo(spec, depth) for depth in depths]
+            self.async_fifos = [
+                PipeAsyncFifo(spec, 4, in_domain='sync', out_domain='fast'),
+                PipeAsyncFifo(spec, 16, in_domain='fast', out_domain='sync'),
+            ]
+
+        def elaborate(self, platform):
+            m = Module()
+            m.domains.fast = ClockDomain('fast')
+            for (i, fifo) in enumerate(self.fifos + self.async_fifos):
+                m.submodules[f'fifo_{i}'] = fifo
+            return m
+
+    depths = (1, 3, 13, 32)
+    design = Top(depths + depths)
+    for fifo in design.fifos + design.async_fifos:
+        fifo.data_in.leave_unconnected()
+        fifo.data_out.leave_unconnected()
+    bursty = design.fifos[:len(depths)]
+    streaming = design.fifos[len(depths):]
+
+    def sender(fifo, count, gaps=()):
+        # Send `count` bytes in 4-byte packets, pausing on cycles in `gaps`.
+        def send():
+            data_in = fifo.data_in
+            n = 0
+            cycle = 0
+            while n < count:
+                pausing = cycle in gaps
+                yield data_in.i_valid.eq(not pausing)
+                yield data_in.i_data.eq(n & 0xFF)
+                yield data_in.i_data_size.eq(n % 9)
+                yield data_in.i_start.eq(n % 4 == 0)
+                yield data_in.i_stop.eq(n % 4 == 3)
+                yield
+                cycle += 1
+                if not pausing and (yield data_in.o_ready):
+                    n += 1
+            yield data_in.i_valid.eq(False)
+        return send
+
+    def receiver(fifo, count, stalls=(), min_rate=None):
+        # Receive `count` bytes, stalling on cycles in `stalls`.
+        def receive():
+            data_out = fifo.data_out
+            n = 0
+            cycle = 0
+            first = None
+            while n < count:
+                stalling = cycle in stalls
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield data_out.o_valid):
+                    if first is None:
+                        first = cycle
+                    data = yield data_out.o_data
+                    assert data == n & 0xFF, (
+                        f'depth {fifo.depth}: got {data:#x}, wanted {n:#x}')
+                    assert (yield data_out.o_data_size) == n % 9
+                    assert (yield data_out.o_start) == (n % 4 == 0)
+                    assert (yield data_out.o_stop) == (n % 4 == 3)
+                    n += 1
+            if min_rate is not None:
+                rate = count / (cycle - first + 1)
+                assert rate >= min_rate, (
+                    f'depth {fifo.depth}: {rate:.2f} transfers/clock')
+        return receive
+
+    with Main(design).sim as sim:
+        sim.add_clock(1e-6, domain='sync')
+        sim.add_clock(0.37e-6, domain='fast')
+        gaps = {3, 4, 20, 21, 22, 50}
+        stalls = set(range(10, 30)) | {40, 41, 60, 61, 62, 63}
+        for fifo in bursty:
+            # Bursty traffic with backpressure.
+            sim.sync_process(sender(fifo, 100, gaps))
+            sim.sync_process(receiver(fifo, 100, stalls))
+        for fifo in streaming:
+            # Streaming runs at full rate, except at depth 1.
+            rate = 1.0 if fifo.depth > 1 else 0.5
+            sim.sync_process(sender(fifo, 100))
+            sim.sync_process(receiver(fifo, 100, min_rate=rate))
+        for fifo in design.async_fifos:
+            # Slow to fast, then fast to slow.
+            sim.sync_process(sender(fifo, 100, gaps), fifo.in_domain)
+            sim.sync_process(receiver(fifo, 100, stalls), fifo.out_domain)
+
+        @sim.sync_process
+        def check_level():
+            for _ in range(300):
+                for fifo in design.fifos:
+                    level = yield fifo.o_level
+                    assert level <= fifo.depth, (
+                        f'level {level} > {fifo.depth}')
+                yield
+            for fifo in design.fifos + design.async_fifos:
+                assert (yield fifo.data_in.o_ready)
+                assert not (yield fifo.data_out.o_valid)
+            for fifo in design.fifos:
+                assert (yield fifo.o_level) == 0
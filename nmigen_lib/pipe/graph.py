@@ -0,0 +1,295 @@
+#!/usr/bin/env nmigen
+
+from collections import Counter
+
+from nmigen import Elaboratable, Memory, Module
+
+from nmigen_lib.util import Main
+
+from .endpoint import PipeInlet, PipeOutlet, _PipeEnd
+from .spec import CREDIT, DATA_SIZE, START_STOP
+
+"""
+PipeGraph -- build a design from explicitly connected stages.
+
+    g = PipeGraph()
+    uart = g.add('uart', P_UART(divisor))
+    bender = g.add('bender', CaseBender())
+    g.connect(uart.rx_out, bender.char_in)
+    g.connect(bender.char_out, uart.tx_in)
+    m.submodules.graph = g
+
+`add` makes a stage a node of the graph and a submodule of it.  A
+node's ports are the pipe ends among its attributes, found once
+when it is added.  An attribute holding a list of ends, like
+`Broadcast.data_outs`, gives ports `data_outs[0]`, `data_outs[1]`,
+and so on.  `connect(inlet, outlet)` adds an edge from one node's
+`PipeInlet` to another's `PipeOutlet`.  Mark ports that the
+enclosing design connects with `external`.
+
+When the graph is elaborated, `check` looks at the whole thing
+first and raises one `ValueError` listing every problem:
+
+  * ports that are neither connected nor external,
+  * ports connected more than once,
+  * edges that run the wrong way or to ends of no node,
+  * edges between pipes with different specs,
+  * combinatorial `ready` loops.
+
+A stage whose `ready` signals come straight from registers sets the
+class attribute `registered_ready`, as `SkidBuffer` and `PipeFifo`
+do.  Any other stage may pass `ready` through from its inlets to
+its outlets, so a cycle of edges through only such stages is a
+loop.  `CREDIT` pipes have no `ready`, so their edges break loops.
+
+`to_dot()` returns the graph in Graphviz DOT format.
+"""
+
+
+class PipeGraph(Elaboratable):
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+        self._ports = {}        # id(end) -> (node, port, end)
+        self._external = set()  # id(end)
+        self._joined = set()    # id(end), connected by elaborate
+
+    def add(self, name, stage):
+        """Add `stage` as node `name`.  Returns `stage`."""
+        assert name not in self.nodes, f'duplicate node name {name!r}'
+        self.nodes[name] = stage
+        for (port, end) in _find_ports(stage):
+            self._ports.setdefault(id(end), (name, port, end))
+        return stage
+
+    def connect(self, inlet, outlet):
+        """Send data from `inlet`, a node's output, to `outlet`."""
+        self.edges.append((inlet, outlet))
+
+    def external(self, *ends):
+        """Mark ports that are connected outside the graph."""
+        self._external.update(id(end) for end in ends)
+
+    def port_name(self, end):
+        (node, port, _) = self._ports.get(id(end), (None, None, None))
+        if node is None:
+            return repr(end)
+        return f'{node}.{port}'
+
+    def problems(self):
+        """Return a list of everything wrong with the graph."""
+        problems = []
+        uses = Counter()
+        for (inlet, outlet) in self.edges:
+            edge = f'{self.port_name(inlet)} -> {self.port_name(outlet)}'
+            for end in (inlet, outlet):
+                if id(end) not in self._ports:
+                    problems.append(f'{edge}: {end!r} is not a port of a node')
+                uses[id(end)] += 1
+            if not (isinstance(inlet, PipeInlet)
+                    and isinstance(outlet, PipeOutlet)):
+                problems.append(
+                    f'{edge}: edges run from a PipeInlet to a PipeOutlet')
+            elif inlet._spec != outlet._spec:
+                problems.append(f'{edge}: spec mismatch, '
+                                f'{inlet._spec} and {outlet._spec}')
+        for (key, (node, port, end)) in self._ports.items():
+            name = f'{node}.{port}'
+            outside = key in self._external or (
+                end._connected and key not in self._joined
+            )
+            if uses[key] > 1:
+                problems.append(f'{name} is connected {uses[key]} times')
+            elif uses[key] and outside:
+                problems.append(f'{name} is also connected outside the graph')
+            elif not uses[key] and not outside:
+                problems.append(f'{name} is not connected')
+        for loop in self._ready_loops():
+            problems.append(f'combinatorial ready loop: {" -> ".join(loop)}')
+        return problems
+
+    def check(self):
+        """Raise `ValueError` if the graph has problems."""
+        problems = self.problems()
+        if problems:
+            raise ValueError('bad pipe graph:\n  ' + '\n  '.join(problems))
+
+    def _ready_loops(self):
+        succ = {name: [] for name in self.nodes}
+        for (inlet, outlet) in self.edges:
+            src = self._ports.get(id(inlet))
+            dst = self._ports.get(id(outlet))
+            if src and dst and not inlet._spec.credit:
+                succ[src[0]].append(dst[0])
+        comb = {
+            name
+            for (name, stage) in self.nodes.items()
+            if not getattr(stage, 'registered_ready', False)
+        }
+        loops = []
+        state = {}
+        path = []
+
+        def visit(name):
+            state[name] = 'active'
+            path.append(name)
+            for s in succ[name]:
+                if s not in comb:
+                    continue
+                if state.get(s) == 'active':
+                    loops.append(path[path.index(s):] + [s])
+                elif s not in state:
+                    visit(s)
+            path.pop()
+            state[name] = 'done'
+
+        for name in self.nodes:
+            if name in comb and name not in state:
+                visit(name)
+        return loops
+
+    def to_dot(self, name='pipes'):
+        """Return the graph in Graphviz DOT format."""
+        lines = [f'digraph "{name}" {{', '    rankdir=LR;']
+        for (node, stage) in self.nodes.items():
+            style = ''
+            if getattr(stage, 'registered_ready', False):
+                style = ', style=bold'
+            lines.append(f'    "{node}" [shape=box, '
+                         f'label="{node}\\n{type(stage).__name__}"{style}];')
+        for (inlet, outlet) in self.edges:
+            (src, src_port, _) = self._ports.get(id(inlet), ('?', '?', None))
+            (dst, dst_port, _) = self._ports.get(id(outlet), ('?', '?', None))
+            lines.append(f'    "{src}" -> "{dst}" [label="{_label(inlet._spec)}", '
+                         f'taillabel="{src_port}", headlabel="{dst_port}"];')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def elaborate(self, platform):
+        self.check()
+        m = Module()
+        for (name, stage) in self.nodes.items():
+            m.submodules[name] = stage
+        for (inlet, outlet) in self.edges:
+            m.d.comb += inlet.flow_to(outlet)
+            self._joined.update((id(inlet), id(outlet)))
+        return m
+
+
+def _find_ports(stage):
+    for (attr, value) in vars(stage).items():
+        if isinstance(value, _PipeEnd):
+            yield (attr, value)
+        elif isinstance(value, (list, tuple)):
+            for (k, v) in enumerate(value):
+                if isinstance(v, _PipeEnd):
+                    yield (f'{attr}[{k}]', v)
+
+def _label(spec):
+    words = [str(spec.lane_width)]
+    if spec.lanes > 1:
+        words[0] += f'x{spec.lanes}'
+    for (flag, name) in ((DATA_SIZE, 'DATA_SIZE'),
+                         (START_STOP, 'START_STOP'),
+                         (CREDIT, 'CREDIT')):
+        if spec.flags & flag:
+            words.append(name)
+    return ' '.join(words)
+
+
+if __name__ == '__main__':
+    from nmigen import Fragment, Mux
+    from nmigen_lib.pipe import PipeSpec
+    from nmigen_lib.pipe.fan import Broadcast, RoundRobinArbiter
+    from nmigen_lib.pipe.memory import MemoryReader, MemoryWriter
+    from nmigen_lib.pipe.simple import LogicStage
+    from nmigen_lib.pipe.skid import SkidBuffer
+
+    spec = PipeSpec(8)
+
+    def upper_case(i, o):
+        is_lower = (ord('a') <= i) & (i <= ord('z'))
+        return o.eq(Mux(is_lower, i - 0x20, i))
+
+    # A broken graph.  Every problem is reported at once.
+    bad = PipeGraph()
+    a = bad.add('a', SkidBuffer(spec))
+    b = bad.add('b', LogicStage(upper_case, spec, spec))
+    c = bad.add('c', LogicStage(upper_case, spec, spec))
+    d = bad.add('d', SkidBuffer(PipeSpec(9)))
+    e = bad.add('e', SkidBuffer(spec))
+    bad.connect(b.data_out, c.data_in)
+    bad.connect(c.data_out, b.data_in)
+    bad.connect(a.data_out, b.data_in)
+    bad.connect(a.data_out, d.data_in)
+    bad.connect(e.data_in, e.data_out)
+    bad.external(d.data_out)
+    problems = bad.problems()
+    for expected in [
+        'a.data_in is not connected',
+        'a.data_out is connected 2 times',
+        'b.data_in is connected 2 times',
+        'a.data_out -> d.data_in: spec mismatch',
+        'e.data_in -> e.data_out: edges run from a PipeInlet to a PipeOutlet',
+        'combinatorial ready loop: b -> c -> b',
+    ]:
+        assert any(p.startswith(expected) for p in problems), (
+            f'{expected!r} not in {problems}'
+        )
+    assert len(problems) == 6, problems
+    try:
+        Fragment.get(bad, None)
+    except ValueError as e:
+        assert str(e).count('\n') == 6
+    else:
+        assert False, 'bad graph elaborated'
+    for (_, _, end) in bad._ports.values():
+        end.leave_unconnected()
+    for stage in bad.nodes.values():
+        Fragment.get(stage, None)       # so nMigen doesn't warn
+
+    # A good one: upper and lower case copies of some text, merged
+    # and captured.
+    text = b'Pipe Graph'
+    design = PipeGraph()
+    reader = design.add('reader', MemoryReader(spec, init=text))
+    bcast = design.add('bcast', Broadcast(spec, 2))
+    upper = design.add('upper', LogicStage(upper_case, spec, spec))
+    skid = design.add('skid', SkidBuffer(spec))
+    arb = design.add('arb', RoundRobinArbiter(spec, 2))
+    ram = Memory(width=8, depth=32, name='ram')
+    writer = design.add('writer', MemoryWriter(spec, ram))
+    design.connect(reader.data_out, bcast.data_in)
+    design.connect(bcast.data_outs[0], upper.data_in)
+    design.connect(bcast.data_outs[1], skid.data_in)
+    design.connect(upper.data_out, arb.data_ins[0])
+    design.connect(skid.data_out, arb.data_ins[1])
+    design.connect(arb.data_out, writer.data_in)
+    assert design.problems() == []
+    dot = design.to_dot()
+    assert dot.startswith('digraph "pipes" {')
+    assert ('"bcast" -> "upper" [label="8", '
+            'taillabel="data_outs[0]", headlabel="data_in"];') in dot
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def run():
+            yield writer.i_length.eq(2 * len(text))
+            yield writer.i_go.eq(True)
+            yield reader.i_length.eq(len(text))
+            yield reader.i_go.eq(True)
+            yield
+            yield writer.i_go.eq(False)
+            yield reader.i_go.eq(False)
+            yield
+            while (yield writer.o_busy):
+                yield
+            got = []
+            for addr in range(2 * len(text)):
+                got.append((yield ram[addr]))
+            assert sorted(got) == sorted(text + text.upper()), f'got {got}'
+
+    # Elaborating it connected its ports, but they're still fine.
+    assert design.problems() == [], design.problems()
@@ -0,0 +1,231 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Elaboratable, Memory, Module, Mux, Signal
+
+from nmigen_lib.util import Main, delay
+
+"""
+Streaming between pipes and memories.
+
+`MemoryReader(spec, memory)` sends a region of `memory` down
+`data_out`, one word per clock.  Set `i_addr` and `i_length` and
+pulse `i_go`; `o_busy` stays high until the last word has been
+sent.  On `START_STOP` pipes the region is framed as one packet.
+`MemoryReader(spec, init=data)` makes its own ROM from `data`, e.g.
+a `bytes` object, to replay canned input:
+
+    reader = MemoryReader(PipeSpec(8, flags=START_STOP),
+                          init=b'Hello, World!\\r\\n')
+
+`MemoryWriter(spec, memory)` captures `data_in` into `memory`.
+Pulse `i_go` with `i_addr` and `i_length` set; it takes up to
+`i_length` words, one per clock, and on `START_STOP` pipes it also
+stops after a `stop`.  `o_count` says how many words it took.  While
+it is idle, `data_in` is not ready.
+
+Each has its own port on `memory`, so a reader and a writer can
+share one to capture a burst and play it back later.  (nMigen
+warns that it flattens the hierarchy to do that.)  Addresses
+wrap at the end of the memory.  Only the data is stored; on
+`DATA_SIZE` and multi-lane pipes, the reader sends whole words.
+"""
+
+
+def _next_addr(addr, depth):
+    return Mux(addr == depth - 1, 0, addr + 1)
+
+
+class MemoryReader(Elaboratable):
+
+    def __init__(self, spec, memory=None, *, init=None):
+        assert (memory is None) != (init is None), (
+            'MemoryReader needs a memory or init data, not both'
+        )
+        if memory is None:
+            init = list(init)
+            memory = Memory(width=spec.data_width, depth=len(init), init=init)
+        assert memory.width == spec.data_width, (
+            f'{memory.width} bit memory, {spec.data_width} bit pipe'
+        )
+        self.spec = spec
+        self.memory = memory
+        self.i_addr = Signal(range(memory.depth))
+        self.i_length = Signal(range(memory.depth + 1))
+        self.i_go = Signal()
+        self.o_busy = Signal()
+        self.data_out = spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        spec = self.spec
+        data_out = self.data_out
+        m.submodules.r_port = r_port = self.memory.read_port(transparent=False)
+        addr = Signal.like(self.i_addr)
+        remaining = Signal.like(self.i_length)
+        first = Signal()
+        advance = Signal()
+
+        # The read port is the output register.  It holds its data
+        # while the output is stalled.
+        m.d.comb += [
+            advance.eq(~data_out.o_valid | data_out.i_ready),
+            r_port.addr.eq(addr),
+            r_port.en.eq(advance),
+            data_out.o_data.eq(r_port.data),
+            self.o_busy.eq((remaining != 0) | data_out.o_valid),
+        ]
+        if spec.data_size:
+            m.d.comb += data_out.o_data_size.eq(spec.data_width)
+        if spec.lanes > 1:
+            m.d.comb += data_out.o_lane_valid.eq((1 << spec.lanes) - 1)
+
+        with m.If(advance):
+            m.d.sync += data_out.o_valid.eq(remaining != 0)
+            with m.If(remaining != 0):
+                m.d.sync += [
+                    addr.eq(_next_addr(addr, self.memory.depth)),
+                    remaining.eq(remaining - 1),
+                    first.eq(False),
+                ]
+                if spec.start_stop:
+                    m.d.sync += [
+                        data_out.o_start.eq(first),
+                        data_out.o_stop.eq(remaining == 1),
+                    ]
+        with m.If(self.i_go & ~self.o_busy):
+            m.d.sync += [
+                addr.eq(self.i_addr),
+                remaining.eq(self.i_length),
+                first.eq(True),
+            ]
+        return m
+
+
+class MemoryWriter(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, spec, memory):
+        assert memory.width == spec.data_width, (
+            f'{memory.width} bit memory, {spec.data_width} bit pipe'
+        )
+        self.spec = spec
+        self.memory = memory
+        self.i_addr = Signal(range(memory.depth))
+        self.i_length = Signal(range(memory.depth + 1))
+        self.i_go = Signal()
+        self.o_busy = Signal()
+        self.o_count = Signal(range(memory.depth + 1))
+        self.data_in = spec.outlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        m.submodules.w_port = w_port = self.memory.write_port()
+        addr = Signal.like(self.i_addr)
+        remaining = Signal.like(self.i_length)
+        m.d.comb += [
+            data_in.o_ready.eq(self.o_busy),
+            w_port.addr.eq(addr),
+            w_port.data.eq(data_in.i_data),
+            w_port.en.eq(data_in.received()),
+        ]
+        with m.If(data_in.received()):
+            m.d.sync += [
+                addr.eq(_next_addr(addr, self.memory.depth)),
+                remaining.eq(remaining - 1),
+                self.o_count.eq(self.o_count + 1),
+            ]
+            done = remaining == 1
+            if self.spec.start_stop:
+                done |= data_in.i_stop
+            with m.If(done):
+                m.d.sync += self.o_busy.eq(False)
+        with m.If(self.i_go & ~self.o_busy):
+            m.d.sync += [
+                addr.eq(self.i_addr),
+                remaining.eq(self.i_length),
+                self.o_count.eq(0),
+                self.o_busy.eq(self.i_length != 0),
+            ]
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, START_STOP
+
+    spec = PipeSpec(8, flags=START_STOP)
+    text = b'The quick brown fox jumps over the lazy dog.'
+
+    class Top(Elaboratable):
+
+        # Replay part of a ROM into a RAM, then read the RAM back.
+        def __init__(self):
+            self.ram = Memory(width=8, depth=128, name='ram')
+            self.rom_reader = MemoryReader(spec, init=text)
+            self.writer = MemoryWriter(spec, self.ram)
+            self.ram_reader = MemoryReader(spec, self.ram)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.rom_reader = self.rom_reader
+            m.submodules.writer = self.writer
+            m.submodules.ram_reader = self.ram_reader
+            m.d.comb += self.rom_reader.data_out.flow_to(self.writer.data_in)
+            return m
+
+    design = Top()
+    design.ram_reader.data_out.leave_unconnected()
+    (first, length) = (4, 15)           # 'quick brown fox'
+    (ram_addr, ram_length) = (120, 32)  # wraps around the RAM
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def capture():
+            writer = design.writer
+            reader = design.rom_reader
+            yield writer.i_addr.eq(ram_addr)
+            yield writer.i_length.eq(ram_length)
+            yield writer.i_go.eq(True)
+            yield reader.i_addr.eq(first)
+            yield reader.i_length.eq(length)
+            yield reader.i_go.eq(True)
+            yield
+            yield writer.i_go.eq(False)
+            yield reader.i_go.eq(False)
+            yield
+            cycles = 0
+            while (yield writer.o_busy):
+                yield
+                cycles += 1
+            # One word per clock, and the packet's stop ended it.
+            assert cycles == length + 1, f'{cycles} clocks'
+            assert (yield writer.o_count) == length
+
+            # Play it back through a stalling receiver.
+            reader = design.ram_reader
+            out = reader.data_out
+            yield reader.i_addr.eq(ram_addr)
+            yield reader.i_length.eq(length)
+            yield reader.i_go.eq(True)
+            yield
+            yield reader.i_go.eq(False)
+            got = []
+            cycle = 0
+            while True:
+                stalling = cycle % 3 == 1
+                yield out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield out.o_valid):
+                    got.append(((yield out.o_data),
+                                (yield out.o_start),
+                                (yield out.o_stop)))
+                    if got[-1][2]:
+                        break
+            expected = [(c, i == 0, i == length - 1)
+                        for (i, c) in enumerate(text[first:first + length])]
+            assert got == expected, f'got {got}'
+            yield from delay(2)
+            assert not (yield reader.o_busy)
@@ -0,0 +1,200 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Memory, Module, Signal
+
+from nmigen_lib.util import Main
+
+"""
+PacketBuffer -- a store-and-forward buffer for `START_STOP` pipes.
+
+    buf = PacketBuffer(spec, depth=256)
+    m.d.comb += [
+        rx.rx_out.flow_to(buf.data_in),
+        buf.i_error.eq(rx.rx_err),
+        buf.data_out.flow_to(parser.data_in),
+    ]
+
+A packet is written into a `Memory` as it arrives, but it is not
+released to `data_out` until its `stop` beat has been accepted.
+Then the whole packet goes out at one beat per clock.
+
+If `i_error` is asserted on any clock from the first beat of a
+packet through its `stop` beat, the packet is dropped.  A packet
+that doesn't fit in the buffer is dropped, too.  `o_dropped` pulses
+for a clock when a packet is dropped.
+
+`depth` must be a power of two.
+"""
+
+
+class PacketBuffer(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, spec, depth):
+        assert spec.start_stop, 'PacketBuffer needs a START_STOP pipe'
+        assert depth >= 2 and depth & (depth - 1) == 0, (
+            f'PacketBuffer depth must be a power of two, not {depth}'
+        )
+        self.spec = spec
+        self.depth = depth
+
+        self.data_in = spec.outlet()
+        self.data_out = spec.inlet()
+        self.i_error = Signal()
+        self.o_dropped = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        in_word = Cat(*(data_in._get_signal(desc)
+                        for desc in self.spec.payload_signals))
+        out_word = Cat(*(data_out._get_signal(desc)
+                         for desc in self.spec.payload_signals))
+
+        # Pointers have one more bit than the address to tell full
+        # from empty.  Entries between r_ptr and commit are whole
+        # packets; entries between commit and w_ptr are the packet
+        # being received.
+        ptr_bits = (self.depth - 1).bit_length() + 1
+        w_ptr = Signal(ptr_bits)
+        commit = Signal(ptr_bits)
+        r_ptr = Signal(ptr_bits)
+        full = Signal()
+        in_packet = Signal()
+        bad = Signal()          # current packet will be dropped
+        drop = Signal()         # drop it, or the rest of it, now
+        push = Signal()
+
+        mem = Memory(width=len(in_word), depth=self.depth)
+        m.submodules.w_port = w_port = mem.write_port()
+        m.submodules.r_port = r_port = mem.read_port(transparent=False)
+
+        # When the packet fills the whole buffer, it can never be
+        # released, so accept and drop the rest of it.
+        m.d.comb += [
+            full.eq((w_ptr - r_ptr)[:ptr_bits] == self.depth),
+            data_in.o_ready.eq(~full | bad | (commit == r_ptr)),
+            drop.eq(bad | self.i_error | full),
+            push.eq(data_in.received() & ~drop),
+            w_port.addr.eq(w_ptr[:-1]),
+            w_port.data.eq(in_word),
+            w_port.en.eq(push),
+        ]
+        with m.If(push):
+            m.d.sync += w_ptr.eq(w_ptr + 1)
+        with m.If(in_packet & self.i_error):
+            m.d.sync += bad.eq(True)
+        with m.If(data_in.received()):
+            m.d.sync += in_packet.eq(~data_in.i_stop)
+            with m.If(data_in.i_stop):
+                m.d.sync += bad.eq(False)
+                with m.If(drop):
+                    m.d.sync += [
+                        w_ptr.eq(commit),
+                        self.o_dropped.eq(True),
+                    ]
+                with m.Else():
+                    m.d.sync += commit.eq(w_ptr + 1)
+            with m.Else():
+                m.d.sync += bad.eq(drop)
+        with m.If(self.o_dropped):
+            m.d.sync += self.o_dropped.eq(False)
+
+        # Same as `PipeFifo`'s memory version: the read port feeds
+        # `data_out` directly.
+        load = Signal()
+        m.d.comb += [
+            load.eq((r_ptr != commit) &
+                    (~data_out.o_valid | data_out.sent())),
+            r_port.addr.eq(r_ptr[:-1]),
+            r_port.en.eq(load),
+            out_word.eq(r_port.data),
+        ]
+        with m.If(load):
+            m.d.sync += [
+                r_ptr.eq(r_ptr + 1),
+                data_out.o_valid.eq(True),
+            ]
+        with m.Elif(data_out.sent()):
+            m.d.sync += data_out.o_valid.eq(False)
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, START_STOP
+
+    spec = PipeSpec(8, flags=START_STOP)
+    design = PacketBuffer(spec, 16)
+    design.data_in.leave_unconnected()
+    design.data_out.leave_unconnected()
+
+    # (length, beat with error or None)
+    packets = [
+        (3, None), (1, None), (5, 2), (16, None), (17, None), (4, None),
+        (6, 0), (2, 1), (7, None), (30, None), (8, None), (12, None),
+    ]
+    sent = []
+    for (n, (length, error)) in enumerate(packets):
+        beats = [(16 * n + i) & 0xFF for i in range(length)]
+        sent.append((beats, error))
+    good = [beats
+            for (beats, error) in sent
+            if error is None and len(beats) <= design.depth]
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def send():
+            # A slow source: one beat every three clocks.
+            data_in = design.data_in
+            for (beats, error) in sent:
+                for (i, beat) in enumerate(beats):
+                    yield data_in.i_valid.eq(True)
+                    yield data_in.i_data.eq(beat)
+                    yield data_in.i_start.eq(i == 0)
+                    yield data_in.i_stop.eq(i == len(beats) - 1)
+                    yield design.i_error.eq(i == error)
+                    yield
+                    while not (yield data_in.o_ready):
+                        yield
+                    yield data_in.i_valid.eq(False)
+                    yield design.i_error.eq(False)
+                    yield
+                    yield
+
+        @sim.sync_process
+        def receive():
+            data_out = design.data_out
+            yield data_out.i_ready.eq(False)
+            cycle = 0
+            for beats in good:
+                # Take packets only now and then, so some queue up.
+                while cycle % 80 < 20:
+                    yield
+                    cycle += 1
+                yield data_out.i_ready.eq(True)
+                for (i, beat) in enumerate(beats):
+                    yield
+                    cycle += 1
+                    while i == 0 and not (yield data_out.o_valid):
+                        yield
+                        cycle += 1
+                    # No bubbles inside a packet.
+                    assert (yield data_out.o_valid), (
+                        f'bubble at beat {i} of {beats}')
+                    assert (yield data_out.o_data) == beat
+                    assert (yield data_out.o_start) == (i == 0)
+                    assert (yield data_out.o_stop) == (i == len(beats) - 1)
+                yield data_out.i_ready.eq(False)
+
+        @sim.sync_process
+        def count_drops():
+            dropped = 0
+            for _ in range(600):
+                dropped += yield design.o_dropped
+                yield
+            assert dropped == len(sent) - len(good), (
+                f'dropped {dropped} packets')
+            assert not (yield design.data_out.o_valid)
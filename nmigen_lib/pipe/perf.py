@@ -0,0 +1,241 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Const, Elaboratable, Module, Signal
+
+from nmigen_lib.util import Main, delay
+
+from .spec import START_STOP, PipeSpec
+
+"""
+Performance counters for pipe links.
+
+`PipeCounters` watches one link -- either end of it -- and counts
+
+  * `transfers`: clocks with valid and ready,
+  * `stalls`: clocks with valid but not ready (the sink is slow),
+  * `starves`: clocks with ready but not valid (the source is slow),
+  * `packets`: transfers with `stop`, on `START_STOP` pipes.
+
+A `CREDIT` pipe never stalls, so its idle clocks count as starves.
+
+`Pipeline(stages, instrument=True)` puts a `PipeCounters` on every
+link; they are in `pipeline.counters`, in order.
+
+`CounterReadout(counters)` reads them all out at once.  When
+`i_trigger` is asserted, it copies every counter, then sends the
+copies down `data_out`, a byte-wide `START_STOP` pipe, least
+significant byte first.  Connect it to a `P_UARTTx` and decode the
+packet on the host with `decode_counters`:
+
+    readout = CounterReadout(pipeline.counters)
+    ...
+    for (name, counts) in decode_counters(packet, pipeline.counters):
+        print(name, counts)
+
+The link with the most stalls is waiting on the stage after it; the
+link with the most starves is waiting on the stage before it.
+"""
+
+COUNTER_NAMES = ('transfers', 'stalls', 'starves', 'packets')
+
+
+class PipeCounters(Elaboratable):
+
+    def __init__(self, end=None, *, width=32, name=None):
+        self.end = end
+        self.width = width
+        self.name = name
+        self.i_clear = Signal()
+        self.transfers = Signal(width)
+        self.stalls = Signal(width)
+        self.starves = Signal(width)
+        self.packets = Signal(width)
+
+    def watch(self, end):
+        """Count transfers on `end`, a `PipeInlet` or `PipeOutlet`."""
+        self.end = end
+        return self
+
+    @property
+    def counters(self):
+        return [getattr(self, name) for name in COUNTER_NAMES]
+
+    def elaborate(self, platform):
+        m = Module()
+        assert self.end is not None, f'{self.name}: no pipe end to watch'
+        spec = self.end._spec
+        handshake = {desc.name: self.end._get_signal(desc)
+                     for desc in spec.handshake_signals}
+        valid = handshake['valid']
+        ready = handshake.get('ready', Const(1))    # credit pipes
+        events = {
+            'transfers': valid & ready,
+            'stalls': valid & ~ready,
+            'starves': ~valid & ready,
+        }
+        if spec.start_stop:
+            stop = next(self.end._get_signal(desc)
+                        for desc in spec.payload_signals
+                        if desc.name == 'stop')
+            events['packets'] = valid & ready & stop
+        for (name, event) in events.items():
+            counter = getattr(self, name)
+            with m.If(self.i_clear):
+                m.d.sync += counter.eq(0)
+            with m.Elif(event):
+                m.d.sync += counter.eq(counter + 1)
+        return m
+
+
+class CounterReadout(Elaboratable):
+
+    def __init__(self, counters):
+        self.counters = list(counters)
+        for c in self.counters:
+            assert c.width % 8 == 0, f'{c.name}: width must be whole bytes'
+        self.i_trigger = Signal()
+        self.data_out = PipeSpec(8, flags=START_STOP).inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        values = [v for c in self.counters for v in c.counters]
+        snapshot = Signal(sum(len(v) for v in values))
+        n_bytes = len(snapshot) // 8
+        index = Signal(range(n_bytes))
+        data_out = self.data_out
+        m.d.comb += [
+            data_out.o_data.eq(snapshot.word_select(index, 8)),
+            data_out.o_start.eq(index == 0),
+            data_out.o_stop.eq(index == n_bytes - 1),
+        ]
+        with m.If(data_out.sent()):
+            m.d.sync += index.eq(index + 1)
+            with m.If(data_out.o_stop):
+                m.d.sync += [
+                    index.eq(0),
+                    data_out.o_valid.eq(False),
+                ]
+        with m.If(self.i_trigger & ~data_out.o_valid):
+            m.d.sync += [
+                snapshot.eq(Cat(*values)),
+                data_out.o_valid.eq(True),
+            ]
+        return m
+
+
+def decode_counters(packet, counters):
+    """Return (name, {counter: count}) for each `PipeCounters`."""
+    packet = bytes(packet)
+    offset = 0
+    result = []
+    for (i, c) in enumerate(counters):
+        n = c.width // 8
+        counts = {}
+        for name in COUNTER_NAMES:
+            counts[name] = int.from_bytes(packet[offset:offset + n], 'little')
+            offset += n
+        result.append((c.name or f'link_{i}', counts))
+    return result
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import Pipeline
+
+    spec = PipeSpec(8, flags=START_STOP)
+
+    class Increment(Elaboratable):
+
+        def __init__(self):
+            self.data_in = spec.outlet()
+            self.data_out = spec.inlet()
+
+        def elaborate(self, platform):
+            m = Module()
+            m.d.comb += [
+                self.data_out.o_valid.eq(self.data_in.i_valid),
+                self.data_out.o_data.eq(self.data_in.i_data + 1),
+                self.data_out.o_start.eq(self.data_in.i_start),
+                self.data_out.o_stop.eq(self.data_in.i_stop),
+                self.data_in.o_ready.eq(self.data_out.i_ready),
+            ]
+            return m
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.stages = [Increment() for _ in range(3)]
+            self.pipeline = Pipeline(self.stages, skid_every=2,
+                                     instrument=True)
+            self.readout = CounterReadout(self.pipeline.counters)
+            self.data_in = self.stages[0].data_in
+            self.data_out = self.stages[-1].data_out
+
+        def elaborate(self, platform):
+            m = Module()
+            for (i, stage) in enumerate(self.stages):
+                m.submodules[f'stage_{i}'] = stage
+            m.submodules.pipeline = self.pipeline
+            m.submodules.readout = self.readout
+            return m
+
+    design = Top()
+    design.data_in.leave_unconnected()
+    design.data_out.leave_unconnected()
+    design.readout.data_out.leave_unconnected()
+    assert len(design.pipeline.counters) == 2
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def send():
+            # 30 packets of 3, with gaps.
+            data_in = design.data_in
+            for n in range(90):
+                yield data_in.i_valid.eq(True)
+                yield data_in.i_data.eq(n)
+                yield data_in.i_start.eq(n % 3 == 0)
+                yield data_in.i_stop.eq(n % 3 == 2)
+                yield
+                while not (yield data_in.o_ready):
+                    yield
+                if n % 10 == 9:
+                    yield data_in.i_valid.eq(False)
+                    yield from delay(4)
+            yield data_in.i_valid.eq(False)
+
+        @sim.sync_process
+        def receive():
+            # Stall one clock in four.
+            data_out = design.data_out
+            for cycle in range(300):
+                yield data_out.i_ready.eq(cycle % 4 != 0)
+                yield
+
+        @sim.sync_process
+        def read_counters():
+            yield from delay(300)
+            # The snapshot is taken on the clock the trigger is seen,
+            # so read the counters on that clock, too.
+            out = design.readout.data_out
+            yield design.readout.i_trigger.eq(True)
+            yield
+            yield design.readout.i_trigger.eq(False)
+            expected = {}
+            for c in design.pipeline.counters:
+                expected[c.name] = {}
+                for name in COUNTER_NAMES:
+                    expected[c.name][name] = yield getattr(c, name)
+                assert expected[c.name]['transfers'] == 90
+                assert expected[c.name]['packets'] == 30
+            packet = []
+            while True:
+                yield
+                if (yield out.o_valid):
+                    packet.append((yield out.o_data))
+                    if (yield out.o_stop):
+                        break
+            assert len(packet) == 2 * 4 * 4
+            for (name, counts) in decode_counters(packet,
+                                                  design.pipeline.counters):
+                assert counts == expected[name], (
+                    f'{name}: read {counts}, expected {expected[name]}')
@@ -4,13 +4,30 @@ from .endpoint import PipeInlet, PipeOutlet
 
 class Pipeline(Elaboratable):
 
-    def __init__(self, seq):
+    def __init__(self, seq, *, skid_every=0, instrument=False):
+        """Connect each item in `seq` to the next.
+
+        If `skid_every` is N, a `SkidBuffer` is inserted after every
+        Nth item to register the handshake signals.
+
+        If `instrument` is true, `self.counters` has a `PipeCounters`
+        for each link.
+        """
+        assert skid_every >= 0, 'skid_every must not be negative'
         self.seq = seq
+        self.skid_every = skid_every
+        self.counters = []
+        if instrument:
+            # Imported here so the package doesn't import its stages.
+            from .perf import PipeCounters
+            self.counters = [
+                PipeCounters(name=f'link_{i}') for i in range(1, len(seq))
+            ]
 
     def elaborate(self, platform):
         m = Module()
         sink = None
-        for source in self.seq:
+        for (i, source) in enumerate(self.seq):
             if sink is not None:
                 outlets = find_outlets(source)
                 if not outlets:
@@ -24,6 +41,15 @@ class Pipeline(Elaboratable):
                     raise ValueError(
                         f'{sink} and {source} have no matching pipe endpoints'
                     )
+                if self.counters:
+                    counters = self.counters[i - 1].watch(inlet)
+                    m.submodules[f'counters_{i}'] = counters
+                if self.skid_every and i % self.skid_every == 0:
+                    from .skid import SkidBuffer
+                    skid = SkidBuffer(inlet._spec)
+                    m.submodules[f'skid_{i}'] = skid
+                    m.d.comb += skid.data_in.flow_from(inlet)
+                    inlet = skid.data_out
                 m.d.comb += outlet.flow_from(inlet)
             sink = source
         return m
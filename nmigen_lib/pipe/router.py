@@ -0,0 +1,139 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Array, Elaboratable, Module, Mux, Signal, Value
+
+from nmigen_lib.util import Main, delay
+
+"""
+Router -- steer each beat or packet to one of several pipes.
+
+    spec = PipeSpec((('command', 2), ('operand', 8)), flags=START_STOP)
+    router = Router(spec, 3, lambda data: data.command)
+
+`selector` is called with `data_in.i_data`, so a `Layout`'s fields
+are available by name, and returns the index of the output in
+`data_outs` to send the beat to.  A beat whose index is `n` or more
+is accepted and dropped.
+
+On `START_STOP` pipes, the index is computed from the `start` beat
+and the whole packet follows it.
+
+Each output has its own backpressure.  Only the output the current
+beat is going to can stall the input, so a stalled output blocks
+the others only when the beat at the head of the line is for it.
+Like `Broadcast`, the router is combinatorial.
+"""
+
+
+class Router(Elaboratable):
+
+    def __init__(self, spec, n, selector):
+        self.spec = spec
+        self.n = n
+        self.selector = selector
+        self.data_in = spec.outlet()
+        self.data_outs = [spec.inlet() for _ in range(n)]
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        selected = Value.cast(self.selector(data_in.i_data))
+        route = Signal(len(selected))
+        if self.spec.start_stop:
+            latched = Signal.like(route)
+            with m.If(data_in.received() & data_in.i_start):
+                m.d.sync += latched.eq(selected)
+            m.d.comb += route.eq(Mux(data_in.i_start, selected, latched))
+        else:
+            m.d.comb += route.eq(selected)
+
+        readies = Array(out.i_ready for out in self.data_outs)
+        m.d.comb += data_in.o_ready.eq(
+            Mux(route < self.n, readies[route], True)
+        )
+        for (k, out) in enumerate(self.data_outs):
+            m.d.comb += [
+                out._get_signal(desc).eq(data_in._get_signal(desc))
+                for desc in self.spec.payload_signals
+            ]
+            m.d.comb += out.o_valid.eq(data_in.i_valid & (route == k))
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, START_STOP
+
+    spec = PipeSpec((('command', 2), ('operand', 8)), flags=START_STOP)
+    design = Router(spec, 3, lambda data: data.command)
+    design.data_in.leave_unconnected()
+    for out in design.data_outs:
+        out.leave_unconnected()
+
+    # Packets of 1 to 4 beats.  Only the first beat's command counts.
+    commands = [0, 1, 0, 3, 2, 1, 1, 0, 2, 3, 0, 1, 2, 2, 0]
+    packets = []
+    for (p, command) in enumerate(commands):
+        length = p % 4 + 1
+        packets.append([(command if i == 0 else (p + i) % 4,
+                         (p * 8 + i) & 0xFF,
+                         i == 0,
+                         i == length - 1)
+                        for i in range(length)])
+    expected = [
+        [beat for (c, p) in zip(commands, packets) if c == k for beat in p]
+        for k in range(3)
+    ]
+    got = [[] for _ in range(3)]
+    arrival = [[] for _ in range(3)]
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def send():
+            data_in = design.data_in
+            for packet in packets:
+                for (command, operand, start, stop) in packet:
+                    yield data_in.i_valid.eq(True)
+                    yield data_in.i_data.command.eq(command)
+                    yield data_in.i_data.operand.eq(operand)
+                    yield data_in.i_start.eq(start)
+                    yield data_in.i_stop.eq(stop)
+                    yield
+                    while not (yield data_in.o_ready):
+                        yield
+            yield data_in.i_valid.eq(False)
+
+        def receiver(k, stalls):
+            def receive():
+                out = design.data_outs[k]
+                cycle = 0
+                while len(got[k]) < len(expected[k]):
+                    stalling = stalls(cycle)
+                    yield out.i_ready.eq(not stalling)
+                    yield
+                    cycle += 1
+                    if not stalling and (yield out.o_valid):
+                        got[k].append(((yield out.o_data.command),
+                                       (yield out.o_data.operand),
+                                       bool((yield out.o_start)),
+                                       bool((yield out.o_stop))))
+                        arrival[k].append(cycle)
+            return receive
+
+        sim.sync_process(receiver(0, lambda cycle: cycle % 3 == 1))
+        sim.sync_process(receiver(1, lambda cycle: False))
+        # Output 2 is stalled for a long time.
+        sim.sync_process(receiver(2, lambda cycle: cycle < 100))
+
+        @sim.sync_process
+        def check():
+            yield from delay(200)
+            assert got == expected, f'got {got}'
+            # Traffic ahead of the first packet for output 2 wasn't
+            # held up by it.
+            first_2 = commands.index(2)
+            ahead = sum(len(p)
+                        for (c, p) in zip(commands[:first_2], packets)
+                        if c == 0)
+            assert arrival[0][ahead - 1] < 100
+            assert arrival[2][0] >= 100
@@ -1,21 +1,28 @@
 #!/usr/bin/env nmigen
 
-from nmigen import Elaboratable, Module
+from nmigen import Elaboratable, Module, Signal
+from nmigen.hdl.ast import Statement
 
-from nmigen_lib.pipe import PipeSpec, START_STOP
+from nmigen_lib.util import Main
+
+from .spec import DATA_SIZE, START_STOP, PipeSpec
 
-# This code is an idea.  It does not run in current form.
-# But boy would it make pipelining easy...
-#
 # A `SimpleStage` is a pipeline stage that can always compute one
 # result from one input in a single clock.  It has no state
-# or external timing dependencies.
+# or external timing dependencies.  The stage generates the
+# handshake: it accepts a new input whenever its output register is
+# empty or being read, so it passes one transfer per clock, and
+# `start`, `stop`, `data_size` and `lane_valid` are copied through
+# when both pipes have them.
+#
+# On multi-lane pipes, `logic` is applied to every lane in parallel:
+# `i` and `o` are one lane's data.  Both pipes need the same number
+# of lanes.
 #
 # Example:
 #   into_a = PipeSpec(...)
 #   a_to_b = PipeSpec(...)
 #   b_to_c = PipeSpec(...)
-#   out_of_c = PipeSpec(...)
 #
 #   class A(SimpleStage):
 #
@@ -23,229 +30,401 @@ from nmigen_lib.pipe import PipeSpec, START_STOP
 #       # and flow control are provided.
 #       def logic(self, m, i, o):
 #           m.d.sync += o.eq(...)
-#           m.d.comb += ...
 #
 #   class B(SimpleStage):
 #
 #       # control both logic and optional handshake signals
 #       def logic_and_handshake(self, m, i, o):
 #           m.d.sync += [
-#               o.data.eq(...),
+#               o.o_data.eq(...),
 #               o.o_start.eq(...), # or whatever
 #           ]
 #
-#   m.submodules.a = a = SimpleStage(into_a, a_to_b)
-#   m.submodules.b = b = SimpleStage(a_to_b, b_to_c)
-#   m.submodules.c = SimpleStage.sync_expr([o.eq(...), ...])
+#   m.submodules.a = a = A(into_a, a_to_b)
+#   m.submodules.b = b = B(a_to_b, b_to_c)
 #
-# And that's it.  The last one doesn't work, because the input and
-# output pipespecs are not passed in, and because `o` is not bound
-# in the expression.
-
-# Here's another idea.
+# Statements added to `m` in `logic` only take effect on clocks when
+# the stage accepts an input, `m.d.comb` ones included.
 #
-#   m.pipeline = pipeline = SimplePipeline.assemble(
-#       PipeSpec(16),              # pipe takes unsigned(16) words
+# Or assemble a whole pipeline from lambdas.  Each stage is a
+# `LogicStage`, whose function maps input data to a statement (or
+# list of statements) assigning output data, or a
+# `LogicAndHandshakeStage`, whose function gets both endpoints.  A
+# bare callable is a `LogicStage`.
+#
+#   m.submodules.pipeline = pipeline = SimplePipeline.assemble(
+#       PipeSpec(16),               # pipe takes unsigned(16) words
 #       LogicStage(
 #           lambda i, o: o.eq(some_function(i))
 #       ),
-#       PipeSpec(unsigned(12)),     # 1st stage passes unsigned(16) to 2nd
+#       PipeSpec(unsigned(12)),     # 1st stage passes unsigned(12) to 2nd
 #       LogicAndHandshakeStage(
 #           lambda i, o:
 #               [
 #                   o.o_data_size.eq(whatever),
 #                   o.o_data.flag.eq(some_condition),
-#                   o.o_data.word.eq(other_function(i)),
+#                   o.o_data.word.eq(other_function(i.i_data)),
 #               ]
 #       ),
-#       PipeSpec((('flag': 1), ('word', signed(8)), flags=DATA_SIZE)
-#                               # pipe emits flag + 8-bit word + data_size.
+#       PipeSpec((('flag', 1), ('word', signed(8))), flags=DATA_SIZE)
+#                                   # pipe emits flag + 8-bit word + data_size.
 #   )
+#   m.d.comb += [
+#       source.data_out.flow_to(pipeline.data_in),
+#       pipeline.data_out.flow_to(sink.data_in),
+#   ]
+#
+# A function may also return a dict that maps domain names to
+# statements, e.g. `{'sync': ..., 'comb': ...}`.  The `comb`
+# statements hold on every clock, e.g. to compute the output from a
+# register the `sync` statements update; the others take effect
+# when the stage accepts an input.
+
 
-class Decimator(Elaboratable):
+class SimpleStage(Elaboratable):
 
-    def __init__(self, cfg):
-        ...
-        self.samples_in = mono_sample_spec(cfg.osc_depth).outlet()
-        self.samples_out = mono_sample_spec(cfg.osc_depth).inlet()
+    def __init__(self, in_spec=None, out_spec=None):
+        self.data_in = None
+        self.data_out = None
+        self._comb = []         # from `_add_logic`, added unconditionally
+        if in_spec is not None or out_spec is not None:
+            self.bind(in_spec, out_spec)
+
+    def bind(self, in_spec, out_spec):
+        """Create the stage's endpoints, if not done by the constructor."""
+        assert self.data_in is None, f'{self} is already bound'
+        self.data_in = in_spec.outlet()
+        self.data_out = out_spec.inlet()
+        return self
 
     def elaborate(self, platform):
         m = Module()
-        N = self.M + 2
-        assert _is_power_of_2(N)
-        # kernel_RAM = Memory(width=COEFF_WIDTH, depth=N, init=kernel)
-        m.submodules.kr_port = kr_port = kernel_RAM.read_port()
-        sample_RAM = Memory(width=self.sample_depth, depth=N, init=[0] * N)
-        m.submodules.sw_port = sw_port = sample_RAM.write_port()
-        m.submodules.sr_port = sr_port = sample_RAM.read_port()
-
-        roto_sample_spec = PipeSpec(
-            (
-                ('coeff', COEFF_SHAPE),
-                ('sample', signed(sample_depth)),
-            ),
-            flags=START_STOP,
-        )
-
-        class RotorFIFO(Elaboratable):
-            def elaborate(self):
-                m = Module()
-                # when samples_in and fifo not full: insert sample.
-                # when samples_readable and out pipe not full:
-                #     out pipe send {}
-                #         o_data.coeff = kernel[c_index],
-                #         o_data.sample = sample[...],
-                #         o_start=c_index == 1,
-                #         o_stop=c_index == ~0,
-                #     }
-                # when c_index == ~0:
-                #     c_index = 1
-                #     sr_index = start_index + R
-                #     start_index += R
-                # else:
-                #     c_index += 1
-                #     sr_index += 1
-                return m
-
-
-        m.submodules.rfifo = RotorFifo()
-        m.submodules.pipe = SimplePipeline.assemble(
-            roto_sample_spec,
-            LogicModule(lambda m, i, o: o.eq(i.coeff * i.sample)),
-            PipeSpec(signed(COEFF_WIDTH + sample_depth)),
-            LogicAndHandshakeModule(
-                lambda m, i, o: {
-                    'sync': acc.eq(Mux(i_start, i_data, acc + i_data)),
-                    'comb': o.o_data.eq(acc[shift:]),
-                }
-            ),
-            PipeSpec(signed(sample_depth)),
-            flags=START_STOP,
-        )
+        i = self.data_in
+        o = self.data_out
+        advance = Signal()
+        m.d.comb += [
+            advance.eq(~o.o_valid | o.i_ready),
+            i.o_ready.eq(advance),
+        ]
+        with m.If(advance):
+            m.d.sync += o.o_valid.eq(i.i_valid)
+        self._comb = []
+        with m.If(i.received()):
+            m.d.sync += self._sidebands(i, o)
+            self.logic_and_handshake(m, i, o)
+        m.d.comb += self._comb
         return m
 
+    @staticmethod
+    def _sidebands(i, o):
+        stmts = []
+        if i._spec.start_stop and o._spec.start_stop:
+            stmts += [
+                o.o_start.eq(i.i_start),
+                o.o_stop.eq(i.i_stop),
+            ]
+        if i._spec.data_size and o._spec.data_size:
+            stmts += [
+                o.o_data_size.eq(i.i_data_size),
+            ]
+        if i._spec.lanes > 1 and o._spec.lanes > 1:
+            stmts += [
+                o.o_lane_valid.eq(i.i_lane_valid),
+            ]
+        return stmts
 
+    def logic_and_handshake(self, m, i, o):
+        """default implementation.  Override to access handshake signals."""
+        assert i._spec.lanes == o._spec.lanes, (
+            f'{i._spec.lanes} lanes in, {o._spec.lanes} lanes out'
+        )
+        for (i_lane, o_lane) in zip(i.lanes(), o.lanes()):
+            self.logic(m, i_lane, o_lane)
 
-class SimplePipeline(Elaboratable):
-
-    @classmethod
-    def assemble(cls, *args):
-        assert len(args) % 2 == 1
-        assert all(callable(a) for a in args[1::2])
-        assert all(isinstance(s, PipeSpec) for s in args[::2])
-        pline = cls()
-        pline.inlet = args[0]
-        pline.outlet = args[1]
-        stages = args[1:-1:2]
-        sources = args[:-2:2]
-        sinks = args[2::2]
-        for (src, stg, snk) in zip(sources, stages, sinks):
-            # get name for stage
-            # LogicStg()
-            ...
-        return pline
-
-    def __init__(self):
-        self.stages = []
-        self.connector_specs = []
-
-    # @property.setter
-    # def inlet(self, spec):
-    #     self.inlet_spec = spec
-    #     self.data_in = spec.outlet()
-    #     return self
-    #
-    # @property.setter
-    # def outlet(self, spec):
-    #     self.outlet_spec = spec
-    #     self.data_out = spec.inlet()
-    #     return self
-
-    def data(self, data):
-        self.elements.append(data)
-        return self
+    def logic(self, m, i, o):
+        """Override with code that computes o from i.
 
-    def logic_stage(self, logic):
-        """logic may be:
-              a callable
-              an assignment (e.g. a.eq(b0))
-              a list of assignments
-              a dict that maps domain names to (list of) assignments
+        It runs under the condition that the stage accepts an input.
         """
-        self.stages.append(logic)
-        return self
+        raise NotImplementedError()
 
-    def logic_and_handshake_stage(self, logic):
-        """logic may be a callable or a dict"""
-        self.elements.append(logic)
-        return self
 
-    def elaborate(self, platform):
-        ...
+class LogicStage(SimpleStage):
 
+    def __init__(self, logic, in_spec=None, out_spec=None):
+        """`logic(i, o)` returns statements that compute o from i."""
+        super().__init__(in_spec, out_spec)
+        self._logic = logic
 
-class SimpleStage(Elaboratable):
+    def logic(self, m, i, o):
+        _add_logic(self, m, self._logic(i, o))
 
-    def __init__(self, in_spec, out_spec):
-        self.in_data = in_spec.outlet()
-        self.out_data = out_spec.inlet()
 
-    def elaborate(self, platform):
-        m = Module()
-        m.d.comb += self.in_data.o_ready.eq(~self.out_data.full())
-        with m.If(self.in_data.received()):
-            self.logic_and_handshake(m, self.in_data, self.out_data)
-            m.d.sync += self.out_data.o_valid.eq(True)
-        with m.Else():
-            m.d.sync += self.out_data.o_valid.eq(False)
-        return
+class LogicAndHandshakeStage(SimpleStage):
+
+    def __init__(self, logic, in_spec=None, out_spec=None):
+        """`logic(i, o)` gets both endpoints and returns statements."""
+        super().__init__(in_spec, out_spec)
+        self._logic = logic
 
     def logic_and_handshake(self, m, i, o):
-        """default implementation.  Override to access handshake signals."""
-        ...
-        return self.logic(m, i.i_data, o.o_data)
+        _add_logic(self, m, self._logic(i, o))
 
-    def logic(self, m, i, o):
-        """Override with code that unconditionally computes o from i."""
-        raise NotImplementedError()
 
-    def elaborate(self, platform):
-        m = Module()
-        logic = self.logic_and_handshake(m, self.in_data, self.out_data)
-        if isinstance(logic, dict):
-            ...
-        elif isinstance(logic, AST):
-            ...
-        return m
+def _add_logic(stage, m, logic):
+    # Called inside the stage's accept condition, so `comb`
+    # statements are saved for `elaborate` to add outside it.
+    if isinstance(logic, dict):
+        for (domain, stmts) in logic.items():
+            if domain == 'comb':
+                stage._comb += Statement.cast(stmts)
+            else:
+                m.d[domain] += stmts
+    elif isinstance(logic, (list, tuple, Statement)):
+        m.d.sync += logic
+    else:
+        raise TypeError(f'unknown stage logic {logic!r}')
 
-    # @classmethod
-    # def sync_expr(cls, m, sync_exprs):
-    #     """create a pipeline stage around one or more nMigen AST expressions"""
-    #     class Anonymous(cls):
-    #         def logic(self, m, i, o):
-    #             m.d.sync += sync_exprs
-    #     return Anonymous()
 
+class SimplePipeline(Elaboratable):
 
-def LogicAndHandshakeStage(SimpleStage):
+    @classmethod
+    def assemble(cls, *args):
+        """Build a pipeline from alternating `PipeSpec`s and stages."""
+        assert len(args) % 2 == 1, 'pipeline must start and end with specs'
+        specs = args[::2]
+        stages = args[1::2]
+        assert all(isinstance(s, tuple) and hasattr(s, 'inlet')
+                   for s in specs), 'even arguments must be PipeSpecs'
+        assert all(callable(s) or isinstance(s, SimpleStage)
+                   for s in stages), 'odd arguments must be stages'
+        pline = cls()
+        for (src, stg, snk) in zip(specs, stages, specs[1:]):
+            if not isinstance(stg, SimpleStage):
+                stg = LogicStage(stg)
+            if stg.data_in is None:
+                stg.bind(src, snk)
+            pline.stages.append(stg)
+        pline.data_in = pline.stages[0].data_in
+        pline.data_out = pline.stages[-1].data_out
+        return pline
 
-    def __init__(self, logic):
-        super().__init__(None, None)
-        self._logic = logic
+    def __init__(self):
+        self.stages = []
+        self.data_in = None
+        self.data_out = None
 
-    def logic_and_handshake(self, m, i, o):
-        frag = self._logic
-        if callable(frag):
-            frag = frag(m, i, o)
-        if isinstance(frag, (list, Assign)):
-            m.d.sync += frag
-        elif isinstance(frag, dict):
-            for domain, frags in frag:
-                m.d[domain] += frag
-        else:
-            raise TypeError('unknown logic_and_handshake {frag!r}')
+    def elaborate(self, platform):
+        m = Module()
+        for (n, stage) in enumerate(self.stages):
+            m.submodules[f'stage_{n}'] = stage
+        for (a, b) in zip(self.stages, self.stages[1:]):
+            m.d.comb += a.data_out.flow_to(b.data_in)
+        return m
 
 
 if __name__ == '__main__':
-    spec = PipeSpec(1)  # one bit of data
-    # design = SimpleStage.sync_expr(o.eq(~i))
+    from nmigen import Mux, signed
+
+    # ((x * 3) - 5) as signed, then absolute value with sign flag.
+    flags = DATA_SIZE | START_STOP
+    arith = SimplePipeline.assemble(
+        PipeSpec(8, flags=flags),
+        lambda i, o: o.eq(i * 3),
+        PipeSpec(10, flags=flags),
+        LogicStage(lambda i, o: o.eq(i - 5)),
+        PipeSpec(signed(11), flags=flags),
+        LogicAndHandshakeStage(
+            lambda i, o: [
+                o.o_data.neg.eq(i.i_data < 0),
+                o.o_data.mag.eq(Mux(i.i_data < 0, -i.i_data, i.i_data)),
+                o.o_data_size.eq(i.i_data_size + 1),
+            ]
+        ),
+        PipeSpec((('mag', 10), ('neg', 1)), flags=flags),
+    )
+
+    # Swap the case of four characters per clock.
+    spec = PipeSpec(8, flags=START_STOP, lanes=4)
+    assert spec.data_width == 32
+    assert spec.lane_width == 8
+    assert [d.name for d in spec.payload_signals] == [
+        'data', 'stop', 'start', 'lane_valid'
+    ]
+    assert PipeSpec(8) == PipeSpec(8, lanes=1) != PipeSpec(8, lanes=2)
+
+    def other_case(i, o):
+        is_alpha = ((i & 0xC0) == 0x40) & (1 <= (i & 0x1F)) & ((i & 0x1F) <= 26)
+        return o.eq(Mux(is_alpha, i ^ 0x20, i))
+
+    lanes = SimplePipeline.assemble(spec, other_case, spec)
+    assert len(lanes.data_in.lanes()) == 4
+
+    # Running sum.  The output comes from the accumulator through
+    # comb logic, so it must hold while the output is stalled.
+    total = Signal(16)
+    running = SimplePipeline.assemble(
+        PipeSpec(8),
+        LogicAndHandshakeStage(
+            lambda i, o: {
+                'sync': total.eq(total + i.i_data),
+                'comb': o.o_data.eq(total),
+            }
+        ),
+        PipeSpec(16),
+    )
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.arith = arith
+            self.lanes = lanes
+            self.running = running
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.arith = self.arith
+            m.submodules.lanes = self.lanes
+            m.submodules.running = self.running
+            return m
+
+    design = Top()
+    for pipeline in (arith, lanes, running):
+        pipeline.data_in.leave_unconnected()
+        pipeline.data_out.leave_unconnected()
+
+    def expected(x):
+        y = x * 3 - 5
+        return (abs(y), y < 0)
+
+    def sender(count, gaps):
+        def send():
+            data_in = arith.data_in
+            n = 0
+            cycle = 0
+            while n < count:
+                pausing = cycle in gaps
+                yield data_in.i_valid.eq(not pausing)
+                yield data_in.i_data.eq(n & 0xFF)
+                yield data_in.i_data_size.eq(n % 8)
+                yield data_in.i_start.eq(n % 4 == 0)
+                yield data_in.i_stop.eq(n % 4 == 3)
+                yield
+                cycle += 1
+                if not pausing and (yield data_in.o_ready):
+                    n += 1
+            yield data_in.i_valid.eq(False)
+        return send
+
+    def receiver(count, stalls, min_rate=None):
+        def receive():
+            data_out = arith.data_out
+            n = 0
+            cycle = 0
+            first = None
+            while n < count:
+                stalling = cycle in stalls
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield data_out.o_valid):
+                    if first is None:
+                        first = cycle
+                    got = ((yield data_out.o_data.mag),
+                           (yield data_out.o_data.neg))
+                    want = expected(n & 0xFF)
+                    assert got == want, f'{n}: got {got}, wanted {want}'
+                    assert (yield data_out.o_data_size) == n % 8 + 1
+                    assert (yield data_out.o_start) == (n % 4 == 0)
+                    assert (yield data_out.o_stop) == (n % 4 == 3)
+                    n += 1
+            if min_rate is not None:
+                rate = count / (cycle - first + 1)
+                assert rate >= min_rate, f'{rate:.2f} transfers/clock'
+        return receive
+
+    text = b'Hello, World!  Four lanes at a time.'
+    beats = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    with Main(design).sim as sim:
+        # Bursty traffic with backpressure...
+        gaps = {3, 4, 20, 21, 22, 50}
+        stalls = {7, 8, 9, 15, 16, 40, 41, 42, 43, 44, 60, 62, 64}
+        @sim.sync_process
+        def bursty():
+            yield from sender(100, gaps)()
+            yield from sender(300, ())()
+
+        @sim.sync_process
+        def check():
+            yield from receiver(100, stalls)()
+            # ... then streaming at full rate.
+            yield from receiver(300, (), min_rate=1.0)()
+
+        @sim.sync_process
+        def send_lanes():
+            data_in = lanes.data_in
+            for (n, beat) in enumerate(beats):
+                yield data_in.i_valid.eq(True)
+                for (lane, c) in zip(data_in.lanes(), beat):
+                    yield lane.eq(c)
+                yield data_in.i_lane_valid.eq((1 << len(beat)) - 1)
+                yield data_in.i_start.eq(n == 0)
+                yield data_in.i_stop.eq(n == len(beats) - 1)
+                yield
+                while not (yield data_in.o_ready):
+                    yield
+            yield data_in.i_valid.eq(False)
+
+        @sim.sync_process
+        def receive_lanes():
+            data_out = lanes.data_out
+            got = b''
+            cycles = 0
+            while True:
+                yield
+                cycles += 1
+                if (yield data_out.o_valid):
+                    mask = yield data_out.o_lane_valid
+                    for (k, lane) in enumerate(data_out.lanes()):
+                        if mask & 1 << k:
+                            got += bytes([(yield lane)])
+                    if (yield data_out.o_stop):
+                        break
+            assert got == text.swapcase(), f'got {got}'
+            assert cycles == len(beats) + 1
+
+        @sim.sync_process
+        def send_running():
+            data_in = running.data_in
+            yield data_in.i_valid.eq(True)
+            for n in range(1, 21):
+                yield data_in.i_data.eq(n)
+                yield
+                while not (yield data_in.o_ready):
+                    yield
+            yield data_in.i_valid.eq(False)
+
+        @sim.sync_process
+        def receive_running():
+            data_out = running.data_out
+            sums = []
+            held = None
+            cycle = 0
+            while len(sums) < 20:
+                stalling = cycle % 3 != 0
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if (yield data_out.o_valid):
+                    got = yield data_out.o_data
+                    # A valid output holds until it is taken.
+                    assert held is None or got == held, (
+                        f'cycle {cycle}: {held} changed to {got} while stalled')
+                    if stalling:
+                        held = got
+                    else:
+                        sums.append(got)
+                        held = None
+            n = range(1, 21)
+            assert sums == [sum(n[:k + 1]) for k in range(20)], f'got {sums}'
@@ -0,0 +1,181 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Signal
+
+from nmigen_lib.util import Main
+
+"""
+SkidBuffer -- a register slice for pipes.
+
+A `SkidBuffer` registers everything that passes through it: the
+payload and `valid` going downstream, and `ready` going upstream.
+That cuts the combinatorial paths through a chain of stages like
+`CaseBender`, whose `ready` is wired straight through.
+
+Registering `ready` means the upstream stage learns about a stall
+one clock late, so the buffer has a second, "skid" register to
+catch the transfer that was already in flight.  It still passes one
+transfer per clock.
+
+`Pipeline(stages, skid_every=N)` inserts one after every Nth stage.
+"""
+
+
+class SkidBuffer(Elaboratable):
+
+    registered_ready = True
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.data_in = spec.outlet()
+        self.data_out = spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        in_word = Cat(*(data_in._get_signal(desc)
+                        for desc in self.spec.payload_signals))
+        out_word = Cat(*(data_out._get_signal(desc)
+                         for desc in self.spec.payload_signals))
+        skid_word = Signal(len(in_word))
+        skid_valid = Signal()
+
+        # Upstream may send whenever the skid register is empty.
+        m.d.comb += data_in.o_ready.eq(~skid_valid)
+        with m.If(~data_out.o_valid | data_out.i_ready):
+            # Output register is free.  Drain the skid register first.
+            with m.If(skid_valid):
+                m.d.sync += [
+                    out_word.eq(skid_word),
+                    data_out.o_valid.eq(True),
+                    skid_valid.eq(False),
+                ]
+            with m.Else():
+                m.d.sync += data_out.o_valid.eq(data_in.i_valid)
+                with m.If(data_in.i_valid):
+                    m.d.sync += out_word.eq(in_word)
+        with m.Elif(data_in.received()):
+            # Output is stalled; catch the transfer in flight.
+            m.d.sync += [
+                skid_word.eq(in_word),
+                skid_valid.eq(True),
+            ]
+        return m
+
+
+if __name__ == '__main__':
+    from nmigen_lib.pipe import PipeSpec, Pipeline, START_STOP
+
+    spec = PipeSpec(8, flags=START_STOP)
+
+    class Increment(Elaboratable):
+
+        """Add one, combinatorially, like `CaseBender`."""
+
+        def __init__(self):
+            self.data_in = spec.outlet()
+            self.data_out = spec.inlet()
+
+        def elaborate(self, platform):
+            m = Module()
+            m.d.comb += [
+                self.data_out.o_valid.eq(self.data_in.i_valid),
+                self.data_out.o_data.eq(self.data_in.i_data + 1),
+                self.data_out.o_start.eq(self.data_in.i_start),
+                self.data_out.o_stop.eq(self.data_in.i_stop),
+                self.data_in.o_ready.eq(self.data_out.i_ready),
+            ]
+            return m
+
+    class Top(Elaboratable):
+
+        def __init__(self, stages, skid_every):
+            self.stages = [Increment() for _ in range(stages)]
+            self.pipeline = Pipeline(self.stages, skid_every=skid_every)
+            self.data_in = self.stages[0].data_in
+            self.data_out = self.stages[-1].data_out
+
+        def elaborate(self, platform):
+            m = Module()
+            for (i, stage) in enumerate(self.stages):
+                m.submodules[f'stage_{i}'] = stage
+            m.submodules.pipeline = self.pipeline
+            return m
+
+    class Tops(Elaboratable):
+
+        def __init__(self):
+            self.tops = [Top(4, 1), Top(4, 2), Top(5, 3)]
+            self.skids = [SkidBuffer(spec) for _ in range(2)]
+
+        def elaborate(self, platform):
+            m = Module()
+            for (i, top) in enumerate(self.tops):
+                m.submodules[f'top_{i}'] = top
+            for (i, skid) in enumerate(self.skids):
+                m.submodules[f'skid_{i}'] = skid
+            return m
+
+    design = Tops()
+    pipes = design.tops + design.skids
+    for pipe in pipes:
+        pipe.data_in.leave_unconnected()
+        pipe.data_out.leave_unconnected()
+
+    def sender(pipe, count, gaps=()):
+        def send():
+            data_in = pipe.data_in
+            n = 0
+            cycle = 0
+            while n < count:
+                pausing = cycle in gaps
+                yield data_in.i_valid.eq(not pausing)
+                yield data_in.i_data.eq(n & 0xFF)
+                yield data_in.i_start.eq(n % 4 == 0)
+                yield data_in.i_stop.eq(n % 4 == 3)
+                yield
+                cycle += 1
+                if not pausing and (yield data_in.o_ready):
+                    n += 1
+            yield data_in.i_valid.eq(False)
+        return send
+
+    def receiver(pipe, count, offset, stalls=(), min_rate=None):
+        def receive():
+            data_out = pipe.data_out
+            n = 0
+            cycle = 0
+            first = None
+            while n < count:
+                stalling = cycle in stalls
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield data_out.o_valid):
+                    if first is None:
+                        first = cycle
+                    data = yield data_out.o_data
+                    want = (n + offset) & 0xFF
+                    assert data == want, f'got {data:#x}, wanted {want:#x}'
+                    assert (yield data_out.o_start) == (n % 4 == 0)
+                    assert (yield data_out.o_stop) == (n % 4 == 3)
+                    n += 1
+            if min_rate is not None:
+                rate = count / (cycle - first + 1)
+                assert rate >= min_rate, f'{rate:.2f} transfers/clock'
+        return receive
+
+    with Main(design).sim as sim:
+        gaps = {3, 4, 20, 21, 22, 50}
+        stalls = {7, 8, 9, 15, 16, 40, 41, 42, 43, 44, 60, 62, 64}
+        for top in design.tops:
+            offset = len(top.stages)
+            sim.sync_process(sender(top, 100, gaps))
+            sim.sync_process(receiver(top, 100, offset, stalls))
+        # A lone skid buffer, with and without backpressure.
+        (bursty, streaming) = design.skids
+        sim.sync_process(sender(bursty, 100, gaps))
+        sim.sync_process(receiver(bursty, 100, 0, stalls))
+        sim.sync_process(sender(streaming, 100))
+        sim.sync_process(receiver(streaming, 100, 0, min_rate=1.0))
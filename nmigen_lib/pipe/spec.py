@@ -12,14 +12,16 @@ from .endpoint import PipeInlet, PipeOutlet
 
 DATA_SIZE = 1 << 8
 START_STOP = 1 << 9
+CREDIT = 1 << 10
 
 
 class PipeSpec(NamedTuple):
     flags: int
     dsol: Union[Shape, Layout]
+    lanes: int = 1
 
     @classmethod
-    def new(cls, dswol, *, flags=0):
+    def new(cls, dswol, *, flags=0, lanes=1):
         """
         Create a PipeSpec.
 
@@ -27,7 +29,17 @@ class PipeSpec(NamedTuple):
         of the data signal, a `Layout` describing the data signal, or
         a tuple of tuples that nMigen can coerce into a `Layout`.
 
-        The flags arg may include DATA_SIZE or START_STOP flags.
+        The flags arg may include DATA_SIZE, START_STOP or CREDIT flags.
+        A CREDIT pipe has a `credit` signal instead of `ready`; see
+        `credit.py`.
+
+        With `lanes` > 1, each beat carries that many independent
+        elements of the data shape or layout.  The data signal has a
+        field per lane, `lane_0`, `lane_1`, etc., and a `lane_valid`
+        signal has a bit per lane.  `end.lanes()` lists the lanes'
+        data signals.  `data_width` is the width of the whole beat and
+        `lane_width` of one lane.  DATA_SIZE can't be used with lanes;
+        `lane_valid` does its job.
         """
         # dsol: data shape or layout
         # dwsol: data width, shape, or layout
@@ -35,7 +47,11 @@ class PipeSpec(NamedTuple):
             dsol = Shape.cast(dswol)
         else:
             dsol = Layout.cast(dswol)
-        return cls(flags, dsol)
+        assert lanes >= 1, f'a pipe needs at least one lane, not {lanes}'
+        assert lanes == 1 or not flags & DATA_SIZE, (
+            'DATA_SIZE pipes have one lane'
+        )
+        return cls(flags, dsol, lanes)
 
     @classmethod
     def from_int(cls, n):
@@ -43,7 +59,7 @@ class PipeSpec(NamedTuple):
         Create a PipeSpec from a 32 bit integer for SpokeFPGA compatibility.
         """
         data_width = n & 0xFF
-        flags = n & 0x300
+        flags = n & 0x700
         if n != data_width | flags:
             raise ValueError(f'invalid PipeSpec {n:\#x}')
         return cls.new(data_width, flags=flags)
@@ -51,10 +67,15 @@ class PipeSpec(NamedTuple):
     @property
     def as_int(self):
         """Convert a PipeSpec to a SpokeFPGA-compatible 32 bit integer."""
+        assert self.lanes == 1, 'SpokeFPGA pipes have one lane'
         return self.data_width | self.flags
 
     @property
     def data_width(self):
+        return self.lane_width * self.lanes
+
+    @property
+    def lane_width(self):
         return Record((('d', self.dsol), )).shape()[0]
 
     @property
@@ -65,6 +86,10 @@ class PipeSpec(NamedTuple):
     def start_stop(self):
         return bool(self.flags & START_STOP)
 
+    @property
+    def credit(self):
+        return bool(self.flags & CREDIT)
+
     def inlet(self, **kwargs):
         return PipeInlet(
             self,
@@ -89,8 +114,14 @@ class PipeSpec(NamedTuple):
 
     def _signals(self):
         # N.B., these need to be in the same order as SpokeFPGA uses.
+        if self.lanes > 1:
+            data_sol = Layout(
+                (f'lane_{k}', self.dsol) for k in range(self.lanes)
+            )
+        else:
+            data_sol = self.dsol
         sigs = (
-            SignalDesc('data', self.dsol),
+            SignalDesc('data', data_sol),
         )
         if self.flags & DATA_SIZE:
             size_bits = (self.data_width + 1).bit_length()
@@ -102,22 +133,33 @@ class PipeSpec(NamedTuple):
                 SignalDesc('stop', 1),
                 SignalDesc('start', 1),
             )
+        if self.lanes > 1:
+            sigs += (
+                SignalDesc('lane_valid', self.lanes),
+            )
         sigs += (
             SignalDesc('valid', 1),
-            SignalDesc('ready', 1, SignalDirection.UPSTREAM),
         )
+        if self.flags & CREDIT:
+            sigs += (
+                SignalDesc('credit', 1, SignalDirection.UPSTREAM),
+            )
+        else:
+            sigs += (
+                SignalDesc('ready', 1, SignalDirection.UPSTREAM),
+            )
         return sigs
 
     @property
     def payload_signals(self):
         def is_payload(name, shape, dir):
-            return name not in {'ready', 'valid'}
+            return name not in {'ready', 'valid', 'credit'}
         return self._filter_signals(is_payload)
 
     @property
     def handshake_signals(self):
         def is_handshake(name, shape, dir):
-            return name in {'ready', 'valid'}
+            return name in {'ready', 'valid', 'credit'}
         return self._filter_signals(is_handshake)
 
     @property
@@ -144,7 +186,7 @@ class PipeSpec(NamedTuple):
 _PipeSpec = PipeSpec
 del PipeSpec
 
-def PipeSpec(data_width_shape_or_layout, *, flags=0):
-    return _PipeSpec.new(data_width_shape_or_layout, flags=flags)
+def PipeSpec(data_width_shape_or_layout, *, flags=0, lanes=1):
+    return _PipeSpec.new(data_width_shape_or_layout, flags=flags, lanes=lanes)
 PipeSpec.__doc__ = _PipeSpec.new.__doc__
 PipeSpec.from_int = _PipeSpec.from_int
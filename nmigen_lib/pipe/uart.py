@@ -8,6 +8,8 @@ from nmigen_lib.util import Main, delay
 
 class P_UART(Elaboratable):
 
+    registered_ready = True
+
     def __init__(self, divisor, data_bits=8):
         self.divisor = divisor
         self.data_bits = data_bits
@@ -36,6 +38,8 @@ class P_UART(Elaboratable):
 
 class P_UARTTx(Elaboratable):
 
+    registered_ready = True
+
     def __init__(self, divisor, data_bits, outlet=None):
         if outlet is None:
             outlet = PipeSpec(data_bits).outlet()
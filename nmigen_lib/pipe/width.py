@@ -0,0 +1,268 @@
+#!/usr/bin/env nmigen
+
+from nmigen import Cat, Elaboratable, Module, Mux, Signal
+
+from nmigen_lib.util import Main
+
+from .spec import DATA_SIZE, START_STOP, PipeSpec
+
+"""
+Width converters -- pack narrow beats into wide ones and back.
+
+    up = PipeUpsizer(PipeSpec(8, flags=START_STOP), 4)
+    # up.data_in takes 8-bit beats, up.data_out sends 32-bit words.
+    down = PipeDownsizer(up.out_spec, 4)
+    # down.data_in takes 32-bit words, down.data_out sends 8-bit beats.
+
+The first beat goes in the least significant bits of the word.
+
+`data_size` counts valid bits.  `PipeUpsizer` closes a word early
+at the end of a packet (`stop`) or after a partial beat, so its
+output has `DATA_SIZE` whenever its input has `START_STOP` or
+`DATA_SIZE`.  `PipeDownsizer` only sends as many beats as the word's
+`data_size` covers; the last may be partial.  `start` goes with the
+first beat or word of a packet, `stop` with the last.
+
+Both run the narrow side at one beat per clock.
+"""
+
+
+class PipeUpsizer(Elaboratable):
+
+    def __init__(self, in_spec, ratio):
+        assert ratio >= 1, f'ratio must be positive, not {ratio}'
+        assert in_spec.lanes == 1, 'width converters take one-lane pipes'
+        flags = in_spec.flags
+        if flags & (START_STOP | DATA_SIZE):
+            flags |= DATA_SIZE
+        self.in_spec = in_spec
+        self.out_spec = PipeSpec(in_spec.data_width * ratio, flags=flags)
+        self.ratio = ratio
+
+        self.data_in = in_spec.outlet()
+        self.data_out = self.out_spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        in_width = self.in_spec.data_width
+        ratio = self.ratio
+
+        acc = Signal(in_width * (ratio - 1))    # beats so far
+        count = Signal(range(ratio))
+        word_start = Signal()
+        beat_size = in_width
+        if self.in_spec.data_size:
+            beat_size = data_in.i_data_size
+        # A word ends when it's full, at the end of a packet, or
+        # after a partial beat.
+        closing = Signal()
+        ends = count == ratio - 1
+        if self.in_spec.start_stop:
+            ends |= data_in.i_stop
+        if self.in_spec.data_size:
+            ends |= data_in.i_data_size < in_width
+        m.d.comb += closing.eq(ends)
+
+        m.d.comb += data_in.o_ready.eq(~data_out.full())
+        with m.If(data_out.sent()):
+            m.d.sync += data_out.o_valid.eq(False)
+        with m.If(data_in.received()):
+            with m.If(closing):
+                m.d.sync += [
+                    count.eq(0),
+                    data_out.o_valid.eq(True),
+                ]
+                if self.in_spec.start_stop:
+                    m.d.sync += [
+                        data_out.o_start.eq(Mux(count == 0,
+                                                data_in.i_start,
+                                                word_start)),
+                        data_out.o_stop.eq(data_in.i_stop),
+                    ]
+            with m.Else():
+                m.d.sync += count.eq(count + 1)
+            if self.in_spec.start_stop:
+                with m.If(count == 0):
+                    m.d.sync += word_start.eq(data_in.i_start)
+            with m.Switch(count):
+                for k in range(ratio):
+                    with m.Case(k):
+                        if k < ratio - 1:
+                            m.d.sync += (
+                                acc[k * in_width:(k + 1) * in_width]
+                                .eq(data_in.i_data)
+                            )
+                        with m.If(closing):
+                            m.d.sync += data_out.o_data.eq(
+                                Cat(acc[:k * in_width], data_in.i_data))
+                            if self.out_spec.data_size:
+                                m.d.sync += data_out.o_data_size.eq(
+                                    k * in_width + beat_size)
+        return m
+
+
+class PipeDownsizer(Elaboratable):
+
+    def __init__(self, in_spec, ratio):
+        assert ratio >= 1, f'ratio must be positive, not {ratio}'
+        assert in_spec.lanes == 1, 'width converters take one-lane pipes'
+        assert in_spec.data_width % ratio == 0, (
+            f'{in_spec.data_width} bits do not divide into {ratio} beats'
+        )
+        self.in_spec = in_spec
+        self.out_spec = PipeSpec(in_spec.data_width // ratio,
+                                 flags=in_spec.flags)
+        self.ratio = ratio
+
+        self.data_in = in_spec.outlet()
+        self.data_out = self.out_spec.inlet()
+
+    def elaborate(self, platform):
+        m = Module()
+        data_in = self.data_in
+        data_out = self.data_out
+        out_width = self.out_spec.data_width
+        ratio = self.ratio
+
+        word = Signal(self.in_spec.data_width)
+        count = Signal(range(ratio))
+        word_start = Signal()
+        word_stop = Signal()
+        last = Signal()
+        m.d.comb += data_out.o_data.eq(word.word_select(count, out_width))
+        if self.in_spec.data_size:
+            # Bits not yet sent, including this beat.
+            remaining = Signal.like(data_in.i_data_size)
+            m.d.comb += [
+                last.eq((count == ratio - 1) | (remaining <= out_width)),
+                data_out.o_data_size.eq(Mux(last, remaining, out_width)),
+            ]
+            with m.If(data_in.received()):
+                m.d.sync += remaining.eq(data_in.i_data_size)
+            with m.Elif(data_out.sent()):
+                m.d.sync += remaining.eq(remaining - out_width)
+        else:
+            m.d.comb += last.eq(count == ratio - 1)
+        if self.in_spec.start_stop:
+            m.d.comb += [
+                data_out.o_start.eq(word_start & (count == 0)),
+                data_out.o_stop.eq(word_stop & last),
+            ]
+
+        m.d.comb += data_in.o_ready.eq(~data_out.o_valid |
+                                       (data_out.i_ready & last))
+        with m.If(data_in.received()):
+            m.d.sync += [
+                word.eq(data_in.i_data),
+                count.eq(0),
+                data_out.o_valid.eq(True),
+            ]
+            if self.in_spec.start_stop:
+                m.d.sync += [
+                    word_start.eq(data_in.i_start),
+                    word_stop.eq(data_in.i_stop),
+                ]
+        with m.Elif(data_out.sent()):
+            with m.If(last):
+                m.d.sync += data_out.o_valid.eq(False)
+            with m.Else():
+                m.d.sync += count.eq(count + 1)
+        return m
+
+
+if __name__ == '__main__':
+    # 8-bit packets of 1 to 10 bytes go up to 32 bits and back down.
+    spec = PipeSpec(8, flags=START_STOP)
+
+    class Top(Elaboratable):
+
+        def __init__(self):
+            self.up = PipeUpsizer(spec, 4)
+            self.down = PipeDownsizer(self.up.out_spec, 4)
+            self.data_in = self.up.data_in
+            self.words = self.up.data_out
+            self.data_out = self.down.data_out
+
+        def elaborate(self, platform):
+            m = Module()
+            m.submodules.up = self.up
+            m.submodules.down = self.down
+            m.d.comb += self.up.data_out.flow_to(self.down.data_in)
+            return m
+
+    design = Top()
+    design.data_in.leave_unconnected()
+    design.data_out.leave_unconnected()
+    assert design.up.out_spec == PipeSpec(32, flags=START_STOP | DATA_SIZE)
+    assert design.down.out_spec == PipeSpec(8, flags=START_STOP | DATA_SIZE)
+
+    packets = [bytes((n * 13 + i) & 0xFF for i in range(n % 10 + 1))
+               for n in range(20)]
+    beats = [(byte, i == 0, i == len(p) - 1)
+             for p in packets
+             for (i, byte) in enumerate(p)]
+
+    with Main(design).sim as sim:
+
+        @sim.sync_process
+        def send():
+            data_in = design.data_in
+            n = 0
+            cycle = 0
+            while n < len(beats):
+                (byte, start, stop) = beats[n]
+                pausing = cycle % 7 == 3
+                yield data_in.i_valid.eq(not pausing)
+                yield data_in.i_data.eq(byte)
+                yield data_in.i_start.eq(start)
+                yield data_in.i_stop.eq(stop)
+                yield
+                cycle += 1
+                if not pausing and (yield data_in.o_ready):
+                    n += 1
+            yield data_in.i_valid.eq(False)
+
+        @sim.sync_process
+        def check_words():
+            # Words carry the packet's bytes, 4 at a time.
+            words = design.words
+            expected = []
+            for p in packets:
+                for i in range(0, len(p), 4):
+                    chunk = p[i:i + 4]
+                    expected.append((int.from_bytes(chunk, 'little'),
+                                     8 * len(chunk),
+                                     i == 0,
+                                     i + 4 >= len(p)))
+            n = 0
+            while n < len(expected):
+                yield
+                if (yield words.o_valid) and (yield words.i_ready):
+                    got = ((yield words.o_data),
+                           (yield words.o_data_size),
+                           bool((yield words.o_start)),
+                           bool((yield words.o_stop)))
+                    assert got == expected[n], (
+                        f'word {n}: got {got}, wanted {expected[n]}')
+                    n += 1
+
+        @sim.sync_process
+        def receive():
+            data_out = design.data_out
+            n = 0
+            cycle = 0
+            while n < len(beats):
+                stalling = cycle % 11 in {5, 6}
+                yield data_out.i_ready.eq(not stalling)
+                yield
+                cycle += 1
+                if not stalling and (yield data_out.o_valid):
+                    got = ((yield data_out.o_data),
+                           bool((yield data_out.o_start)),
+                           bool((yield data_out.o_stop)))
+                    assert got == beats[n], (
+                        f'beat {n}: got {got}, wanted {beats[n]}')
+                    assert (yield data_out.o_data_size) == 8
+                    n += 1
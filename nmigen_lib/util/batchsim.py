@@ -0,0 +1,356 @@
+#!/usr/bin/env nmigen
+
+import numpy as np
+
+from nmigen import Const
+
+from .fastsim import _Emitter, _Netlist, _RHSCompiler, _StatementCompiler
+from .fastsim import _mask, _topological_order
+
+"""
+Evaluate a small design on many input vectors at once.
+
+`BatchSim` compiles a combinational design, or one with a single
+clock domain, to NumPy array expressions.  Each input is an array
+with one element per test vector, so thousands or millions of
+vectors are evaluated in one pass instead of one per simulated
+clock.
+
+    dp = DigitPattern()
+    bs = BatchSim(dp, inputs=[dp.digit_in], outputs=[dp.segments_out])
+    (segments, ) = bs(np.arange(16))
+    bs.check(reference, exhaustive(dp.digit_in))
+
+A design with synchronous logic is clocked once from reset with
+the inputs held, so a registered output like `Mul.product` holds
+the result for its inputs.
+
+All signals must be narrower than 63 bits.
+"""
+
+MAX_WIDTH = 62
+
+
+def exhaustive(*signals):
+    """Every combination of values of `signals`, as one array per signal."""
+    width = sum(len(sig) for sig in signals)
+    assert width <= 24, f'{width} input bits is too many to test exhaustively'
+    counts = np.arange(1 << width, dtype=np.int64)
+    arrays = []
+    for sig in signals:
+        arrays.append(_normalize_array(counts & _mask(len(sig)), sig.shape()))
+        counts = counts >> len(sig)
+    return arrays
+
+def random_vectors(signals, count, seed=None):
+    """`count` random values of each of `signals`."""
+    rng = np.random.default_rng(seed)
+    return [
+        _normalize_array(rng.integers(0, 1 << len(sig), count, dtype=np.int64),
+                         sig.shape())
+        for sig in signals
+    ]
+
+def _normalize_array(values, shape):
+    values = np.asarray(values, dtype=np.int64) & _mask(shape.width)
+    if shape.signed and shape.width:
+        half = 1 << (shape.width - 1)
+        values = (values ^ half) - half
+    return values
+
+def _select(index, choices):
+    index, *choices = np.broadcast_arrays(index, *choices)
+    # Pick along the stacked axis, so vectors of any shape work.
+    return np.take_along_axis(np.stack(choices), index[np.newaxis], 0)[0]
+
+def _parity(x):
+    for shift in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> shift)
+    return x & 1
+
+_GLOBALS = {
+    'np': np,
+    '_i': lambda x: np.asarray(x, dtype=np.int64),
+    '_where': np.where,
+    '_select': _select,
+    '_parity': _parity,
+}
+
+
+class _VectorRHSCompiler(_RHSCompiler):
+
+    def on_Operator(self, value):
+        op = value.operator
+        ops = value.operands
+        if op in ('b', 'r|', 'r&', '==', '!=', '<', '<=', '>', '>='):
+            # Comparisons give bool arrays; the rest of the
+            # arithmetic wants ints.
+            return f'_i{super().on_Operator(value)}'
+        if op == 'r^':
+            (arg, ) = ops
+            return f'_parity({self(arg)} & {_mask(len(arg))})'
+        if op == '//':
+            (lhs, rhs) = ops
+            a = self.normalized(lhs)
+            b = self.emitter.def_var('div', self.normalized(rhs))
+            return f'_where({b} == 0, 0, {a} // _where({b} == 0, 1, {b}))'
+        if op == 'm':
+            (sel, val1, val0) = ops
+            return (f'_where({self(sel)} & {_mask(len(sel))}, '
+                    f'{self(val1)}, {self(val0)})')
+        return super().on_Operator(value)
+
+    def on_ArrayProxy(self, value):
+        elems = list(value.elems)
+        if not elems:
+            return '0'
+        index = (f'np.minimum({self(value.index)} & {_mask(len(value.index))}, '
+                 f'{len(elems) - 1})')
+        return f"_select({index}, ({', '.join(self(e) for e in elems)}, ))"
+
+
+class _VectorStatementCompiler(_StatementCompiler):
+
+    """Compile statements to masked array updates.
+
+    A statement inside a `Switch` case only updates the vectors for
+    which the case matches.
+    """
+
+    def __init__(self, netlist, emitter, inputs):
+        super().__init__(netlist, emitter, dict_mode=False, inputs=inputs)
+        self.rhs = _VectorRHSCompiler(netlist, emitter, inputs)
+        self.cond = None
+
+    def write_next(self, signal, expr):
+        index = self.netlist.index(signal)
+        if self.cond is None:
+            self.emitter.append(f'n{index} = {expr} + z')
+        else:
+            self.emitter.append(f'n{index} = _where({self.cond}, {expr}, n{index})')
+
+    def lhs_array(self, value, expr):
+        emitter = self.emitter
+        elems = list(value.elems)
+        if not elems:
+            return
+        index = emitter.def_var('index',
+            f'np.minimum({self.rhs(value.index)} & {_mask(len(value.index))}, '
+            f'{len(elems) - 1})')
+        arg = emitter.def_var('arg', expr)
+        outer = self.cond
+        for (i, elem) in enumerate(elems):
+            self.cond = self._and(outer, f'({index} == {i})')
+            self.lhs(elem, arg)
+        self.cond = outer
+
+    def on_Switch(self, stmt):
+        emitter = self.emitter
+        test = emitter.def_var('test',
+            f'{self.rhs(stmt.test)} & {_mask(len(stmt.test))}')
+        outer = rest = self.cond
+        for (patterns, stmts) in stmt.cases.items():
+            if not patterns:
+                self.cond = rest
+                self.on_statements(stmts)
+                break
+            checks = []
+            for pattern in patterns:
+                mask = int(''.join('0' if b == '-' else '1' for b in pattern), 2)
+                value = int(''.join('0' if b == '-' else b for b in pattern), 2)
+                checks.append(f'({test} & {mask} == {value})')
+            match = emitter.def_var('match', ' | '.join(checks))
+            self.cond = self._and(rest, match)
+            self.on_statements(stmts)
+            rest = self._and(rest, f'~{match}')
+        self.cond = outer
+
+    def _and(self, cond, term):
+        if cond is None:
+            return self.emitter.def_var('cond', term)
+        return self.emitter.def_var('cond', f'{cond} & {term}')
+
+
+class BatchSim:
+
+    def __init__(self, design, inputs, outputs):
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        netlist = _Netlist(design)
+        for sig in netlist.signals:
+            assert len(sig) <= MAX_WIDTH, (
+                f'signal {sig.name} is too wide ({len(sig)} bits) '
+                f'for batched evaluation')
+        assert len(netlist.sync_stmts) <= 1, (
+            'batched evaluation needs a design with at most one clock domain')
+        self._netlist = netlist
+        self._input_indexes = [netlist.index(sig) for sig in self.inputs]
+        self._output_indexes = [netlist.index(sig) for sig in self.outputs]
+        self._resets = [Const.normalize(sig.reset, sig.shape())
+                        for sig in netlist.signals]
+        self._comb, self._iterate = self._compile_comb()
+        self._sync = [self._compile_sync(stmts)
+                      for stmts in netlist.sync_stmts.values()]
+
+    def _compile_comb(self):
+        netlist = self._netlist
+        emitter = _Emitter()
+        emitter.globals.update(_GLOBALS)
+        emitter.append('def comb(v, z):')
+        emitter.level += 1
+        writers = {}
+        groups = []
+        for (g, (outputs, stmts)) in enumerate(netlist.comb_groups):
+            inputs = set()
+            body = _Emitter()
+            body.count = emitter.count
+            compiler = _VectorStatementCompiler(netlist, body, inputs)
+            out_indexes = [netlist.index(sig) for sig in outputs]
+            for (sig, index) in zip(outputs, out_indexes):
+                body.append(f'n{index} = {self._resets[index]} + z')
+            compiler(stmts)
+            for index in out_indexes:
+                body.append(f'v[{index}] = n{index}')
+                writers[index] = g
+            emitter.count = body.count
+            emitter.globals.update(body.globals)
+            groups.append((body.lines, inputs))
+        deps = [{writers[i] for i in inputs if i in writers and writers[i] != g}
+                for (g, (_, inputs)) in enumerate(groups)]
+        order = _topological_order(deps)
+        for g in order:
+            for line in groups[g][0]:
+                emitter.append(line)
+        emitter.append('pass')
+        # Groups that feed each other can't be put in order.  Evaluate
+        # them until they're stable.
+        iterate = _has_cycle(deps)
+        return emitter.compile('comb'), iterate
+
+    def _compile_sync(self, stmts):
+        netlist = self._netlist
+        emitter = _Emitter()
+        emitter.globals.update(_GLOBALS)
+        emitter.append('def tick(v, z):')
+        emitter.level += 1
+        inputs = set()
+        outputs = {netlist.index(sig)
+                   for stmt in stmts for sig in stmt._lhs_signals()}
+        for index in sorted(outputs):
+            emitter.append(f'n{index} = v[{index}]')
+        _VectorStatementCompiler(netlist, emitter, inputs)(stmts)
+        for index in sorted(outputs):
+            emitter.append(f'v[{index}] = n{index}')
+        return emitter.compile('tick')
+
+    def __call__(self, *inputs):
+        """Evaluate the design.  Return one array per output."""
+        assert len(inputs) == len(self.inputs), (
+            f'expected {len(self.inputs)} input arrays, got {len(inputs)}')
+        inputs = [np.asarray(values) for values in inputs]
+        shape = np.broadcast_shapes(*(values.shape for values in inputs))
+        z = np.zeros(shape, dtype=np.int64)
+        v = [reset + z for reset in self._resets]
+        for (index, sig, values) in zip(self._input_indexes, self.inputs, inputs):
+            v[index] = _normalize_array(values, sig.shape()) + z
+        self._settle(v, z)
+        for tick in self._sync:
+            tick(v, z)
+            self._settle(v, z)
+        return tuple(v[index] for index in self._output_indexes)
+
+    def _settle(self, v, z):
+        # Inputs are held; the design doesn't drive them.
+        held = [(index, v[index]) for index in self._input_indexes]
+        for _ in range(16 if self._iterate else 1):
+            before = list(v)
+            self._comb(v, z)
+            for (index, values) in held:
+                v[index] = values
+            if not self._iterate or all(
+                    np.array_equal(a, b) for (a, b) in zip(before, v)):
+                return
+        raise RuntimeError('combinational logic did not settle')
+
+    def check(self, reference, inputs, limit=10):
+        """Assert that the design matches `reference` on every input vector.
+
+        `reference` takes one array per input and returns one array
+        per output.  Up to `limit` mismatches are reported.
+        """
+        actual = self(*inputs)
+        expected = reference(*inputs)
+        if len(self.outputs) == 1 and not isinstance(expected, tuple):
+            expected = (expected, )
+        bad = np.zeros(actual[0].shape, dtype=bool)
+        for (sig, got, want) in zip(self.outputs, actual, expected):
+            bad |= got != _normalize_array(want, sig.shape())
+        if not bad.any():
+            return
+        lines = []
+        for i in np.flatnonzero(bad)[:limit]:
+            ins = ', '.join(f'{sig.name}={values.flat[i]:#x}'
+                            for (sig, values)
+                            in zip(self.inputs, np.broadcast_arrays(*inputs)))
+            outs = ', '.join(
+                f'{sig.name}={got.flat[i]:#x} (expected '
+                f'{np.broadcast_to(want, got.shape).flat[i]:#x})'
+                for (sig, got, want) in zip(self.outputs, actual, expected))
+            lines.append(f'  {ins}: {outs}')
+        raise AssertionError(
+            f'{bad.sum()} of {bad.size} vectors mismatched:\n'
+            + '\n'.join(lines))
+
+
+def _has_cycle(deps):
+    # True if the groups can't all be placed after their inputs.
+    placed = set()
+    for g in _topological_order(deps):
+        if not deps[g] <= placed:
+            return True
+        placed.add(g)
+    return False
+
+
+if __name__ == '__main__':
+    import time
+
+    from nmigen import Array, Module, Signal
+
+    from nmigen_lib.mul import Mul
+    from nmigen_lib.seven_segment.digit_pattern import DigitPattern
+
+    SEGMENTS = [0x3F, 0x06, 0x5B, 0x4F, 0x66, 0x6D, 0x7D, 0x07,
+                0x7F, 0x6F, 0x77, 0x7C, 0x39, 0x5E, 0x79, 0x71]
+
+    def timed(label, f):
+        start = time.perf_counter()
+        f()
+        print(f'{label}: ok in {time.perf_counter() - start:.3f} s')
+
+    dp = DigitPattern()
+    bs = BatchSim(dp, inputs=[dp.digit_in], outputs=[dp.segments_out])
+    timed('DigitPattern, all 16 digits',
+          lambda: bs.check(lambda d: np.array(SEGMENTS)[d],
+                           exhaustive(dp.digit_in)))
+
+    for signed in (False, True):
+        mul = Mul(signed=signed)
+        bs = BatchSim(mul,
+                      inputs=[mul.multiplicand, mul.multiplier],
+                      outputs=[mul.product])
+        timed(f'Mul(signed={signed}), 1,000,000 random vectors',
+              lambda: bs.check(lambda a, b: a * b,
+                               random_vectors(bs.inputs, 1_000_000, seed=1)))
+
+    # A two-level Array, fed a grid of vectors.
+    m = Module()
+    row, col = Signal(2), Signal(2)
+    entry = Signal(8)
+    table = Array(Array(Const(4 * r + c, 8) for c in range(3))
+                  for r in range(3))
+    m.d.comb += entry.eq(table[row][col])
+    bs = BatchSim(m, inputs=[row, col], outputs=[entry])
+    grid = np.meshgrid(np.arange(3), np.arange(3), indexing='ij')
+    timed('Array of Arrays, 3x3 grid of vectors',
+          lambda: bs.check(lambda r, c: 4 * r + c, grid))
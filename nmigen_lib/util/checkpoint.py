@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+
+from nmigen import Value
+
+from .fastsim import _DELAY, _DONE, _SETTLE, _TICK
+
+"""
+Save a `FastSimulator` run part way and resume it later.
+
+A checkpoint holds
+
+  * the value of every signal in the design, which includes FSM
+    states and memory contents,
+
+  * the simulated time and the phase of every clock, and
+
+  * each process's progress: how many commands it has yielded, the
+    values it has read, and what it is waiting for.
+
+Python generators can't be saved, so a process is restored by
+running it again from the start, feeding it its recorded reads
+instead of simulating.  That takes a tiny fraction of the time the
+simulation took, but it assumes the processes are deterministic:
+given the same reads, they yield the same commands.  Call
+`sim.record_progress()` before running a simulation that will be
+checkpointed.
+
+The design's state has a fixed size, but the recorded reads go back
+to time zero, so the file grows, and restoring slows down, in
+proportion to how many values the processes have read up to the
+checkpoint.  A testbench that reads a signal every cycle of a
+multi-million-cycle run makes a checkpoint of millions of values.
+Checkpoints suit runs whose processes read little, e.g., ones that
+stimulate the design and then only wait, or that have finished.
+
+The checkpoint is gzipped JSON.  It can only be restored into the
+same design with the same processes; a fingerprint of the design's
+signals is checked.
+
+    $ python -m nmigen_lib.i2s simulate -b fast \\
+        --checkpoint-at 10000 --checkpoint warm.ckpt
+    $ python -m nmigen_lib.i2s simulate -b fast --restore warm.ckpt
+"""
+
+VERSION = 1
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def design_fingerprint(netlist):
+    h = hashlib.sha256()
+    for signal in netlist.signals[:netlist.design_signals]:
+        h.update(f'{signal.name}:{signal.width}:{signal.signed};'.encode())
+    return h.hexdigest()
+
+def save_checkpoint(sim, path):
+    """Write `sim`'s state to the file at `path`."""
+    engine = sim._engine
+    procs = sim._processes
+    if not sim._recording:
+        raise CheckpointError('call record_progress() before running '
+                              'a simulation that will be checkpointed')
+    index = {id(proc): i for (i, proc) in enumerate(procs)}
+    state = {
+        'version': VERSION,
+        'design': design_fingerprint(engine.netlist),
+        'now': sim._now,
+        'values': engine.get_state(),
+        'clocks': {clock.domain: clock.edge for clock in sim._clocks},
+        'processes': [
+            {
+                'wait': proc.wait,
+                'passive': proc.passive,
+                'yields': proc.yields,
+                'reads': proc.reads,
+            }
+            for proc in procs
+        ],
+        'tick_waiters': {
+            domain: [index[id(proc)] for proc in waiters]
+            for (domain, waiters) in sim._tick_waiters.items()
+        },
+        'delay_waiters': [
+            (deadline, seq, index[id(proc)])
+            for (deadline, seq, proc) in sorted(sim._delay_waiters,
+                                                key=lambda w: w[:2])
+        ],
+        'seq': sim._seq,
+    }
+    with gzip.open(path, 'wt') as f:
+        json.dump(state, f, separators=(',', ':'))
+
+def load_checkpoint(sim, path):
+    """Restore `sim` from the file at `path`.
+
+    `sim` must have the same clocks and processes as the simulation
+    that was saved, and must not have been run yet.
+    """
+    if sim._started:
+        raise CheckpointError('cannot restore a simulation that has started')
+    with gzip.open(path, 'rt') as f:
+        state = json.load(f)
+    if state.get('version') != VERSION:
+        raise CheckpointError(f'{path}: unknown checkpoint version')
+    engine = sim._engine
+    if state['design'] != design_fingerprint(engine.netlist):
+        raise CheckpointError(f'{path}: checkpoint is for a different design')
+    procs = sim._processes
+    if len(state['processes']) != len(procs):
+        raise CheckpointError(f'{path}: checkpoint has '
+                              f'{len(state["processes"])} processes, '
+                              f'simulation has {len(procs)}')
+    if set(state['clocks']) != {clock.domain for clock in sim._clocks}:
+        raise CheckpointError(f'{path}: checkpoint has different clocks')
+
+    for (proc, saved) in zip(procs, state['processes']):
+        _replay(proc, saved)
+    engine.set_state(state['values'])
+    sim._now = state['now']
+    for clock in sim._clocks:
+        clock.advance(state['clocks'][clock.domain])
+    sim._tick_waiters = {
+        domain: [procs[i] for i in waiters]
+        for (domain, waiters) in state['tick_waiters'].items()
+    }
+    sim._settle_waiters = []
+    sim._delay_waiters = [(deadline, seq, procs[i])
+                          for (deadline, seq, i) in state['delay_waiters']]
+    sim._seq = state['seq']
+    sim._started = True
+    sim.record_progress()
+
+def _replay(proc, saved):
+    # Run a fresh process up to the saved point, answering its reads
+    # from the recording.
+    reads = saved['reads']
+    proc.wait = saved['wait']
+    proc.passive = saved['passive']
+    proc.yields = saved['yields']
+    proc.reads = list(reads)
+    if proc.wait == _DONE:
+        return
+    assert proc.wait in (_TICK, _DELAY, _SETTLE)
+    coroutine = proc.coroutine
+    reads = iter(reads)
+    response = None
+    try:
+        for _ in range(saved['yields']):
+            command = coroutine.send(response)
+            response = next(reads) if isinstance(command, Value) else None
+    except (StopIteration, RuntimeError) as e:
+        raise CheckpointError(f'process {proc.name} did not replay the same '
+                              f'way; is it deterministic?') from e
@@ -0,0 +1,447 @@
+import ctypes
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+from nmigen.hdl.ast import Const
+
+from .fastsim import FastSimulator, _EngineBase
+from .gencache import default_cache_dir
+
+"""
+A native simulation backend for `Main`, built with Yosys CXXRTL.
+
+Select it with `simulate --backend cxxrtl`.  `Main` converts the
+design to RTLIL (through the generate cache), Yosys translates the
+RTLIL to C++, and the C++ compiler builds a shared library that is
+loaded with ctypes.  `SimBuilder` processes are scheduled by
+`fastsim` exactly as with `--backend fast`; only the design runs
+natively.
+
+The library is cached under `cxxrtl` in the `gencache` directory,
+keyed by the RTLIL text and the toolchain, so an unchanged design
+is only compiled once.
+
+Processes can read any signal that survives into the compiled
+design: ports always do, and named internal signals usually do.
+They should only write the design's inputs.  When no process is
+waiting for a clock, e.g., after the testbench finishes in a
+`--clocks N` run, the clock is toggled in a native loop.
+
+The tools are found as `$YOSYS` (default `yosys`) and `$CXX`
+(default `c++`).  Verilator is not supported; it has no C API to
+look signals up by name.
+"""
+
+# C API implementation files, relative to Yosys's include directory.
+# Their location has moved between Yosys releases.
+CAPI_SOURCES = [
+    ('backends/cxxrtl/runtime',
+     ['cxxrtl/capi/cxxrtl_capi.cc', 'cxxrtl/capi/cxxrtl_capi_vcd.cc']),
+    ('.',
+     ['backends/cxxrtl/cxxrtl_capi.cc', 'backends/cxxrtl/cxxrtl_vcd_capi.cc']),
+]
+
+BRIDGE_SOURCE = '''\
+#include "design.cc"
+{capi_includes}
+
+extern "C" void nmigen_lib_run_clock(cxxrtl_handle handle,
+                                     cxxrtl_object *clk, size_t edges,
+                                     cxxrtl_vcd vcd, uint64_t time,
+                                     uint64_t half_period) {{
+    for (size_t i = 0; i < edges; i++) {{
+        clk->next[0] ^= 1;
+        cxxrtl_step(handle);
+        if (vcd) {{
+            time += half_period;
+            cxxrtl_vcd_sample(vcd, time);
+        }}
+    }}
+}}
+'''
+
+
+class CxxrtlError(Exception):
+    pass
+
+
+class _CxxrtlObject(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('width', ctypes.c_size_t),
+        ('lsb_at', ctypes.c_size_t),
+        ('depth', ctypes.c_size_t),
+        ('zero_at', ctypes.c_size_t),
+        ('curr', ctypes.POINTER(ctypes.c_uint32)),
+        ('next', ctypes.POINTER(ctypes.c_uint32)),
+    ]
+
+_VCD_FILTER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_char_p,
+                               ctypes.POINTER(_CxxrtlObject))
+
+
+class CxxrtlBuild:
+
+    """Builds and caches the native library for an RTLIL design."""
+
+    def __init__(self, cache_dir=None, yosys=None, cxx=None):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(),
+                                      'cxxrtl')
+        self.yosys = yosys or os.environ.get('YOSYS', 'yosys')
+        self.cxx = cxx or os.environ.get('CXX', 'c++')
+        self.cxxflags = ['-std=c++14', '-O2', '-shared', '-fPIC']
+
+    def library(self, rtlil_text, top='top'):
+        """Return the path of the design's library, building it if needed."""
+        key = self._key(rtlil_text, top)
+        path = os.path.join(self.cache_dir, key + '.so')
+        if not os.path.exists(path):
+            self._build(rtlil_text, top, path)
+        return path
+
+    def _key(self, rtlil_text, top):
+        h = hashlib.sha256()
+        for item in (rtlil_text, top, self._tool_version(self.yosys),
+                     self._tool_version(self.cxx), *self.cxxflags):
+            h.update(item.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _tool_version(self, tool):
+        return self._run([tool, '--version']).splitlines()[0]
+
+    def _include_dir(self):
+        datdir = self._run([self.yosys + '-config', '--datdir']).strip()
+        return os.path.join(datdir, 'include')
+
+    def _build(self, rtlil_text, top, path):
+        include_dir = self._include_dir()
+        for (subdir, sources) in CAPI_SOURCES:
+            root = os.path.join(include_dir, subdir)
+            if all(os.path.exists(os.path.join(root, s)) for s in sources):
+                break
+        else:
+            raise CxxrtlError(f'CXXRTL C API not found in {include_dir}')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.cache_dir,
+                                         prefix='.build') as build_dir:
+            with open(os.path.join(build_dir, 'design.il'), 'w') as f:
+                f.write(rtlil_text)
+            self._run([self.yosys, '-q', '-p',
+                       f'read_rtlil design.il; hierarchy -top {top}; '
+                       f'write_cxxrtl design.cc'], cwd=build_dir)
+            capi_includes = '\n'.join(f'#include <{s}>' for s in sources)
+            with open(os.path.join(build_dir, 'bridge.cc'), 'w') as f:
+                f.write(BRIDGE_SOURCE.format(capi_includes=capi_includes))
+            tmp_lib = os.path.join(build_dir, 'design.so')
+            self._run([self.cxx, *self.cxxflags,
+                       f'-I{include_dir}', f'-I{root}',
+                       'bridge.cc', '-o', tmp_lib], cwd=build_dir)
+            # Rename so that concurrent builds never load a partial file.
+            os.replace(tmp_lib, path)
+
+    def _run(self, cmd, cwd=None):
+        if shutil.which(cmd[0]) is None:
+            raise CxxrtlError(f'{cmd[0]}: not found; '
+                              f'the cxxrtl backend needs Yosys and a C++ compiler')
+        proc = subprocess.run(cmd, cwd=cwd,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              universal_newlines=True)
+        if proc.returncode:
+            raise CxxrtlError(f'{" ".join(cmd)} failed:\n{proc.stdout}')
+        return proc.stdout
+
+
+class _CxxrtlLibrary:
+
+    def __init__(self, path):
+        lib = ctypes.CDLL(path)
+        obj_p = ctypes.POINTER(_CxxrtlObject)
+        lib.cxxrtl_design_create.restype = ctypes.c_void_p
+        lib.cxxrtl_create.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_create.restype = ctypes.c_void_p
+        lib.cxxrtl_destroy.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_step.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_step.restype = ctypes.c_size_t
+        lib.cxxrtl_get_parts.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t)]
+        lib.cxxrtl_get_parts.restype = obj_p
+        lib.cxxrtl_vcd_create.restype = ctypes.c_void_p
+        lib.cxxrtl_vcd_destroy.argtypes = [ctypes.c_void_p]
+        lib.cxxrtl_vcd_timescale.argtypes = [
+            ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p]
+        lib.cxxrtl_vcd_add_from_if.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, _VCD_FILTER]
+        lib.cxxrtl_vcd_sample.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+        lib.cxxrtl_vcd_read.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p),
+            ctypes.POINTER(ctypes.c_size_t)]
+        lib.nmigen_lib_run_clock.argtypes = [
+            ctypes.c_void_p, obj_p, ctypes.c_size_t,
+            ctypes.c_void_p, ctypes.c_uint64, ctypes.c_uint64]
+        self.lib = lib
+
+
+class _NativeSlots:
+
+    """Signal values in the native design, indexed like `netlist.signals`."""
+
+    def __init__(self, lib, handle, netlist):
+        self.lib = lib
+        self.handle = handle
+        self.netlist = netlist
+        self.objects = {}
+
+    def object(self, index):
+        try:
+            return self.objects[index]
+        except KeyError:
+            pass
+        signal = self.netlist.signals[index]
+        parts = ctypes.c_size_t()
+        for path in sorted(self.netlist.names.get(signal, ()), key=len):
+            name = ' '.join(map(str, path[1:])).encode()
+            obj = self.lib.cxxrtl_get_parts(self.handle, name,
+                                            ctypes.byref(parts))
+            if obj and parts.value == 1:
+                self.objects[index] = obj.contents
+                return obj.contents
+        raise CxxrtlError(f'signal {signal.name!r} is not visible in the '
+                          f'compiled design')
+
+    def __getitem__(self, index):
+        obj = self.object(index)
+        curr = obj.curr
+        value = 0
+        for i in range((obj.width + 31) // 32):
+            value |= curr[i] << (32 * i)
+        return Const.normalize(value, self.netlist.signals[index].shape())
+
+    def __setitem__(self, index, value):
+        obj = self.object(index)
+        value &= (1 << obj.width) - 1
+        for i in range((obj.width + 31) // 32):
+            obj.next[i] = (value >> (32 * i)) & 0xFFFFFFFF
+
+
+class _CxxrtlEngine(_EngineBase):
+
+    def __init__(self, netlist, library_path):
+        super().__init__(netlist)
+        self.library = _CxxrtlLibrary(library_path)
+        lib = self.library.lib
+        self.handle = lib.cxxrtl_create(lib.cxxrtl_design_create())
+        self.v = _NativeSlots(lib, self.handle, netlist)
+        self.on_settle = None
+        self._dirty = True
+
+    def tick(self, domain_name):
+        # Registers update in the native design when the clock is
+        # committed.
+        return {}
+
+    def commit(self, changes):
+        for (index, value) in changes.items():
+            self.v[index] = value
+        if changes:
+            self._dirty = True
+
+    def settle(self):
+        if self._dirty:
+            self.library.lib.cxxrtl_step(self.handle)
+            self._dirty = False
+        if self.on_settle is not None:
+            self.on_settle()
+
+    def commit_clocks(self, changes):
+        # Step the edge on its own, so the flops capture the values
+        # from before it, not the testbench's writes made at it.
+        self.commit(changes)
+        if self._dirty:
+            self.library.lib.cxxrtl_step(self.handle)
+            self._dirty = False
+
+    def run_clock(self, clock_index, edges, vcd=None, time=0, half_period=0):
+        """Toggle a clock `edges` times without returning to Python."""
+        self.library.lib.nmigen_lib_run_clock(
+            self.handle, ctypes.byref(self.v.object(clock_index)), edges,
+            vcd, time, half_period)
+
+    def close(self):
+        if self.handle:
+            self.library.lib.cxxrtl_destroy(self.handle)
+            self.handle = None
+
+
+class CxxrtlSimulator(FastSimulator):
+
+    """`FastSimulator`'s scheduler driving a CXXRTL build of the design.
+
+    `rtlil_text` must be the RTLIL for `design`, e.g., from
+    `Main._convert('il', fragment)`.  `design` may be that
+    already-elaborated `Fragment`: designs that connect pipes in
+    `elaborate` can only be elaborated once.
+    """
+
+    def __init__(self, design, rtlil_text, *, top='top', build=None):
+        self._library_path = (build or CxxrtlBuild()).library(rtlil_text, top)
+        super().__init__(design)
+
+    def _create_engine(self, netlist):
+        return _CxxrtlEngine(netlist, self._library_path)
+
+    def __exit__(self, *args):
+        super().__exit__(*args)
+        self._engine.close()
+
+    def start_waveform(self, trace_filter, *, vcd_file, gtkw_file=None,
+                       traces=()):
+        if self._started:
+            raise ValueError('Cannot start writing waveforms after '
+                             'starting the simulation')
+        self._tracer = _CxxrtlVCDTracer(self._engine, trace_filter,
+                                        vcd_file, gtkw_file)
+
+    def run_until(self, deadline, *, run_passive=False):
+        while self._now < deadline:
+            if self._started and self._can_run_natively():
+                self._run_natively(deadline)
+                return True
+            if not self.step() and not run_passive:
+                return False
+            if not self._can_advance():
+                return False
+        return True
+
+    def _can_run_natively(self):
+        return (len(self._clocks) == 1 and not self._delay_waiters
+                and not self._settle_waiters
+                and not self._tick_waiters.get(self._clocks[0].domain))
+
+    def _run_natively(self, deadline):
+        clock = self._clocks[0]
+        edges = 0
+        while clock.next_time + edges * clock.half_period < deadline:
+            edges += 1
+        if not edges:
+            return
+        engine = self._engine
+        clk_index = engine.netlist.indexes[self._domains[clock.domain].clk]
+        engine.settle()
+        tracer = self._tracer
+        if tracer is not None:
+            engine.run_clock(clk_index, edges, tracer.vcd,
+                             tracer.timestamp_to_vcd(self._now),
+                             tracer.timestamp_to_vcd(clock.half_period))
+            tracer.flush()
+        else:
+            engine.run_clock(clk_index, edges)
+        clock.advance(edges)
+        self._now = clock.next_time - clock.half_period
+
+
+class _CxxrtlVCDTracer:
+
+    @staticmethod
+    def timestamp_to_vcd(timestamp):
+        return round(timestamp * 1e10)          # 1/(100 ps)
+
+    def __init__(self, engine, trace_filter, vcd_file, gtkw_file):
+        lib = engine.library.lib
+        self.lib = lib
+        self.vcd_file = vcd_file
+        self.gtkw_file = gtkw_file
+        self.now = 0.0
+        self.vcd = lib.cxxrtl_vcd_create()
+        lib.cxxrtl_vcd_timescale(self.vcd, 100, b'ps')
+        def accept(data, name, obj):
+            path = ('top', *name.decode().split(' '))
+            return int(trace_filter.accepts(path))
+        self._filter = _VCD_FILTER(accept)  # keep alive while in use
+        lib.cxxrtl_vcd_add_from_if(self.vcd, engine.handle, None, self._filter)
+        engine.on_settle = self.sample
+
+    def sample(self):
+        self.lib.cxxrtl_vcd_sample(self.vcd, self.timestamp_to_vcd(self.now))
+        self.flush()
+
+    def flush(self):
+        data = ctypes.c_char_p()
+        size = ctypes.c_size_t()
+        while True:
+            self.lib.cxxrtl_vcd_read(self.vcd, ctypes.byref(data),
+                                     ctypes.byref(size))
+            if not size.value:
+                break
+            self.vcd_file.write(ctypes.string_at(data, size.value).decode())
+
+    def close(self, timestamp):
+        self.flush()
+        self.lib.cxxrtl_vcd_destroy(self.vcd)
+        self.vcd_file.close()
+        if self.gtkw_file is not None:
+            # CXXRTL names the signals itself; just point GTKWave at
+            # the dump.
+            self.gtkw_file.write(f'[dumpfile] "{self.vcd_file.name}"\n')
+            self.gtkw_file.close()
+
+
+if __name__ == '__main__':
+    from nmigen import Elaboratable, Fragment, Module, Signal
+    from nmigen.back import pysim, rtlil
+
+    # The same testbench must see the same values on every backend.
+    # Writes made at a clock edge are captured at the next one.
+
+    class Capture(Elaboratable):
+
+        def __init__(self):
+            self.d = Signal(8)
+            self.q = Signal(8)
+            self.total = Signal(16)
+
+        def elaborate(self, platform):
+            m = Module()
+            m.d.sync += [
+                self.q.eq(self.d),
+                self.total.eq(self.total + self.d),
+            ]
+            return m
+
+    def run(make_simulator):
+        design = Capture()
+        log = []
+
+        def bench():
+            for n in range(1, 20):
+                yield design.d.eq(n)
+                yield
+                log.append(((yield design.q), (yield design.total)))
+
+        sim = make_simulator(design)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(bench)
+        if isinstance(sim, FastSimulator):
+            with sim:           # closes the native design
+                sim.run()
+        else:
+            sim.run()           # pysim deprecates `with`
+        return log
+
+    def cxxrtl_simulator(design):
+        fragment = Fragment.get(design, None)
+        rtlil_text = rtlil.convert(fragment, name='top',
+                                   ports=[design.d, design.q, design.total])
+        return CxxrtlSimulator(fragment, rtlil_text, top='top')
+
+    expected = run(pysim.Simulator)
+    assert run(FastSimulator) == expected, 'fast differs from pysim'
+    if shutil.which(os.environ.get('YOSYS', 'yosys')) is None:
+        print('cxxrtl: skipped, Yosys not found')
+    else:
+        assert run(cxxrtl_simulator) == expected, 'cxxrtl differs from pysim'
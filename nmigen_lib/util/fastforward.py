@@ -0,0 +1,401 @@
+import math
+
+from nmigen import Cat, Const, Signal
+from nmigen.hdl.ast import ArrayProxy, Assign, Operator, Part, Repl, Slice
+from nmigen.hdl.ast import Switch
+
+"""
+Skip over clock cycles in which only counters are counting.
+
+Timers, blinkers and refresh counters spend most of their time
+adding or subtracting a constant with nothing else in the design
+changing.  `FastForward` watches a `FastSimulator`'s clock domain.
+When the same registers change by the same amounts on consecutive
+clocks, it proves how many more clocks that can go on and jumps
+over them in one step.
+
+The proof evaluates the design's logic over intervals: each
+counter is given the range of values it will take, every other
+signal keeps its current value, and the evaluation must show that
+
+  * every combinational signal stays constant,
+
+  * every register that isn't a counter keeps its value, and
+
+  * each counter's next value is itself plus its step, without
+    overflowing.
+
+Conditions like `counter == N`, `counter[-1]` or `counter < limit`
+are constant over a range that doesn't reach the threshold, so the
+jump lands just before the next threshold crossing and normal
+simulation takes over from there.  A design that needs anything
+else to happen is simulated clock by clock, so the results are the
+same either way.
+
+A jump is only taken when the design has one clock, no process is
+waiting for a clock edge, and no `Delay` expires during the jump.
+Nor may it pass the end of the run, so without a deadline, e.g.,
+`Main`'s `--clocks`, nothing is skipped; `Main` refuses
+`--fast-forward` without `--clocks`.
+In waveforms, counters jump instead of counting.
+"""
+
+MIN_SKIP = 4                # don't bother proving shorter jumps
+MAX_BACKOFF = 1024          # clocks between failed proofs, at most
+
+
+class _Fail(Exception):
+    pass
+
+
+class _Interval:
+
+    """Evaluate values over intervals.
+
+    An abstract value is `(lo, hi, sym)`, where `sym` is
+    `(counter_index, offset)` if the value is exactly that counter
+    plus `offset`, or None.  `None` means unknown.
+    """
+
+    def __init__(self, netlist, env):
+        self.indexes = netlist.indexes
+        self.env = env              # signal index -> abstract value
+
+    def __call__(self, value):
+        if isinstance(value, Const):
+            v = value.value
+            return (v, v, None)
+        if isinstance(value, Signal):
+            return self.env[self.indexes[value]]
+        if isinstance(value, Operator):
+            return self.operator(value)
+        if isinstance(value, Slice):
+            return self.slice(self(value.value), value.start, value.stop)
+        if isinstance(value, Part):
+            offset = _exact(self(value.offset))
+            if offset is None:
+                return None
+            start = (offset & ((1 << len(value.offset)) - 1)) * value.stride
+            return self.slice(self(value.value), start, start + value.width)
+        if isinstance(value, Cat):
+            result = 0
+            shift = 0
+            for part in value.parts:
+                v = _exact(self(part))
+                if v is None:
+                    return None
+                result |= (v & ((1 << len(part)) - 1)) << shift
+                shift += len(part)
+            return (result, result, None)
+        if isinstance(value, Repl):
+            v = _exact(self(value.value))
+            if v is None:
+                return None
+            width = len(value.value)
+            v &= (1 << width) - 1
+            result = sum(v << (i * width) for i in range(value.count))
+            return (result, result, None)
+        if isinstance(value, ArrayProxy):
+            index = _exact(self(value.index))
+            elems = list(value.elems)
+            if index is None or not elems:
+                return None
+            index &= (1 << len(value.index)) - 1
+            return self(elems[min(index, len(elems) - 1)])
+        if hasattr(value, 'fields'):
+            return self(Cat(value.fields.values()))
+        return None
+
+    def slice(self, v, start, stop):
+        if v is None:
+            return None
+        (lo, hi, _) = v
+        if lo >> start != hi >> start:
+            return None
+        result = (lo >> start) & ((1 << (stop - start)) - 1)
+        return (result, result, None)
+
+    def operator(self, value):
+        op = value.operator
+        args = [self(arg) for arg in value.operands]
+        if op == 'm':
+            (sel, val1, val0) = args
+            sel = _exact(sel)
+            if sel is None:
+                return val1 if val1 == val0 else None
+            return val1 if sel & 1 else val0
+        if any(arg is None for arg in args):
+            return None
+        if len(args) == 1:
+            (a, ) = args
+            (lo, hi, sym) = a
+            if op == '-':
+                return (-hi, -lo, None)
+            if op in ('b', 'r|'):
+                if lo > 0 or hi < 0:
+                    return (1, 1, None)
+                return (0, 0, None) if lo == hi == 0 else None
+            if op in ('u', 's'):
+                shape = value.shape()
+                if _fits(a, shape):
+                    return a
+                v = _exact(a)
+                if v is None:
+                    return None
+                v = Const.normalize(v, shape)
+                return (v, v, None)
+            v = _exact(a)
+            if v is None:
+                return None
+            width = len(value.operands[0])
+            if op == '~':
+                v = ~v
+            elif op == 'r&':
+                v = int(v & ((1 << width) - 1) == (1 << width) - 1)
+            elif op == 'r^':
+                v = bin(v & ((1 << width) - 1)).count('1') & 1
+            else:
+                return None
+            v = Const.normalize(v, value.shape())
+            return (v, v, None)
+        (a, b) = args
+        if op == '+':
+            return (a[0] + b[0], a[1] + b[1], _offset(a, b, 1))
+        if op == '-':
+            return (a[0] - b[1], a[1] - b[0], _offset(a, b, -1))
+        if op in ('==', '!='):
+            if a[0] == a[1] == b[0] == b[1]:
+                result = True
+            elif a[1] < b[0] or b[1] < a[0]:
+                result = False
+            else:
+                return None
+            result = int(result == (op == '=='))
+            return (result, result, None)
+        if op in ('<', '<=', '>', '>='):
+            if op in ('>', '>='):
+                (a, b) = (b, a)
+                op = '<' if op == '>' else '<='
+            if (a[1] < b[0]) if op == '<' else (a[1] <= b[0]):
+                return (1, 1, None)
+            if (a[0] >= b[1]) if op == '<' else (a[0] > b[1]):
+                return (0, 0, None)
+            return None
+        (a, b) = (_exact(a), _exact(b))
+        if a is None or b is None:
+            return None
+        if op == '*':
+            v = a * b
+        elif op == '//':
+            v = a // b if b else 0
+        elif op == '&':
+            v = a & b
+        elif op == '|':
+            v = a | b
+        elif op == '^':
+            v = a ^ b
+        elif op == '<<':
+            v = a << b
+        elif op == '>>':
+            v = a >> b
+        else:
+            return None
+        v = Const.normalize(v, value.shape())
+        return (v, v, None)
+
+
+def _exact(v):
+    if v is None or v[0] != v[1]:
+        return None
+    return v[0]
+
+def _offset(a, b, sign):
+    # a + b or a - b is a counter plus a constant if a is one and b
+    # is constant.
+    if a[2] is not None and b[0] == b[1]:
+        (index, offset) = a[2]
+        return (index, offset + sign * b[0])
+    return None
+
+def _fits(v, shape):
+    if shape.signed:
+        (lo, hi) = (-(1 << (shape.width - 1)), (1 << (shape.width - 1)) - 1)
+    else:
+        (lo, hi) = (0, (1 << shape.width) - 1)
+    return lo <= v[0] and v[1] <= hi
+
+def _assigned(v, shape):
+    # The abstract value of a signal with `shape` assigned `v`.
+    if v is None:
+        raise _Fail
+    if _fits(v, shape):
+        return v
+    exact = _exact(v)
+    if exact is None:
+        raise _Fail
+    exact = Const.normalize(exact, shape)
+    return (exact, exact, None)
+
+
+class _Executor:
+
+    """Run statements over abstract values.  Assigned values go to `next`."""
+
+    def __init__(self, interval, next):
+        self.eval = interval
+        self.next = next            # signal index -> abstract value
+
+    def __call__(self, stmts):
+        for stmt in stmts:
+            if isinstance(stmt, Assign):
+                if not isinstance(stmt.lhs, Signal):
+                    raise _Fail
+                index = self.eval.indexes[stmt.lhs]
+                self.next[index] = _assigned(self.eval(stmt.rhs),
+                                             stmt.lhs.shape())
+            elif isinstance(stmt, Switch):
+                test = _exact(self.eval(stmt.test))
+                if test is None:
+                    raise _Fail
+                test &= (1 << len(stmt.test)) - 1
+                for (patterns, body) in stmt.cases.items():
+                    if not patterns or any(_matches(test, p) for p in patterns):
+                        self(body)
+                        break
+            else:
+                raise _Fail
+
+
+def _matches(value, pattern):
+    mask = int(''.join('0' if b == '-' else '1' for b in pattern), 2)
+    bits = int(''.join('0' if b == '-' else b for b in pattern), 2)
+    return value & mask == bits
+
+
+class FastForward:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.engine = sim._engine
+        self.netlist = self.engine.netlist
+        self.deltas = {}            # domain -> ({index: delta}, repeats)
+        self.backoff = {}           # domain -> (wait, next_wait)
+        self.skipped = 0            # total clocks skipped
+
+    def observe(self, domain, changes):
+        """Note a domain's register changes before they're committed."""
+        v = self.engine.v
+        deltas = {i: new - v[i] for (i, new) in changes.items() if new != v[i]}
+        (last, repeats) = self.deltas.get(domain, (None, 0))
+        self.deltas[domain] = (deltas, repeats + 1 if deltas == last else 0)
+
+    def skip(self, limit):
+        """Jump over idle clocks before time `limit`.  True if it did."""
+        sim = self.sim
+        if len(sim._clocks) != 1 or sim._settle_waiters:
+            return False
+        (clock, ) = sim._clocks
+        domain = clock.domain
+        if sim._tick_waiters.get(domain):
+            return False
+        rising = clock.edge % 2 == 0
+        if rising != (sim._domains[domain].clk_edge == 'pos'):
+            return False
+        (deltas, repeats) = self.deltas.get(domain, (None, 0))
+        if not deltas or repeats < 2:
+            return False
+        (wait, next_wait) = self.backoff.get(domain, (0, 1))
+        if wait:
+            self.backoff[domain] = (wait - 1, next_wait)
+            return False
+
+        period = 2 * clock.half_period
+        t0 = clock.next_time
+        if sim._delay_waiters:
+            limit = min(limit, sim._delay_waiters[0][0])
+        if math.isinf(limit):
+            return False
+        k_max = math.ceil((limit - t0) / period - 1e-9)
+        k = self._longest_skip(domain, deltas, k_max)
+        if k < MIN_SKIP:
+            self.backoff[domain] = (next_wait, min(2 * next_wait, MAX_BACKOFF))
+            return False
+        self.backoff[domain] = (0, 1)
+
+        # Finish as if the k'th active edge had just been simulated.
+        engine = self.engine
+        v = engine.v
+        engine.commit({
+            i: Const.normalize(v[i] + k * d, self.netlist.signals[i].shape())
+            for (i, d) in deltas.items()
+        })
+        clock.advance(2 * k - 1)
+        sim._now = t0 + (k - 1) * period
+        if sim._tracer is not None:
+            sim._tracer.now = sim._now
+        clk = self.netlist.indexes[sim._domains[domain].clk]
+        engine.commit({clk: int(rising)})
+        engine.stale = [True] * len(engine.stale)
+        engine.settle()
+        self.skipped += k
+        return True
+
+    def _longest_skip(self, domain, deltas, k_max):
+        if k_max < MIN_SKIP or not self._can_skip(domain, deltas, MIN_SKIP):
+            return 0
+        (good, bad) = (MIN_SKIP, k_max + 1)
+        if self._can_skip(domain, deltas, k_max):
+            return k_max
+        while bad - good > 1:
+            k = (good + bad) // 2
+            if self._can_skip(domain, deltas, k):
+                good = k
+            else:
+                bad = k
+        return good
+
+    def _can_skip(self, domain, deltas, k):
+        """True if the next `k` clocks only advance the counters."""
+        netlist = self.netlist
+        v = self.engine.v
+        env = [(x, x, None) for x in v]
+        for (i, d) in deltas.items():
+            (lo, hi) = sorted((v[i], v[i] + (k - 1) * d))
+            env[i] = (lo, hi, (i, 0))
+        interval = _Interval(netlist, env)
+        try:
+            # Combinational logic, until it stops changing.
+            for _ in range(len(netlist.comb_groups) + 1):
+                changed = False
+                for (outputs, stmts) in netlist.comb_groups:
+                    next = {}
+                    for sig in outputs:
+                        reset = Const.normalize(sig.reset, sig.shape())
+                        next[netlist.indexes[sig]] = (reset, reset, None)
+                    _Executor(interval, next)(stmts)
+                    for (i, value) in next.items():
+                        if env[i] != value:
+                            env[i] = value
+                            changed = True
+                if not changed:
+                    break
+            else:
+                return False
+            for (outputs, _) in netlist.comb_groups:
+                for sig in outputs:
+                    i = netlist.indexes[sig]
+                    if i not in deltas and _exact(env[i]) != v[i]:
+                        return False
+
+            # Registers.
+            next = {}
+            _Executor(interval, next)(netlist.sync_stmts.get(domain, ()))
+        except _Fail:
+            return False
+        for (i, value) in next.items():
+            if i in deltas:
+                if value[2] != (i, deltas[i]):
+                    return False
+            elif _exact(value) != v[i]:
+                return False
+        return all(i in next for i in deltas)
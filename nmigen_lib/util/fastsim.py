@@ -0,0 +1,1022 @@
+import heapq
+import inspect
+import math
+
+from nmigen import Cat, Const, Signal, Value
+from nmigen.hdl.ast import ArrayProxy, Assign, Part, Slice
+from nmigen.hdl.ast import SignalDict, Statement
+from nmigen.hdl.ir import Fragment
+from nmigen.hdl.xfrm import LHSGroupAnalyzer, LHSGroupFilter
+from nmigen.hdl.xfrm import StatementVisitor, ValueVisitor
+from nmigen.back.pysim import Active, Delay, Passive, Settle, Tick
+from vcd import VCDWriter
+from vcd.gtkw import GTKWSave
+
+from .fastforward import FastForward
+
+"""
+A fast, cycle-oriented Python simulator for `Main`.
+
+Select it with `simulate --backend fast`.  It runs the same
+processes as pysim (`SimBuilder.process` and `sync_process`
+generators that yield `Value`s, `Statement`s, `Tick`, `Settle`,
+`Delay`, `Passive` and `Active`), but it compiles the design
+differently.
+
+  * Every signal is a slot in one flat list of Python ints.
+    Signed values are stored sign-extended, so reading a signal
+    needs no masking.
+
+  * Each clock domain compiles to one straight-line function that
+    returns the domain's changed registers.  A domain none of
+    whose inputs changed since its last clock is not evaluated at
+    all.
+
+  * Combinational logic compiles to one function per group of
+    signals that are assigned together.  Settling only runs the
+    groups whose inputs changed, in dependency order.
+
+  * Clock edges, delays and process wakeups are scheduled
+    directly instead of through delta cycles.
+
+Limitations: clocks must be added with `add_clock`; asynchronous
+resets are treated as synchronous; `Assert`, `Assume` and `Cover`
+are not supported.
+"""
+
+
+class _Netlist:
+
+    """A flattened, prepared design."""
+
+    def __init__(self, design):
+        fragment = Fragment.get(design, platform=None).prepare()
+        self.domains = fragment.domains
+        self.signals = []
+        self.indexes = SignalDict()
+        self.names = SignalDict()
+        self.comb_groups = []           # [(outputs, statements)]
+        self.sync_stmts = {}            # domain name -> statements
+        for domain in self.domains.values():
+            self.add_name(domain.clk, ('top', ))
+            if domain.rst is not None:
+                self.add_name(domain.rst, ('top', ))
+        self._flatten(fragment, ('top', ))
+        # Signals that only processes use are added after these.
+        self.design_signals = len(self.signals)
+
+    def index(self, signal):
+        try:
+            return self.indexes[signal]
+        except KeyError:
+            index = len(self.signals)
+            self.signals.append(signal)
+            self.indexes[signal] = index
+            return index
+
+    def add_name(self, signal, hierarchy):
+        self.index(signal)
+        name = (*hierarchy, signal.name)
+        if signal not in self.names:
+            self.names[signal] = {name}
+        else:
+            self.names[signal].add(name)
+
+    def _flatten(self, fragment, hierarchy):
+        for stmt in fragment.statements:
+            for signal in stmt._lhs_signals() | stmt._rhs_signals():
+                self.add_name(signal, hierarchy)
+        for (domain_name, signals) in fragment.drivers.items():
+            stmts = LHSGroupFilter(signals)(fragment.statements)
+            if domain_name is None:
+                analyzer = LHSGroupAnalyzer()
+                analyzer.on_statements(stmts)
+                for group in analyzer.groups().values():
+                    group &= signals
+                    if group:
+                        self.comb_groups.append(
+                            (group, LHSGroupFilter(group)(stmts)))
+            else:
+                self.sync_stmts.setdefault(domain_name, []).extend(stmts)
+        for (i, (subfragment, name)) in enumerate(fragment.subfragments):
+            if name is None:
+                name = f'U${i}'
+            self._flatten(subfragment, (*hierarchy, name))
+
+
+class _Emitter:
+
+    def __init__(self):
+        self.lines = []
+        self.level = 0
+        self.count = 0
+        self.globals = {}
+
+    def append(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def gen_var(self, prefix):
+        self.count += 1
+        return f'{prefix}_{self.count}'
+
+    def def_var(self, prefix, expr):
+        name = self.gen_var(prefix)
+        self.append(f'{name} = {expr}')
+        return name
+
+    def def_global(self, prefix, value):
+        name = self.gen_var('_' + prefix)
+        self.globals[name] = value
+        return name
+
+    def compile(self, name):
+        code = '\n'.join(self.lines) + '\n'
+        namespace = dict(self.globals)
+        exec(compile(code, f'<fastsim {name}>', 'exec'), namespace)
+        return namespace[name]
+
+
+def _mask(width):
+    return (1 << width) - 1
+
+def _is_normal(value):
+    # Signal slots and Consts always hold normalized values.
+    return isinstance(value, (Signal, Const))
+
+
+class _RHSCompiler(ValueVisitor):
+
+    """Compile a Value to a Python expression over the slot list `v`."""
+
+    def __init__(self, netlist, emitter, inputs=None):
+        self.netlist = netlist
+        self.emitter = emitter
+        self.inputs = inputs
+
+    def normalized(self, value):
+        """Compile `value`, sign-extended if signed, masked if not."""
+        if _is_normal(value):
+            return self(value)
+        return _normalize(self(value), value.shape())
+
+    def on_Const(self, value):
+        return f'{value.value}'
+
+    def on_Signal(self, value):
+        index = self.netlist.index(value)
+        if self.inputs is not None:
+            self.inputs.add(index)
+        return f'v[{index}]'
+
+    def on_Record(self, value):
+        return self(Cat(value.fields.values()))
+
+    def on_ClockSignal(self, value):
+        raise NotImplementedError   # lowered by Fragment.prepare()
+
+    on_ResetSignal = on_ClockSignal
+
+    def on_AnyConst(self, value):
+        raise NotImplementedError('AnyConst is not supported in simulation')
+
+    on_AnySeq = on_Sample = on_Initial = on_AnyConst
+
+    def on_Operator(self, value):
+        op = value.operator
+        ops = value.operands
+        if len(ops) == 1:
+            (arg, ) = ops
+            if op == '~':
+                return f'(~{self(arg)})'
+            if op == '-':
+                return f'(-{self.normalized(arg)})'
+            if op == 'b':
+                return f'({self(arg)} & {_mask(len(arg))} != 0)'
+            if op == 'r|':
+                return f'({self(arg)} & {_mask(len(arg))} != 0)'
+            if op == 'r&':
+                m = _mask(len(arg))
+                return f'({self(arg)} & {m} == {m})'
+            if op == 'r^':
+                return f"(bin({self(arg)} & {_mask(len(arg))}).count('1') & 1)"
+            if op in ('u', 's'):
+                # Only the interpretation changes; users normalize.
+                return self(arg)
+        elif len(ops) == 2:
+            (lhs, rhs) = ops
+            if op in ('+', '-', '*', '<<', '>>',
+                      '==', '!=', '<', '<=', '>', '>='):
+                return f'({self.normalized(lhs)} {op} {self.normalized(rhs)})'
+            if op == '//':
+                a = self.normalized(lhs)
+                b = self.emitter.def_var('div', self.normalized(rhs))
+                return f'(0 if {b} == 0 else {a} // {b})'
+            if op in ('&', '|', '^'):
+                return f'({self(lhs)} {op} {self(rhs)})'
+        elif len(ops) == 3:
+            if op == 'm':
+                (sel, val1, val0) = ops
+                return (f'({self(val1)} if {self(sel)} & {_mask(len(sel))} '
+                        f'else {self(val0)})')
+        raise NotImplementedError(f'Operator {op!r} not implemented')
+
+    def on_Slice(self, value):
+        return (f'(({self(value.value)} >> {value.start}) '
+                f'& {_mask(value.stop - value.start)})')
+
+    def on_Part(self, value):
+        offset = (f'(({self(value.offset)} & {_mask(len(value.offset))}) '
+                  f'* {value.stride})')
+        return f'(({self(value.value)} >> {offset}) & {_mask(value.width)})'
+
+    def on_Cat(self, value):
+        parts = []
+        offset = 0
+        for part in value.parts:
+            if len(part):
+                parts.append(f'(({self(part)} & {_mask(len(part))}) << {offset})')
+            offset += len(part)
+        return f"({' | '.join(parts) or '0'})"
+
+    def on_Repl(self, value):
+        width = len(value.value)
+        spread = sum(1 << (i * width) for i in range(value.count))
+        return f'(({self(value.value)} & {_mask(width)}) * {spread})'
+
+    def on_ArrayProxy(self, value):
+        elems = list(value.elems)
+        if not elems:
+            return '0'
+        index = f'({self(value.index)} & {_mask(len(value.index))})'
+        if all(isinstance(e, Signal) for e in elems):
+            slots = self.emitter.def_global(
+                'array', tuple(self.netlist.index(e) for e in elems))
+            if self.inputs is not None:
+                self.inputs.update(self.netlist.index(e) for e in elems)
+            return f'v[{slots}[min({index}, {len(elems) - 1})]]'
+        gen_elems = ', '.join(self(e) for e in elems)
+        return f'(({gen_elems}, )[min({index}, {len(elems) - 1})])'
+
+
+def _normalize(expr, shape):
+    m = _mask(shape.width)
+    if shape.signed and shape.width:
+        half = 1 << (shape.width - 1)
+        return f'((({expr}) & {m} ^ {half}) - {half})'
+    return f'(({expr}) & {m})'
+
+
+class _StatementCompiler(StatementVisitor):
+
+    """Compile statements to Python.
+
+    Assigned values go to local variables `n<index>` (comb mode) or
+    to the dict `n` (dict mode).  Right hand sides read the slot
+    list `v`.
+    """
+
+    def __init__(self, netlist, emitter, *, dict_mode, inputs=None,
+                 outputs=None):
+        self.netlist = netlist
+        self.emitter = emitter
+        self.dict_mode = dict_mode
+        self.rhs = _RHSCompiler(netlist, emitter, inputs)
+        self.outputs = outputs
+
+    def read_next(self, index):
+        if self.dict_mode:
+            return f'n.get({index}, v[{index}])'
+        return f'n{index}'
+
+    def write_next(self, signal, expr):
+        index = self.netlist.index(signal)
+        if self.outputs is not None:
+            self.outputs.add(index)
+        if self.dict_mode:
+            self.emitter.append(f'n[{index}] = {expr}')
+        else:
+            self.emitter.append(f'n{index} = {expr}')
+
+    def on_statements(self, stmts):
+        for stmt in stmts:
+            self(stmt)
+        if not stmts:
+            self.emitter.append('pass')
+
+    def on_Assign(self, stmt):
+        self.lhs(stmt.lhs, self.rhs(stmt.rhs))
+
+    def lhs(self, value, expr):
+        emitter = self.emitter
+        if isinstance(value, Signal):
+            self.write_next(value, _normalize(expr, value.shape()))
+        elif isinstance(value, Slice):
+            m = _mask(value.stop - value.start)
+            inner = self.current(value.value)
+            self.lhs(value.value,
+                     f'({inner} & {~(m << value.start)} '
+                     f'| (({expr}) & {m}) << {value.start})')
+        elif isinstance(value, Part):
+            m = _mask(value.width)
+            offset = emitter.def_var('offset',
+                f'({self.rhs(value.offset)} & {_mask(len(value.offset))}) '
+                f'* {value.stride}')
+            inner = self.current(value.value)
+            self.lhs(value.value,
+                     f'({inner} & ~({m} << {offset}) '
+                     f'| (({expr}) & {m}) << {offset})')
+        elif isinstance(value, Cat):
+            cat = emitter.def_var('cat', expr)
+            offset = 0
+            for part in value.parts:
+                self.lhs(part, f'(({cat} >> {offset}) & {_mask(len(part))})')
+                offset += len(part)
+        elif isinstance(value, ArrayProxy):
+            self.lhs_array(value, expr)
+        elif isinstance(value, Value) and hasattr(value, 'fields'):
+            self.lhs(Cat(value.fields.values()), expr)
+        else:
+            raise TypeError(f'cannot assign to {value!r}')
+
+    def current(self, value):
+        # The value an LHS currently holds, including earlier
+        # assignments in the same process.
+        if isinstance(value, Signal):
+            return self.read_next(self.netlist.index(value))
+        if isinstance(value, Slice):
+            return (f'(({self.current(value.value)} >> {value.start}) '
+                    f'& {_mask(value.stop - value.start)})')
+        if isinstance(value, Cat):
+            parts = []
+            offset = 0
+            for part in value.parts:
+                parts.append(
+                    f'(({self.current(part)} & {_mask(len(part))}) << {offset})')
+                offset += len(part)
+            return f"({' | '.join(parts) or '0'})"
+        return self.rhs(value)
+
+    def lhs_array(self, value, expr):
+        emitter = self.emitter
+        elems = list(value.elems)
+        if not elems:
+            return
+        index = emitter.def_var('index',
+            f'min({self.rhs(value.index)} & {_mask(len(value.index))}, '
+            f'{len(elems) - 1})')
+        shapes = {e.shape() for e in elems if isinstance(e, Signal)}
+        if self.dict_mode and len(shapes) == 1 and all(
+                isinstance(e, Signal) for e in elems):
+            # e.g. a Memory write port: index the slot table directly.
+            slots = tuple(self.netlist.index(e) for e in elems)
+            if self.outputs is not None:
+                self.outputs.update(slots)
+            table = emitter.def_global('array', slots)
+            emitter.append(
+                f'n[{table}[{index}]] = {_normalize(expr, shapes.pop())}')
+            return
+        arg = emitter.def_var('arg', expr)
+        for (i, elem) in enumerate(elems):
+            emitter.append(f"{'if' if i == 0 else 'elif'} {index} == {i}:")
+            emitter.level += 1
+            self.lhs(elem, arg)
+            emitter.level -= 1
+
+    def on_Switch(self, stmt):
+        emitter = self.emitter
+        test = emitter.def_var('test',
+            f'{self.rhs(stmt.test)} & {_mask(len(stmt.test))}')
+        first = True
+        for (patterns, stmts) in stmt.cases.items():
+            checks = []
+            if not patterns:
+                checks.append('True')
+            for pattern in patterns:
+                if '-' in pattern:
+                    mask = int(''.join('0' if b == '-' else '1'
+                                       for b in pattern), 2)
+                    value = int(''.join('0' if b == '-' else b
+                                        for b in pattern), 2)
+                    checks.append(f'{test} & {mask} == {value}')
+                else:
+                    checks.append(f'{test} == {int(pattern, 2)}')
+            emitter.append(f"{'if' if first else 'elif'} {' or '.join(checks)}:")
+            first = False
+            emitter.level += 1
+            self.on_statements(stmts)
+            emitter.level -= 1
+
+    def on_Assert(self, stmt):
+        raise NotImplementedError('Assert is not supported by fastsim')
+
+    on_Assume = on_Cover = on_Assert
+
+
+class _EngineBase:
+
+    """Design state as seen by the scheduler and by processes.
+
+    Subclasses hold the values in `v`, indexed like
+    `netlist.signals`, and implement `tick`, `commit` and `settle`.
+    """
+
+    def __init__(self, netlist):
+        self.netlist = netlist
+        self.trace = None           # called with (index, value) on change
+        self._value_cache = {}
+        self._stmt_cache = {}
+
+    def tick(self, domain_name):
+        """Evaluate a domain's registers.  Return changes to commit."""
+        raise NotImplementedError
+
+    def commit(self, changes):
+        """Store a dict of new values, keyed by signal index."""
+        raise NotImplementedError
+
+    def settle(self):
+        """Propagate committed values through combinational logic."""
+        raise NotImplementedError
+
+    def commit_clocks(self, changes):
+        """Store new clock levels, before the writes made at the edge."""
+        self.commit(changes)
+
+    def _grow(self):
+        pass
+
+    def get_state(self):
+        """Return the design's signal values, for a checkpoint."""
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support checkpoints')
+
+    def set_state(self, values):
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support checkpoints')
+
+    def read(self, value):
+        if isinstance(value, Signal):
+            index = self.netlist.indexes.get(value)
+            if index is None:
+                index = self.netlist.index(value)
+                self._grow()
+            return self.v[index]
+        func = self._cached(self._value_cache, value, self._compile_value)
+        return func(self.v)
+
+    def execute(self, stmt, changes):
+        """Execute a process's statement, adding its writes to `changes`."""
+        if (isinstance(stmt, Assign) and isinstance(stmt.lhs, Signal)
+                and isinstance(stmt.rhs, Const)):
+            index = self.netlist.indexes.get(stmt.lhs)
+            if index is None:
+                index = self.netlist.index(stmt.lhs)
+                self._grow()
+            changes[index] = Const.normalize(stmt.rhs.value, stmt.lhs.shape())
+            return
+        func = self._cached(self._stmt_cache, stmt, self._compile_stmt)
+        func(self.v, changes)
+
+    def _cached(self, cache, obj, compile_func):
+        # Values and statements can't be hashed; key on identity and
+        # keep the object alive so the identity can't be reused.
+        entry = cache.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            if len(cache) > 4096:
+                cache.clear()
+            entry = (obj, compile_func(obj))
+            cache[id(obj)] = entry
+            self._grow()
+        return entry[1]
+
+    def _compile_value(self, value):
+        emitter = _Emitter()
+        emitter.append('def read(v):')
+        emitter.level += 1
+        expr = _RHSCompiler(self.netlist, emitter).normalized(Value.cast(value))
+        emitter.append(f'return {expr}')
+        return emitter.compile('read')
+
+    def _compile_stmt(self, stmt):
+        emitter = _Emitter()
+        emitter.append('def execute(v, n):')
+        emitter.level += 1
+        _StatementCompiler(self.netlist, emitter, dict_mode=True)(stmt)
+        return emitter.compile('execute')
+
+
+class _Engine(_EngineBase):
+
+    """Compiled design state: slot values and the logic that updates them."""
+
+    def __init__(self, netlist):
+        super().__init__(netlist)
+        self.v = [Const.normalize(sig.reset, sig.shape())
+                  for sig in netlist.signals]
+        self._compile_domains()
+        self._compile_comb()
+
+    # ---- compilation
+
+    def _compile_domains(self):
+        netlist = self.netlist
+        self.domain_names = list(netlist.sync_stmts)
+        self.domain_ids = {name: i for (i, name) in enumerate(self.domain_names)}
+        self.tick_funcs = []
+        self.domain_inputs = []
+        for name in self.domain_names:
+            emitter = _Emitter()
+            inputs = set()
+            func_name = f'tick_{name}'
+            emitter.append(f'def {func_name}(v):')
+            emitter.level += 1
+            emitter.append('n = {}')
+            _StatementCompiler(netlist, emitter,
+                               dict_mode=True, inputs=inputs)(
+                                   netlist.sync_stmts[name])
+            emitter.append('return n')
+            self.tick_funcs.append(emitter.compile(func_name))
+            self.domain_inputs.append(inputs)
+        self.stale = [True] * len(self.domain_names)
+
+    def _compile_comb(self):
+        netlist = self.netlist
+        compiled = []
+        for (i, (outputs, stmts)) in enumerate(netlist.comb_groups):
+            emitter = _Emitter()
+            inputs = set()
+            out_indexes = [netlist.index(sig) for sig in outputs]
+            func_name = f'comb_{i}'
+            emitter.append(f'def {func_name}(v, changed):')
+            emitter.level += 1
+            for (sig, index) in zip(outputs, out_indexes):
+                reset = Const.normalize(sig.reset, sig.shape())
+                emitter.append(f'n{index} = {reset}')
+            _StatementCompiler(netlist, emitter,
+                               dict_mode=False, inputs=inputs)(stmts)
+            for index in out_indexes:
+                emitter.append(f'if n{index} != v[{index}]:')
+                emitter.append(f'    v[{index}] = n{index}')
+                emitter.append(f'    changed.append({index})')
+            compiled.append((emitter.compile(func_name), inputs, out_indexes))
+
+        # Order groups so that writers come before readers.
+        writers = {}
+        for (g, (_, _, outs)) in enumerate(compiled):
+            for index in outs:
+                writers[index] = g
+        deps = [{writers[i] for i in inputs if i in writers and writers[i] != g}
+                for (g, (_, inputs, _)) in enumerate(compiled)]
+        order = _topological_order(deps)
+        self.comb_funcs = [compiled[g][0] for g in order]
+        rank = {g: r for (r, g) in enumerate(order)}
+        self.comb_readers = [[] for _ in self.v]
+        self.domain_readers = [[] for _ in self.v]
+        for (g, (_, inputs, _)) in enumerate(compiled):
+            for index in inputs:
+                self.comb_readers[index].append(rank[g])
+        for (d, inputs) in enumerate(self.domain_inputs):
+            for index in inputs:
+                self.domain_readers[index].append(d)
+        # Everything is evaluated once at startup.
+        self.comb_pending = [True] * len(self.comb_funcs)
+        self.comb_heap = list(range(len(self.comb_funcs)))
+        self._changed = []
+
+    def _grow(self):
+        # Processes may use signals that are not in the design.
+        while len(self.v) < len(self.netlist.signals):
+            sig = self.netlist.signals[len(self.v)]
+            self.v.append(Const.normalize(sig.reset, sig.shape()))
+            self.comb_readers.append([])
+            self.domain_readers.append([])
+
+    # ---- simulation
+
+    def get_state(self):
+        return self.v[:self.netlist.design_signals]
+
+    def set_state(self, values):
+        self.v[:len(values)] = values
+        # A settled state needs no comb evaluation, but any domain
+        # may see new inputs.
+        self.stale = [True] * len(self.stale)
+        self.comb_pending = [False] * len(self.comb_funcs)
+        self.comb_heap = []
+
+    def tick(self, domain_name):
+        d = self.domain_ids.get(domain_name)
+        if d is None or not self.stale[d]:
+            return {}
+        self.stale[d] = False
+        return self.tick_funcs[d](self.v)
+
+    def commit(self, changes):
+        v = self.v
+        for (index, value) in changes.items():
+            if v[index] != value:
+                v[index] = value
+                self._mark(index)
+
+    def _mark(self, index):
+        pending = self.comb_pending
+        for g in self.comb_readers[index]:
+            if not pending[g]:
+                pending[g] = True
+                heapq.heappush(self.comb_heap, g)
+        for d in self.domain_readers[index]:
+            self.stale[d] = True
+        if self.trace is not None:
+            self.trace(index, self.v[index])
+
+    def settle(self):
+        heap = self.comb_heap
+        if not heap:
+            return
+        v = self.v
+        pending = self.comb_pending
+        funcs = self.comb_funcs
+        changed = self._changed
+        while heap:
+            g = heapq.heappop(heap)
+            pending[g] = False
+            funcs[g](v, changed)
+            if changed:
+                for index in changed:
+                    self._mark(index)
+                changed.clear()
+
+
+def _topological_order(deps):
+    # Kahn's algorithm.  Groups in cycles are appended in index order;
+    # settle() iterates until they are stable.
+    n = len(deps)
+    users = [[] for _ in range(n)]
+    count = [len(d) for d in deps]
+    for (g, d) in enumerate(deps):
+        for dep in d:
+            users[dep].append(g)
+    ready = [g for g in range(n) if count[g] == 0]
+    order = []
+    while ready:
+        g = ready.pop()
+        order.append(g)
+        for user in users[g]:
+            count[user] -= 1
+            if count[user] == 0:
+                ready.append(user)
+    placed = set(order)
+    order.extend(g for g in range(n) if g not in placed)
+    return order
+
+
+class _Clock:
+
+    def __init__(self, domain, period, phase):
+        self.domain = domain
+        self.half_period = period / 2
+        self.phase = self.half_period if phase is None else phase
+        self.edge = 0               # number of edges so far
+        self.next_time = self.phase
+
+    def advance(self, edges=1):
+        self.edge += edges
+        self.next_time = self.phase + self.edge * self.half_period
+
+
+# Process wait states
+_RUNNABLE, _TICK, _SETTLE, _DELAY, _DONE = range(5)
+
+
+class _Process:
+
+    def __init__(self, constructor, default_cmd):
+        self.constructor = constructor
+        self.coroutine = constructor()
+        self.default_cmd = default_cmd
+        self.passive = False
+        self.wait = _RUNNABLE
+        self.domain = None
+        self.yields = 0             # commands received so far
+        self.reads = None           # values read, if recording
+
+    @property
+    def name(self):
+        coroutine = self.coroutine
+        while getattr(coroutine, 'gi_yieldfrom', None) is not None:
+            coroutine = coroutine.gi_yieldfrom
+        frame = getattr(coroutine, 'gi_frame', None)
+        if frame is None:
+            return repr(self.constructor)
+        return f'{inspect.getfile(frame)}:{inspect.getlineno(frame)}'
+
+
+class FastSimulator:
+
+    """Drop-in replacement for the parts of pysim.Simulator Main uses."""
+
+    def __init__(self, design):
+        self._engine = self._create_engine(_Netlist(design))
+        self._domains = self._engine.netlist.domains
+        self._clocks = []
+        self._processes = []
+        self._tick_waiters = {}     # domain name -> [process]
+        self._settle_waiters = []
+        self._delay_waiters = []    # heap of (deadline, seq, process)
+        self._seq = 0
+        self._now = 0.0
+        self._started = False
+        self._tracer = None
+        self._recording = False
+        self._fast_forward = None
+        self._deadline = math.inf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._tracer is not None:
+            self._tracer.close(self._now)
+            self._tracer = None
+
+    @property
+    def now(self):
+        """Current simulation time in seconds."""
+        return self._now
+
+    def _create_engine(self, netlist):
+        return _Engine(netlist)
+
+    # ---- building
+
+    def add_clock(self, period, *, phase=None, domain='sync', if_exists=False):
+        if domain not in self._domains:
+            if if_exists:
+                return
+            raise ValueError(f'Domain {domain!r} is not present in simulation')
+        if any(clock.domain == domain for clock in self._clocks):
+            raise ValueError(f'Domain {domain!r} already has a clock driving it')
+        self._clocks.append(_Clock(domain, period, phase))
+
+    def add_process(self, process):
+        self._add_process(process, default_cmd=None, first_wait=_SETTLE)
+
+    def add_sync_process(self, process, *, domain='sync'):
+        proc = self._add_process(process, default_cmd=Tick(domain),
+                                 first_wait=_TICK)
+        proc.domain = domain
+
+    def _add_process(self, process, *, default_cmd, first_wait):
+        if not inspect.isgeneratorfunction(process):
+            raise TypeError(f'Cannot add a process {process!r} because it '
+                            f'is not a generator function')
+        proc = _Process(process, default_cmd)
+        proc.wait = first_wait
+        if self._recording:
+            proc.reads = []
+        self._processes.append(proc)
+        return proc
+
+    def enable_fast_forward(self):
+        """Jump over clocks in which only counters change.
+
+        See `fastforward.py`.  Return the `FastForward` object.
+        """
+        self._fast_forward = FastForward(self)
+        return self._fast_forward
+
+    def record_progress(self):
+        """Record what processes read so that they can be checkpointed."""
+        self._recording = True
+        for proc in self._processes:
+            if proc.reads is None:
+                proc.reads = []
+
+    def start_waveform(self, trace_filter, *, vcd_file, gtkw_file=None,
+                       traces=()):
+        # Unlike pysim, tracing can start at any time, e.g., after
+        # restoring a checkpoint.
+        self._tracer = _VCDTracer(self._engine, trace_filter,
+                                  vcd_file, gtkw_file, traces)
+        self._tracer.now = self._now
+
+    # ---- running
+
+    def run(self):
+        """Run while any process is active."""
+        self._deadline = math.inf
+        while self.step():
+            pass
+
+    def run_until(self, deadline, *, run_passive=False):
+        """Run until simulation time reaches `deadline`."""
+        self._deadline = deadline
+        while self._now < deadline:
+            if not self.step() and not run_passive:
+                return False
+            if not self._can_advance():
+                return False
+        return True
+
+    def step(self):
+        """Process the next event.  True if any process is still active."""
+        if not self._started:
+            self._start()
+        elif not self._advance():
+            return False
+        return any(not p.passive and p.wait != _DONE for p in self._processes)
+
+    def _start(self):
+        self._started = True
+        for proc in self._processes:
+            if proc.wait == _TICK:
+                self._tick_waiters.setdefault(proc.domain, []).append(proc)
+            elif proc.wait == _SETTLE:
+                self._settle_waiters.append(proc)
+        self._engine.settle()
+        self._run_settle_waiters()
+
+    def _can_advance(self):
+        return bool(self._clocks or self._delay_waiters)
+
+    def _advance(self):
+        engine = self._engine
+        fast_forward = self._fast_forward
+        if fast_forward is not None and fast_forward.skip(self._deadline):
+            return True
+        t = min((clock.next_time for clock in self._clocks), default=None)
+        if self._delay_waiters:
+            t_delay = self._delay_waiters[0][0]
+            if t is None or t_delay < t:
+                t = t_delay
+        if t is None:
+            return False
+        self._now = t
+        if self._tracer is not None:
+            self._tracer.now = t
+
+        # Clock edges at t.  Registers are computed from the values
+        # before the edge, and so are all process reads at t.
+        edges = [clock for clock in self._clocks if clock.next_time == t]
+        domain_changes = []
+        runnable = []
+        for clock in edges:
+            domain = self._domains[clock.domain]
+            rising = clock.edge % 2 == 0
+            if rising == (domain.clk_edge == 'pos'):
+                changes = engine.tick(clock.domain)
+                if fast_forward is not None:
+                    fast_forward.observe(clock.domain, changes)
+                domain_changes.append(changes)
+                waiters = self._tick_waiters.pop(clock.domain, None)
+                if waiters:
+                    runnable.extend(waiters)
+        while self._delay_waiters and self._delay_waiters[0][0] <= t:
+            runnable.append(heapq.heappop(self._delay_waiters)[2])
+
+        writes = {}
+        for proc in runnable:
+            self._run_process(proc, writes)
+
+        clocks = {}
+        for clock in edges:
+            index = engine.netlist.indexes[self._domains[clock.domain].clk]
+            clocks[index] = int(clock.edge % 2 == 0)
+            clock.advance()
+        engine.commit_clocks(clocks)
+        for changes in domain_changes:
+            engine.commit(changes)
+        engine.commit(writes)
+        engine.settle()
+        self._run_settle_waiters()
+        return True
+
+    def _run_settle_waiters(self):
+        engine = self._engine
+        while self._settle_waiters:
+            waiters = self._settle_waiters
+            self._settle_waiters = []
+            writes = {}
+            for proc in waiters:
+                self._run_process(proc, writes)
+            engine.commit(writes)
+            engine.settle()
+
+    def _run_process(self, proc, writes):
+        engine = self._engine
+        coroutine = proc.coroutine
+        response = None
+        while True:
+            try:
+                command = coroutine.send(response)
+                response = None
+                proc.yields += 1
+                if command is None:
+                    command = proc.default_cmd
+                if isinstance(command, Value):
+                    response = engine.read(command)
+                    if proc.reads is not None:
+                        proc.reads.append(response)
+                elif isinstance(command, Statement):
+                    engine.execute(command, writes)
+                elif type(command) is Tick:
+                    domain = command.domain
+                    if domain not in self._domains:
+                        raise NameError(
+                            f'Received command {command!r} that refers to a '
+                            f'nonexistent domain {domain!r} from process '
+                            f'{proc.name!r}')
+                    proc.wait = _TICK
+                    self._tick_waiters.setdefault(domain, []).append(proc)
+                    return
+                elif type(command) is Settle or (
+                        type(command) is Delay and command.interval is None):
+                    proc.wait = _SETTLE
+                    self._settle_waiters.append(proc)
+                    return
+                elif type(command) is Delay:
+                    proc.wait = _DELAY
+                    self._seq += 1
+                    heapq.heappush(self._delay_waiters,
+                        (self._now + command.interval, self._seq, proc))
+                    return
+                elif type(command) is Passive:
+                    proc.passive = True
+                elif type(command) is Active:
+                    proc.passive = False
+                elif command is None:
+                    raise TypeError(
+                        f'Received default command from process {proc.name!r} '
+                        f'that was added with add_process(); did you mean to '
+                        f'add this process with add_sync_process() instead?')
+                else:
+                    raise TypeError(f'Received unsupported command {command!r} '
+                                    f'from process {proc.name!r}')
+            except StopIteration:
+                proc.wait = _DONE
+                proc.passive = True
+                return
+            except Exception as exn:
+                coroutine.throw(exn)
+
+
+class _VCDTracer:
+
+    @staticmethod
+    def timestamp_to_vcd(timestamp):
+        return round(timestamp * 1e10)          # 1/(100 ps)
+
+    def __init__(self, engine, trace_filter, vcd_file, gtkw_file, traces):
+        netlist = engine.netlist
+        names = netlist.names
+        if not trace_filter.selects_all:
+            names = trace_filter.filter_names(names)
+        self.vcd_file = vcd_file
+        self.gtkw_file = gtkw_file
+        self.writer = VCDWriter(vcd_file, timescale='100 ps',
+                                comment='Generated by nmigen_lib fastsim')
+        self.vars = {}
+        self.gtkw_names = SignalDict()
+        self.now = 0.0
+        for (signal, paths) in names.items():
+            index = netlist.index(signal)
+            for (*scope, name) in sorted(paths, key=lambda p: tuple(map(str, p))):
+                scope = [str(s) for s in scope]
+                name = str(name)
+                suffix = 0
+                while True:
+                    var_name = name if not suffix else f'{name}${suffix}'
+                    try:
+                        var = self.writer.register_var(
+                            scope=scope,
+                            name=var_name,
+                            var_type='wire',
+                            size=max(signal.width, 1),
+                            init=engine.v[index] & _mask(signal.width))
+                        break
+                    except KeyError:
+                        suffix += 1
+                self.vars.setdefault(index, []).append((var, signal.width))
+                if signal not in self.gtkw_names:
+                    self.gtkw_names[signal] = '.'.join(scope + [var_name])
+        self.traces = [sig for sig in traces if sig in self.gtkw_names]
+        engine.trace = self.change
+
+    def change(self, index, value):
+        entries = self.vars.get(index)
+        if entries:
+            t = self.timestamp_to_vcd(self.now)
+            for (var, width) in entries:
+                self.writer.change(var, t, value & _mask(width))
+
+    def close(self, timestamp):
+        self.writer.close(self.timestamp_to_vcd(timestamp))
+        if self.gtkw_file is not None:
+            gtkw = GTKWSave(self.gtkw_file)
+            gtkw.dumpfile(self.vcd_file.name)
+            gtkw.treeopen('top')
+            for signal in self.traces:
+                suffix = f'[{len(signal) - 1}:0]' if len(signal) > 1 else ''
+                gtkw.trace(self.gtkw_names[signal] + suffix)
+            self.gtkw_file.close()
+        self.vcd_file.close()
@@ -0,0 +1,175 @@
+import hashlib
+import inspect
+import os
+import sys
+import tempfile
+
+import nmigen
+from nmigen import Array, Elaboratable, Memory, Record, Shape, Signal
+from nmigen.hdl.rec import Layout
+
+"""
+A content-addressed cache for generated RTLIL and Verilog.
+
+`Main` looks up `generate` output here before it elaborates the
+design.  The key is a hash of
+
+  * the source files of the design's class and of every loaded
+    module in the design's package and in `nmigen_lib`,
+
+  * the design's constructor parameters, i.e., the values in its
+    attributes and, recursively, in its submodules' attributes:
+    numbers, strings, shapes, layouts, the shapes and names of
+    signals and records, the size and contents of memories, and
+    tuples, lists, arrays and dicts of them,
+
+  * the platform class, the top module name and the ports,
+
+  * the output language and the nMigen version.
+
+A design with any other kind of value in its attributes, e.g., a
+function, can't be fingerprinted, so it is never cached.  Neither
+is a design that is a bare `Module`.  A design whose output depends
+on something other than its parameters and source code should be
+generated with `--no-cache`.
+
+The cache lives in `$NMIGEN_LIB_CACHE`, or in `nmigen_lib` under
+`$XDG_CACHE_HOME` or `~/.cache`.  It is safe to delete at any time.
+"""
+
+
+def default_cache_dir():
+    cache_dir = os.environ.get('NMIGEN_LIB_CACHE')
+    if cache_dir:
+        return cache_dir
+    xdg_cache = os.environ.get('XDG_CACHE_HOME', '~/.cache')
+    return os.path.join(os.path.expanduser(xdg_cache), 'nmigen_lib')
+
+
+class GenerateCache:
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(),
+                                      'generate')
+
+    def key(self, design, platform, name, ports, generate_type):
+        """Return the cache key for a design, or None if it can't be cached."""
+        if not isinstance(design, Elaboratable) or type(design) is nmigen.Module:
+            return None
+        h = hashlib.sha256()
+        def add(*items):
+            for item in items:
+                h.update(str(item).encode())
+                h.update(b'\0')
+        add('nmigen', getattr(nmigen, '__version__', '?'))
+        add('type', generate_type, 'name', name)
+        add('platform', _qualname(type(platform)))
+        add('ports', *(f'{sig.name}:{sig.shape()}' for sig in ports))
+        params = _params(design)
+        if params is None:
+            return None
+        add('params', *params)
+        for path in source_files(design):
+            with open(path, 'rb') as f:
+                add('source', path)
+                h.update(hashlib.sha256(f.read()).digest())
+        return f'{h.hexdigest()}.{generate_type}'
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.cache_dir, key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, output):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write and rename so that concurrent builds never see a
+        # partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(output)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+
+def source_files(design):
+    """The source files whose contents can affect the design's output."""
+    files = set()
+    for cls in type(design).__mro__:
+        module = sys.modules.get(cls.__module__)
+        if module is None or _is_nmigen(module):
+            continue
+        try:
+            files.add(os.path.abspath(inspect.getsourcefile(cls)))
+        except TypeError:
+            pass                # builtin class
+    packages = {'nmigen_lib', type(design).__module__.split('.')[0]}
+    for (mod_name, module) in list(sys.modules.items()):
+        if mod_name.split('.')[0] not in packages:
+            continue
+        path = getattr(module, '__file__', None)
+        if path and path.endswith('.py'):
+            files.add(os.path.abspath(path))
+    return sorted(files)
+
+def _is_nmigen(module):
+    return module.__name__.split('.')[0] == 'nmigen'
+
+def _qualname(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+def _params(design, active=()):
+    # Return the fingerprints of the design's attributes, or None if
+    # any of them can't be fingerprinted.
+    params = []
+    active += (id(design), )
+    for (name, value) in sorted(vars(design).items()):
+        if name.startswith('_MustUse__'):
+            continue            # nMigen's bookkeeping
+        fp = _fingerprint(value, active)
+        if fp is None:
+            return None
+        params.append(f'{name}={fp}')
+    return params
+
+def _fingerprint(value, active):
+    # Return a stable string describing a value, or None.
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, Shape):
+        return f'Shape({value.width}, {value.signed})'
+    if isinstance(value, Layout):
+        fields = ', '.join(f'{name}:{_fingerprint(shape, active)}:{dir}'
+                           for (name, shape, dir) in value)
+        return f'Layout({fields})'
+    if isinstance(value, Record):
+        return f'Record({_fingerprint(value.layout, active)}, {value.name!r})'
+    if isinstance(value, Signal):
+        shape = _fingerprint(value.shape(), active)
+        return f'Signal({shape}, {value.reset}, {value.name!r})'
+    if isinstance(value, Memory):
+        init = hashlib.sha256(repr(list(value.init)).encode()).hexdigest()
+        return f'Memory({value.width}, {value.depth}, {init}, {value.name!r})'
+    if isinstance(value, Elaboratable):
+        if id(value) in active:
+            return f'cycle({_qualname(type(value))})'
+        params = _params(value, active)
+        if params is None:
+            return None
+        return f'{_qualname(type(value))}({", ".join(params)})'
+    if isinstance(value, (tuple, list, Array)):
+        items = [_fingerprint(item, active) for item in value]
+        if None in items:
+            return None
+        return f'{type(value).__name__}({", ".join(items)})'
+    if isinstance(value, dict):
+        items = [(_fingerprint(k, active), _fingerprint(v, active))
+                 for (k, v) in value.items()]
+        if any(None in item for item in items):
+            return None
+        return f'dict({", ".join(sorted(f"{k}: {v}" for (k, v) in items))})'
+    return None
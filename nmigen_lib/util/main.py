@@ -2,13 +2,21 @@ import argparse
 from collections import namedtuple
 from contextlib import contextmanager
 import inspect
+import math
 import os.path
+import time
 import warnings
 
 from nmigen import *
 from nmigen.hdl.ir import Fragment
 from nmigen.back import rtlil, verilog, pysim
 
+from .checkpoint import CheckpointError, load_checkpoint, save_checkpoint
+from .fastsim import FastSimulator
+from .gencache import GenerateCache
+from .simprofile import SimProfiler
+from .trace import TraceFilter, start_waveform
+
 """
 An enhanced main patterned after nmigen.cli.main.
 
@@ -19,6 +27,12 @@ module.  It has
 
   * By default, <design>.ports is used as the list of ports.
 
+  * Output is cached on disk, keyed by the design's source code and
+    parameters, so regenerating an unchanged design is nearly free.
+    Use `--no-cache` to bypass the cache.  See `gencache.py`.
+    Designs with pipes aren't cached, so their pipe ends are always
+    checked.
+
 `simulate` runs pysim, but with differences:
 
   * By default, <design>.ports is used as the list of ports.
@@ -29,10 +43,48 @@ module.  It has
   * The simulator can easily be extended by adding synchronous
     and asynchronous processes.
 
+  * Stimulus and expected outputs can come from vector files with
+    `sim.stimulus` and `sim.expect`.  See `vectors.py`.
+
   * The simulator will run for either the number of clocks specified
     by the `--clocks=N` argument or until all defined processes
     have finished.
 
+  * Tracing can be turned off with `--no-trace`, or limited with
+    `--trace GLOB`, `--no-trace-signal GLOB` and `--trace-depth N`.
+    Unwanted signals cost nothing to write.  See `trace.py`.
+
+  * `--backend fast` runs the design on a compiled Python
+    simulator instead of pysim.  Testbench processes work
+    unchanged.  See `fastsim.py`.
+
+  * With `--backend fast` and `--clocks`, `--fast-forward` jumps
+    over clocks in which nothing but counters change.  See
+    `fastforward.py`.
+
+  * `--backend cxxrtl` compiles the design to native code with
+    Yosys CXXRTL, for long soak tests.  The build is cached.  See
+    `cxxsim.py`.
+
+  * With `--backend fast`, `--checkpoint FILE --checkpoint-at N`
+    saves the simulation's state after N cycles, and
+    `--restore FILE` resumes from it.  The file holds every value
+    the processes have read so far, so it grows with the run.  See
+    `checkpoint.py`.
+
+  * With `--stats`, a one line summary of sync clock edges run and
+    wall time is printed when the simulation finishes.  The
+    `simulate_all` regression runner uses it.
+
+  * `--profile` prints the wall time, yields and simulated time of
+    each sim process, and how much time was left for the simulator.
+    `--profile-json FILE` writes the same as JSON.  See
+    `simprofile.py`.
+
+Both actions check the design's pipe ends once it is elaborated and
+warn about any that are unconnected or misdirected.  See
+`nmigen_lib/pipe/drc.py`.
+
 If you want the default simulator, instantiate like this.  In this
 case, you must specify the `--clocks=N` argument to simulate.
 
@@ -87,13 +139,17 @@ class SimBuilder:
     def has_clocks(self):
         return bool(self.clocks)
 
-    def build(self, sim):
+    def build(self, sim, profiler=None):
         for clock in self.clocks:
             sim.add_clock(**clock._asdict())
         for proc in self.procs:
+            if profiler:
+                proc = profiler.wrap(proc)
             sim.add_process(proc)
-        for sync_proc in self.sync_procs:
-            sim.add_sync_process(sync_proc.process, domain=sync_proc.domain)
+        for (proc, domain) in self.sync_procs:
+            if profiler:
+                proc = profiler.wrap(proc, f'sync_process({domain})')
+            sim.add_sync_process(proc, domain=domain)
 
     def add_clock(self, period, *,
                   phase=None, domain='sync', if_exists=False):
@@ -111,6 +167,27 @@ class SimBuilder:
         self.sync_procs.append(SimSyncProc(proc, domain))
         return proc
 
+    def stimulus(self, signals, vectors, domain='sync', *, dtype='int64',
+                 **kwargs):
+        """Drive `signals` from a vector file, one row per cycle.
+
+        A raw binary file holds `dtype` integers.  See `vectors.py`.
+        """
+        from .vectors import drive_process
+        self.sync_process(
+            drive_process(signals, vectors, dtype=dtype, **kwargs), domain)
+
+    def expect(self, signals, vectors, domain='sync', *, dtype='int64',
+               **kwargs):
+        """Check `signals` against a vector file, one row per cycle.
+
+        A raw binary file holds `dtype` integers.  See `vectors.py` for
+        the `mask` and `delay` arguments.
+        """
+        from .vectors import check_process
+        self.sync_process(
+            check_process(signals, vectors, dtype=dtype, **kwargs), domain)
+
 
 class Main:
 
@@ -156,7 +233,6 @@ class Main:
 
     def _generate(self):
         args = self.args
-        fragment = Fragment.get(self.design, self.platform)
         generate_type = args.generate_type
         if generate_type is None and args.generate_file:
             if args.generate_file.name.endswith(".v"):
@@ -165,16 +241,48 @@ class Main:
                 generate_type = "il"
         if generate_type is None:
             parser.error("specify file type explicitly with -t")
+        output = self._convert(generate_type)
+        if args.generate_file:
+            args.generate_file.write(output)
+        else:
+            print(output)
+
+    def _convert(self, generate_type, fragment=None):
+        """Return the design as RTLIL ('il') or Verilog ('v') source.
+
+        Output is looked up in the generate cache first unless
+        `--no-cache` was given.  Pass `fragment` if the design has
+        already been elaborated; elaborating it again would connect
+        its pipes twice.
+        """
+        args = self.args
+        cache = key = None
+        # The pipe-end check needs an elaborated design, so designs
+        # with pipes aren't cached.
+        if not getattr(args, 'no_cache', False) and not self._has_pipes():
+            cache = GenerateCache(getattr(args, 'cache_dir', None))
+            key = cache.key(self.design, self.platform,
+                            self.name, self._get_ports(), generate_type)
+        if key is not None:
+            output = cache.load(key)
+            if output is not None:
+                if fragment is None:
+                    # The design is never elaborated.  Don't warn about it.
+                    Elaboratable._Elaboratable__silence = True
+                    Elaboratable._MustUse__silence = True
+                return output
+        if fragment is None:
+            fragment = Fragment.get(self.design, self.platform)
+            self._check_pipes()
         if generate_type == "il":
             output = rtlil.convert(fragment,
                                    name=self.name, ports=self._get_ports())
         if generate_type == "v":
             output = verilog.convert(fragment,
                                      name=self.name, ports=self._get_ports())
-        if args.generate_file:
-            args.generate_file.write(output)
-        else:
-            print(output)
+        if key is not None:
+            cache.store(key, output)
+        return output
 
     def _simulate(self):
         if isinstance(self.design, Module):
@@ -185,16 +293,34 @@ class Main:
             assert TypeError, 'can only simulate Elaboratable or Module'
         args = self.args
         prefix = os.path.splitext(design_file)[0]
-        vcd_file = args.vcd_file or prefix + '.vcd'
-        gtkw_file = args.gtkw_file = prefix + '.gtkw'
-        traces = self._get_ports()
-        with pysim.Simulator(self.design,
-                vcd_file=open(vcd_file, 'w'),
-                gtkw_file=open(gtkw_file, 'w'),
-                traces=traces) as sim:
-            self._sim.build(sim)
+        start_time = time.perf_counter()
+        with self._simulator() as sim:
+            self._check_pipes()
+            profiler = None
+            if args.profile or args.profile_json:
+                profiler = SimProfiler(lambda: self._sim_time(sim))
+            self._sim.build(sim, profiler)
             if not self._sim.has_clocks():
                 sim.add_clock(args.sync_period)
+            if args.fast_forward:
+                if args.backend != 'fast':
+                    exit('main: --fast-forward needs `--backend fast`')
+                if args.sync_clocks is None:
+                    # Skips stop short of the end of the run, so
+                    # there has to be one.
+                    exit('main: --fast-forward needs --clocks')
+                sim.enable_fast_forward()
+            if args.checkpoint or args.restore:
+                self._restore(sim)
+            if not args.no_trace:
+                start_waveform(sim, TraceFilter.from_args(args),
+                    vcd_file=args.vcd_file or open(prefix + '.vcd', 'w'),
+                    gtkw_file=args.gtkw_file or open(prefix + '.gtkw', 'w'),
+                    traces=self._get_ports())
+            if args.checkpoint:
+                sim.run_until(self._sync_period() * args.checkpoint_at,
+                              run_passive=True)
+                save_checkpoint(sim, args.checkpoint)
             if args.sync_clocks:
                 sim.run_until(args.sync_period * args.sync_clocks,
                               run_passive=True)
@@ -203,6 +329,81 @@ class Main:
                     "must provide either a sim process or --clocks"
                 )
                 sim.run()
+        wall_time = time.perf_counter() - start_time
+        if args.stats:
+            print(format_stats(self._sync_edges(sim), wall_time))
+        if args.profile:
+            print(profiler.summary(wall_time, self._sync_period()))
+        if args.profile_json:
+            profiler.write_json(args.profile_json,
+                                wall_time, self._sim_time(sim))
+
+    def _restore(self, sim):
+        """Prepare `sim` for checkpoints and restore it if asked."""
+        args = self.args
+        if not isinstance(sim, FastSimulator) or args.backend != 'fast':
+            exit('main: checkpoints need `--backend fast`')
+        if args.checkpoint and args.checkpoint_at is None:
+            exit('main: --checkpoint needs --checkpoint-at')
+        sim.record_progress()
+        if args.restore:
+            try:
+                load_checkpoint(sim, args.restore)
+            except (CheckpointError, OSError) as e:
+                exit(f'main: {e}')
+
+    def _simulator(self):
+        if self.args.backend == 'fast':
+            return FastSimulator(self.design)
+        if self.args.backend == 'cxxrtl':
+            from .cxxsim import CxxrtlError, CxxrtlSimulator
+            # Elaborate once, for both the RTLIL and the netlist.
+            fragment = Fragment.get(self.design, platform=None)
+            try:
+                return CxxrtlSimulator(fragment,
+                                       self._convert('il', fragment),
+                                       top=self.name)
+            except CxxrtlError as e:
+                exit(f'main: {e}')
+        return pysim.Simulator(self.design)
+
+    def _has_pipes(self):
+        from nmigen_lib.pipe.drc import has_pipe_ends
+        return has_pipe_ends(self.design)
+
+    def _check_pipes(self):
+        # Pipes are connected during elaboration, so this comes after.
+        from nmigen_lib.pipe.drc import warn_pipe_ends
+        warn_pipe_ends(self.design)
+
+    @staticmethod
+    def _sim_time(sim):
+        if isinstance(sim, pysim.Simulator):
+            return sim._state.timestamp
+        return sim.now
+
+    def _sync_period(self):
+        for clock in self._sim.clocks:
+            if clock.domain == 'sync':
+                return clock.period
+        return self.args.sync_period
+
+    def _sync_edges(self, sim):
+        """Count the sync clock's rising edges the simulation has run."""
+        period, phase = self._sync_period(), None
+        for clock in self._sim.clocks:
+            if clock.domain == 'sync':
+                phase = clock.phase
+        if phase is None:
+            phase = period / 2
+        # Edges fall at phase + k * period.  pysim's timestamp is the
+        # time it will run next; fastsim's is the time it ran last.
+        edges = (self._sim_time(sim) - phase) / period
+        if isinstance(sim, pysim.Simulator):
+            count = math.ceil(edges - 1e-6)
+        else:
+            count = math.floor(edges + 1e-6) + 1
+        return max(count, 0)
 
     def _caller_filename(self):
         try:
@@ -230,6 +431,13 @@ class Main:
         p_generate.add_argument("generate_file",
             metavar="FILE", type=argparse.FileType("w"), nargs="?",
             help="write generated code to FILE")
+        p_generate.add_argument("--no-cache",
+            action="store_true",
+            help="always elaborate the design; don't use the cache")
+        p_generate.add_argument("--cache-dir",
+            metavar="DIR",
+            help="cache generated code in DIR "
+                 "(default: $NMIGEN_LIB_CACHE or ~/.cache/nmigen_lib)")
 
         p_simulate = p_action.add_parser(
             "simulate", help="simulate the design")
@@ -239,6 +447,28 @@ class Main:
         p_simulate.add_argument("-w", "--gtkw-file",
             metavar="GTKW-FILE", type=argparse.FileType("w"),
             help="write GTKWave configuration to GTKW-FILE")
+        p_simulate.add_argument("-n", "--no-trace",
+            action="store_true",
+            help="do not write VCD or GTKWave files")
+        p_simulate.add_argument("--trace", dest="trace_include",
+            metavar="GLOB", action="append", default=[],
+            help="trace only signals whose hierarchical name matches GLOB "
+                 "(e.g. 'rx.*'; may be repeated)")
+        p_simulate.add_argument("--no-trace-signal", dest="trace_exclude",
+            metavar="GLOB", action="append", default=[],
+            help="do not trace signals whose hierarchical name matches GLOB "
+                 "(may be repeated)")
+        p_simulate.add_argument("--trace-depth",
+            metavar="DEPTH", type=int,
+            help="trace only signals at most DEPTH submodules below "
+                 "the top")
+        p_simulate.add_argument("-b", "--backend",
+            choices=["pysim", "fast", "cxxrtl"], default="pysim",
+            help="simulate with BACKEND (default: %(default)s)")
+        p_simulate.add_argument("-f", "--fast-forward",
+            action="store_true",
+            help="skip clocks in which only counters change "
+                 "(needs --backend fast and --clocks)")
         p_simulate.add_argument("-p", "--period", dest="sync_period",
             metavar="TIME", type=float, default=1e-6,
             help="set 'sync' clock domain period to TIME "
@@ -246,8 +476,36 @@ class Main:
         p_simulate.add_argument("-c", "--clocks", dest="sync_clocks",
             metavar="COUNT", type=int,
             help="simulate for COUNT 'sync' clock periods")
+        p_simulate.add_argument("--checkpoint",
+            metavar="FILE",
+            help="save the simulation's state to FILE "
+                 "(needs --backend fast; its size grows with the "
+                 "values processes have read)")
+        p_simulate.add_argument("--checkpoint-at",
+            metavar="CYCLE", type=int,
+            help="save the checkpoint after CYCLE 'sync' clock periods")
+        p_simulate.add_argument("--restore",
+            metavar="FILE",
+            help="resume the simulation from the checkpoint in FILE")
+        p_simulate.add_argument("--stats",
+            action="store_true",
+            help="print simulated cycles and wall time when done")
+        p_simulate.add_argument("--profile",
+            action="store_true",
+            help="print the wall time spent in each sim process")
+        p_simulate.add_argument("--profile-json",
+            metavar="JSON-FILE", type=argparse.FileType("w"),
+            help="write sim process profile to JSON-FILE")
 
         return parser
 
 def main(design, platform=None, name='top', ports=()):
     Main(design, platform, name, ports).run()
+
+def format_stats(cycles, wall_time):
+    rate = cycles / wall_time if wall_time else 0
+    return (f'simulated {cycles} cycles in {wall_time:.3f} s '
+            f'({rate:.0f} cycles/s)')
+
+STATS_PATTERN = (r'simulated (?P<cycles>\d+) cycles '
+                 r'in (?P<wall_time>[\d.]+) s')
@@ -0,0 +1,124 @@
+import json
+import time
+
+"""
+Measure where a simulation's wall time goes.
+
+`SimBuilder.build` wraps each testbench process with
+`SimProfiler.wrap` when `Main` is given `--profile` or
+`--profile-json FILE`.  For each process, the profiler records
+
+  * the wall time spent inside the process's generator, including
+    any generators it delegates to with `yield from`,
+
+  * the number of commands it yielded, and
+
+  * the simulated time of its last command.
+
+Whatever wall time is left over was spent in the simulator itself:
+evaluating the design and scheduling.  If that dominates, try a
+faster `--backend`; if a process dominates, its Python is the
+bottleneck.
+"""
+
+
+class ProcessStats:
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind            # 'process' or 'sync_process(<domain>)'
+        self.wall_time = 0.0
+        self.yields = 0
+        self.sim_time = 0.0
+        self.finished = False
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'wall_time': self.wall_time,
+            'yields': self.yields,
+            'sim_time': self.sim_time,
+            'finished': self.finished,
+        }
+
+
+class SimProfiler:
+
+    def __init__(self, sim_time):
+        """`sim_time` is a function that returns the current sim time."""
+        self.sim_time = sim_time
+        self.stats = []
+
+    def wrap(self, process, kind='process'):
+        """Return a generator function that profiles `process`."""
+        stats = ProcessStats(getattr(process, '__qualname__', repr(process)),
+                             kind)
+        self.stats.append(stats)
+        sim_time = self.sim_time
+        clock = time.perf_counter
+
+        def profiled():
+            start = clock()
+            coroutine = process()
+            stats.wall_time += clock() - start
+            response = exception = None
+            while True:
+                start = clock()
+                try:
+                    if exception is None:
+                        command = coroutine.send(response)
+                    else:
+                        command = coroutine.throw(exception)
+                except StopIteration:
+                    stats.finished = True
+                    return
+                finally:
+                    stats.wall_time += clock() - start
+                    stats.sim_time = sim_time()
+                stats.yields += 1
+                try:
+                    response = yield command
+                    exception = None
+                except Exception as e:
+                    # Simulator errors go back to the process.
+                    response, exception = None, e
+        profiled.__qualname__ = stats.name
+        return profiled
+
+    def summary(self, wall_time, period=None):
+        """Format a table of process stats for a run of `wall_time` seconds.
+
+        Simulated times are shown in cycles of `period` if given.
+        """
+        rows = [('process', 'kind', 'wall s', '%', 'yields',
+                 'cycles' if period else 'sim time')]
+        def percent(t):
+            return f'{100 * t / wall_time:.1f}' if wall_time else '-'
+        for s in self.stats:
+            sim_time = (f'{round(s.sim_time / period)}' if period
+                        else f'{s.sim_time:.6g}')
+            rows.append((s.name, s.kind, f'{s.wall_time:.3f}',
+                         percent(s.wall_time), f'{s.yields}', sim_time))
+        simulator_time = self.simulator_time(wall_time)
+        rows.append(('(simulator)', '', f'{simulator_time:.3f}',
+                     percent(simulator_time), '', ''))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for row in rows:
+            cells = [cell.ljust(w) if i < 2 else cell.rjust(w)
+                     for (i, (cell, w)) in enumerate(zip(row, widths))]
+            lines.append('  '.join(cells).rstrip())
+        return '\n'.join(lines)
+
+    def simulator_time(self, wall_time):
+        return max(wall_time - sum(s.wall_time for s in self.stats), 0.0)
+
+    def write_json(self, file, wall_time, sim_time):
+        json.dump({
+            'wall_time': wall_time,
+            'sim_time': sim_time,
+            'simulator_wall_time': self.simulator_time(wall_time),
+            'processes': [s.as_dict() for s in self.stats],
+        }, file, indent=2)
+        file.write('\n')
@@ -0,0 +1,192 @@
+#!/usr/bin/env nmigen
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import fnmatch
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import NamedTuple, Optional
+
+from nmigen_lib.util.main import STATS_PATTERN
+
+"""
+Run every library testbench at once and report the results.
+
+A testbench is any library module whose `__main__` block drives
+`Main(design).sim`.  Each one runs as
+
+    python -m <module> simulate --stats --no-trace
+
+in its own interpreter.  Up to `--jobs` of them run at the same
+time, so the whole regression takes about as long as the slowest
+testbench.  A testbench passes when its process exits with status
+zero before `--timeout` seconds have elapsed.  Waveforms are not
+written unless `--trace` is given.
+
+    $ nmigen -m nmigen_lib.util.simulate_all
+    $ nmigen -m nmigen_lib.util.simulate_all -j 4 -t 60 uart 'pipe.*'
+
+Positional arguments are glob patterns matched against the module
+name relative to `nmigen_lib`.
+"""
+
+PACKAGE = 'nmigen_lib'
+MAIN_GUARD = re.compile(r"^if __name__ == '__main__':", re.MULTILINE)
+TESTBENCH_PATTERN = re.compile(r'^\s*with Main\(.*\)\.sim as ', re.MULTILINE)
+
+
+class SimResult(NamedTuple):
+    module: str
+    status: str             # 'PASS', 'FAIL' or 'TIMEOUT'
+    wall_time: float
+    cycles: Optional[int]
+    output: str
+
+    @property
+    def cycles_per_second(self):
+        if self.cycles is None or not self.wall_time:
+            return None
+        return self.cycles / self.wall_time
+
+
+def repo_root():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return os.path.dirname(os.path.dirname(here))
+
+def find_testbenches(root=None):
+    """Return the sorted module names of all testbenches in the library."""
+    root = root or repo_root()
+    modules = []
+    for (dirpath, dirnames, filenames) in os.walk(os.path.join(root, PACKAGE)):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+        for filename in filenames:
+            if not filename.endswith('.py') or filename == '__init__.py':
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path) as f:
+                source = f.read()
+            guard = MAIN_GUARD.search(source)
+            if not guard or not TESTBENCH_PATTERN.search(source, guard.end()):
+                continue
+            rel = os.path.relpath(path[:-len('.py')], root)
+            modules.append(rel.replace(os.sep, '.'))
+    return sorted(modules)
+
+def select(modules, patterns):
+    if not patterns:
+        return modules
+    prefix = PACKAGE + '.'
+    return [
+        module
+        for module in modules
+        if any(fnmatch.fnmatchcase(module[len(prefix):], pat)
+               for pat in patterns)
+    ]
+
+def run_testbench(module, timeout, sim_args=(), root=None):
+    root = root or repo_root()
+    cmd = [sys.executable, '-m', module, 'simulate', '--stats', *sim_args]
+    start_time = time.perf_counter()
+    try:
+        proc = subprocess.run(cmd,
+                              cwd=root,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              universal_newlines=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired as exc:
+        output = exc.output or ''
+        if isinstance(output, bytes):
+            output = output.decode(errors='replace')
+        wall_time = time.perf_counter() - start_time
+        return SimResult(module, 'TIMEOUT', wall_time, None, output)
+    wall_time = time.perf_counter() - start_time
+    status = 'PASS' if proc.returncode == 0 else 'FAIL'
+    stats = re.search(STATS_PATTERN, proc.stdout)
+    cycles = int(stats.group('cycles')) if stats else None
+    return SimResult(module, status, wall_time, cycles, proc.stdout)
+
+def run_all(modules, jobs=None, timeout=None, sim_args=(), report=None):
+    """Run testbenches concurrently.  Return results in module order.
+
+    Each testbench is a separate process, so a thread per running
+    testbench is enough to keep `jobs` of them busy.
+    """
+    results = {}
+    jobs = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(run_testbench, module, timeout, sim_args)
+            for module in modules
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.module] = result
+            if report:
+                report(result)
+    return [results[module] for module in modules]
+
+def format_result(result):
+    prefix = PACKAGE + '.'
+    name = result.module[len(prefix):]
+    if result.cycles is None:
+        cycles = rate = '-'
+    else:
+        cycles = f'{result.cycles}'
+        rate = f'{result.cycles_per_second:.0f}'
+    return (f'{result.status:<8} {name:<32} {result.wall_time:8.2f} s '
+            f'{cycles:>10} cycles {rate:>10} cycles/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run all library testbenches in parallel')
+    parser.add_argument('patterns',
+        metavar='PATTERN', nargs='*',
+        help='only run modules matching PATTERN (e.g. uart, pipe.*)')
+    parser.add_argument('-j', '--jobs',
+        metavar='N', type=int,
+        help='run N testbenches at once (default: number of CPUs)')
+    parser.add_argument('-t', '--timeout',
+        metavar='SECONDS', type=float, default=300,
+        help='fail any testbench that runs longer than SECONDS '
+             '(default: %(default)s)')
+    parser.add_argument('--trace',
+        action='store_true',
+        help='write .vcd and .gtkw files as usual')
+    parser.add_argument('-l', '--list',
+        action='store_true',
+        help='list the testbenches and exit')
+    parser.add_argument('-v', '--verbose',
+        action='store_true',
+        help='show the output of failing testbenches')
+    args = parser.parse_args()
+
+    modules = select(find_testbenches(), args.patterns)
+    if args.list:
+        print('\n'.join(modules))
+        exit()
+    if not modules:
+        exit('simulate_all: no testbenches match')
+
+    start_time = time.perf_counter()
+    results = run_all(modules,
+                      jobs=args.jobs,
+                      timeout=args.timeout,
+                      sim_args=() if args.trace else ('--no-trace', ),
+                      report=lambda r: print(format_result(r), flush=True))
+    wall_time = time.perf_counter() - start_time
+
+    failures = [r for r in results if r.status != 'PASS']
+    if args.verbose:
+        for result in failures:
+            print()
+            print(f'==== {result.module}: {result.status} ====')
+            print(result.output.rstrip())
+    print()
+    print(f'{len(results) - len(failures)} passed, '
+          f'{len(failures)} failed in {wall_time:.2f} s')
+    exit(1 if failures else 0)
@@ -0,0 +1,87 @@
+from fnmatch import fnmatchcase
+
+from nmigen.hdl.ast import SignalDict
+from nmigen.back import pysim
+
+"""
+Choose which signals get written to a simulation's waveform files.
+
+pysim normally traces every signal in the design.  For long runs,
+writing the VCD file can cost more than simulating the design.  A
+`TraceFilter` limits tracing to the signals you want to look at.
+
+Signals are matched by hierarchical name without the leading "top",
+e.g., `tx.tx_pin` for the `tx_pin` signal in submodule `tx`.  A
+signal's depth is the number of submodules above it, so the
+design's own signals are depth 0.
+
+    TraceFilter()                       # everything
+    TraceFilter(include=['rx.*'])       # signals in submodule rx
+    TraceFilter(exclude=['*dbg*'])      # everything but debug signals
+    TraceFilter(depth=0)                # the top-level module only
+"""
+
+
+class TraceFilter:
+
+    def __init__(self, include=(), exclude=(), depth=None):
+        self.include = tuple(include or ())
+        self.exclude = tuple(exclude or ())
+        self.depth = depth
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.trace_include, args.trace_exclude, args.trace_depth)
+
+    @property
+    def selects_all(self):
+        return not self.include and not self.exclude and self.depth is None
+
+    def accepts(self, path):
+        """True if the signal named `path` should be traced.
+
+        `path` is a pysim hierarchical name: a tuple whose first
+        element is the top module's name and whose last is the
+        signal's name.
+        """
+        if self.depth is not None and len(path) - 2 > self.depth:
+            return False
+        name = '.'.join(map(str, path[1:]))
+        if self.include and not _matches(name, self.include):
+            return False
+        return not _matches(name, self.exclude)
+
+    def filter_names(self, signal_names):
+        """Filter a pysim SignalDict of hierarchical names."""
+        selected = SignalDict()
+        for (signal, names) in signal_names.items():
+            names = {name for name in names if self.accepts(name)}
+            if names:
+                selected[signal] = names
+        return selected
+
+
+def _matches(name, patterns):
+    return any(fnmatchcase(name, pat) for pat in patterns)
+
+def start_waveform(sim, trace_filter, *, vcd_file, gtkw_file=None, traces=()):
+    """Start writing a simulator's selected signals to `vcd_file`.
+
+    Only signals accepted by `trace_filter` are written.  `traces` are
+    the signals to show in GTKWave; those that are not written to the
+    VCD file are dropped.
+    """
+    if not isinstance(sim, pysim.Simulator):
+        # Other backends write their own waveforms.
+        sim.start_waveform(trace_filter, vcd_file=vcd_file,
+                           gtkw_file=gtkw_file, traces=traces)
+        return
+    signal_names = sim._signal_names
+    if not trace_filter.selects_all:
+        signal_names = trace_filter.filter_names(signal_names)
+    traces = [sig for sig in traces if sig in signal_names]
+    writer = pysim._VCDWaveformWriter(signal_names,
+                                      vcd_file=vcd_file,
+                                      gtkw_file=gtkw_file,
+                                      traces=traces)
+    sim._state.start_waveform(writer)
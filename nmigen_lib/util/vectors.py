@@ -0,0 +1,185 @@
+#!/usr/bin/env nmigen
+
+import numpy as np
+
+from nmigen import Cat
+
+"""
+Drive and check a design from vector files.
+
+A vector file holds one row per clock cycle and one column per
+signal.  It can be a NumPy `.npy` file or a raw binary file of
+fixed-size integers, `np.int64` unless another `dtype` is given;
+either way it is memory-mapped and read a chunk of rows at a time,
+so a million-cycle file costs no more memory than a short one.
+NumPy arrays can be used directly, too.
+
+    with Main(design).sim as sim:
+        sim.stimulus([design.a, design.b], 'stimulus.npy')
+        sim.expect([design.product], 'expected.npy',
+                   mask='expected_mask.npy', delay=2)
+
+`stimulus` writes row N's values to its signals on cycle N.
+`expect` compares its signals on cycle N + `delay` against row N.
+A mask has the same shape as the expected values; only the bits
+that are set in the mask are compared, so a zero is a don't-care.
+
+When the expected vectors run out, `expect` raises `AssertionError`
+if any row mismatched.  Its message lists the first mismatches with
+their cycle numbers.
+
+`SignalPacker` reads or writes a list of signals as one value, one
+row of Python ints at a time.  The pipe BFMs use it, too.
+"""
+
+CHUNK_ROWS = 1 << 16
+MAX_REPORTS = 10
+
+
+def open_vectors(source, columns=None, dtype=np.int64):
+    """Return `source` as a two-dimensional array, memory-mapped if a file.
+
+    `source` is an array, a `.npy` file, or a raw binary file of
+    `dtype` integers with `columns` per row.
+    """
+    if isinstance(source, str):
+        if source.endswith('.npy'):
+            array = np.load(source, mmap_mode='r')
+        else:
+            array = np.memmap(source, dtype=dtype, mode='r')
+            if columns is not None:
+                array = array.reshape(-1, columns)
+    else:
+        array = np.asarray(source)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    assert columns is None or array.shape[1] == columns, (
+        f'vectors have {array.shape[1]} columns, expected {columns}')
+    return array
+
+class SignalPacker:
+    """Pack rows of values for `signals` into one value, and unpack it.
+
+    `value` is the signals concatenated, so a process can read or
+    write them all with one `yield`.
+    """
+
+    def __init__(self, signals):
+        self.signals = list(signals)
+        self.widths = [len(signal) for signal in self.signals]
+        self.offsets = np.cumsum([0] + self.widths[:-1]).tolist()
+        self.value = Cat(*self.signals)
+
+    def pack(self, row):
+        return sum((int(v) & ((1 << w) - 1)) << o
+                   for (v, w, o) in zip(row, self.widths, self.offsets))
+
+    def unpack(self, packed):
+        return [(packed >> o) & ((1 << w) - 1)
+                for (w, o) in zip(self.widths, self.offsets)]
+
+
+def _chunks(array, chunk_rows):
+    # Yield rows as lists of Python ints, a chunk at a time.
+    for start in range(0, len(array), chunk_rows):
+        yield from np.asarray(array[start:start + chunk_rows]).tolist()
+
+def drive_process(signals, source, *, dtype=np.int64, chunk_rows=CHUNK_ROWS):
+    """Return a sync process that drives `signals` from `source`.
+
+    A raw binary `source` holds `dtype` integers.
+    """
+    packer = SignalPacker(signals)
+    vectors = open_vectors(source, len(packer.signals), dtype)
+
+    def drive():
+        for row in _chunks(vectors, chunk_rows):
+            yield packer.value.eq(packer.pack(row))
+            yield
+    return drive
+
+def check_process(signals, source, *, mask=None, delay=0, dtype=np.int64,
+                  chunk_rows=CHUNK_ROWS, max_reports=MAX_REPORTS):
+    """Return a sync process that checks `signals` against `source`.
+
+    A raw binary `source` or `mask` holds `dtype` integers.
+    """
+    packer = SignalPacker(signals)
+    signals = packer.signals
+    expected = open_vectors(source, len(signals), dtype)
+    masks = None
+    if mask is not None:
+        masks = open_vectors(mask, len(signals), dtype)
+        assert masks.shape == expected.shape, (
+            f'mask shape {masks.shape} != vector shape {expected.shape}')
+
+    def check():
+        mismatches = 0
+        reports = []
+        for _ in range(delay):
+            yield
+        rows = _chunks(expected, chunk_rows)
+        mask_rows = _chunks(masks, chunk_rows) if masks is not None else None
+        for (n, row) in enumerate(rows):
+            mask_row = next(mask_rows) if mask_rows else None
+            actual = packer.unpack((yield packer.value))
+            for (i, (signal, got, want)) in enumerate(zip(signals, actual, row)):
+                care = (1 << packer.widths[i]) - 1
+                if mask_row is not None:
+                    care &= mask_row[i]
+                if (got ^ want) & care:
+                    mismatches += 1
+                    if mismatches <= max_reports:
+                        reports.append(
+                            f'cycle {n + delay}: {signal.name} = {got:#x}, '
+                            f'expected {want & care:#x} (mask {care:#x})')
+            yield
+        if mismatches:
+            raise AssertionError(f'{mismatches} mismatches in {len(expected)} '
+                                 f'cycles of expected vectors\n'
+                                 + '\n'.join(reports))
+    return check
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    from nmigen_lib.mul import Mul
+    from nmigen_lib.util.main import Main
+
+    design = Mul(signed=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = np.random.default_rng(1)
+        count = 1000
+        a = rng.integers(-1 << 15, 1 << 15, count)
+        b = rng.integers(-1 << 15, 1 << 15, count)
+        stimulus = os.path.join(tmp, 'stimulus.i16')
+        expected = os.path.join(tmp, 'expected.npy')
+        mask = os.path.join(tmp, 'mask.npy')
+        np.stack([a, b], axis=1).astype(np.int16).tofile(stimulus)
+        # The product appears two cycles after its inputs are
+        # written.  Don't care what it is before then.
+        np.save(expected, np.concatenate([[0, 0], a * b]))
+        care = np.full(count + 2, (1 << 32) - 1)
+        care[:2] = 0
+        np.save(mask, care)
+
+        with Main(design).sim as sim:
+            sim.stimulus([design.multiplicand, design.multiplier], stimulus,
+                         dtype=np.int16)
+            sim.expect([design.product], expected, mask=mask)
+
+            # A wrong expectation is caught, with its cycle number.
+            @sim.sync_process
+            def wrong():
+                bad = np.concatenate([[0, 0], a * b])
+                bad[500] += 1
+                check = check_process([design.product], bad, mask=care)
+                try:
+                    yield from check()
+                except AssertionError as e:
+                    assert str(e).startswith('1 mismatches in 1002 cycles')
+                    assert '\ncycle 500: ' in str(e), str(e)
+                else:
+                    assert False, 'mismatch not detected'